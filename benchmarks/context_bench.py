@@ -0,0 +1,51 @@
+import os, time, json, logging
+
+from Pypeline import ProcessNote
+
+NAME = "bench"
+
+# PYPELINE_BENCH_JOBS outputs are produced, and the Start/Finish notes are
+# appended to the PYPELINE_BENCH_RESULTS file (as JSON lines)
+STATE = {
+    "jobs_left": 0,
+    "output_time": None,
+}
+
+
+def setup(hostname, instance, logger = None):
+    STATE["jobs_left"] = int(os.environ.get("PYPELINE_BENCH_JOBS", "0"))
+
+
+def dehydrate():
+    return dict(STATE)
+
+
+def rehydrate(dehydration):
+    STATE.update(dehydration)
+
+
+def run(env = None, logger = None):
+    if STATE["jobs_left"] <= 0:
+        return False
+
+    STATE["jobs_left"] -= 1
+    STATE["output_time"] = time.time()
+    return [STATE["jobs_left"]]
+
+
+def setupstage(stage, logger = None):
+    pass
+
+
+def note(processnote: ProcessNote, **kwargs):
+    results_filepath = os.environ.get("PYPELINE_BENCH_RESULTS")
+    if results_filepath is None or processnote not in [ProcessNote.Start, ProcessNote.Finish]:
+        return
+
+    with open(results_filepath, "a") as fio:
+        fio.write(json.dumps({
+            "note": processnote.value,
+            "time": time.time(),
+            "output_time": STATE["output_time"],
+            "pid": os.getpid(),
+        }) + "\n")
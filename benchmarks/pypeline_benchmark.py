@@ -0,0 +1,371 @@
+"""
+Throughput and latency benchmarks of a Pypeline's service (`entrypoints.main`) and
+worker (`Pypeline.process`) paths, with synthetic contexts and stages. Results are
+emitted as JSON.
+
+    python benchmarks/pypeline_benchmark.py --workers 1 4 --start-methods fork spawn --output results.json
+
+Each configuration runs in a subprocess of its own, so that its peak RSS and start
+method are isolated. The Redis server is either `fake` (an in-process fakeredis TCP
+server, per configuration) or an existing `server`.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import tempfile
+import resource
+import threading
+import subprocess
+import multiprocessing as mp
+from typing import List
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# the stages and keys of each scenario
+SCENARIOS = {
+    "noop": (
+        ["bench_noop"],
+        {"BENCH_NOOP_INP": "bench"}
+    ),
+    "cpu": (
+        ["bench_cpu"],
+        {"BENCH_CPU_INP": "bench", "BENCH_CPU_ARG": "200000"}
+    ),
+    "many": (
+        ["bench_many", "bench_noop"],
+        {"BENCH_MANY_INP": "bench", "BENCH_MANY_ARG": "100", "BENCH_NOOP_INP": "bench_many"}
+    ),
+    "large": (
+        ["bench_large", "bench_noop"],
+        {"BENCH_LARGE_INP": "bench", "BENCH_LARGE_ARG": "16", "BENCH_NOOP_INP": "bench_large"}
+    ),
+    "detached": (
+        ["bench_detached&"],
+        {"BENCH_DETACHED_INP": "bench", "BENCH_DETACHED_ARG": "2"}
+    ),
+}
+
+
+class RedisCommandCounter:
+    """Counts the commands that the Redis clients of this process send."""
+
+    def __init__(self):
+        from redis.connection import AbstractConnection
+
+        self.count = 0
+        self._lock = threading.Lock()
+        # single commands are sent with `send_command`, pipelines are packed together
+        send_command = AbstractConnection.send_command
+        pack_commands = AbstractConnection.pack_commands
+        counter = self
+
+        def counted_send_command(connection, *args, **kwargs):
+            counter.add(1)
+            return send_command(connection, *args, **kwargs)
+
+        def counted_pack_commands(connection, commands):
+            commands = list(commands)
+            counter.add(len(commands))
+            return pack_commands(connection, commands)
+
+        AbstractConnection.send_command = counted_send_command
+        AbstractConnection.pack_commands = counted_pack_commands
+
+    def add(self, count: int):
+        with self._lock:
+            self.count += count
+
+
+def start_fake_redis():
+    import fakeredis
+
+    class NoDelayTcpFakeServer(fakeredis.TcpFakeServer):
+        # as redis-server does, otherwise pipelined replies meet delayed acknowledgements
+        def get_request(self):
+            connection, address = super().get_request()
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return connection, address
+
+    server = NoDelayTcpFakeServer(("127.0.0.1", 0), server_type="redis")
+    # the connections of the service's listener are never closed
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address
+
+
+def peak_rss_mb(who: int) -> float:
+    # ru_maxrss is in kilobytes on Linux, and bytes on macOS
+    maxrss = resource.getrusage(who).ru_maxrss
+    return maxrss / (1024*1024 if sys.platform == "darwin" else 1024)
+
+
+def summarise(values: List[float]) -> dict:
+    if len(values) == 0:
+        return {"count": 0}
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean": sum(values)/len(values),
+        "p50": values[len(values)//2],
+        "p95": values[min(len(values) - 1, int(len(values)*0.95))],
+        "max": values[-1],
+    }
+
+
+def scenario_kv(scenario: str) -> dict:
+    stage_list, kv = SCENARIOS[scenario]
+    return dict(kv, **{"#STAGES": " ".join(stage_list)})
+
+
+def benchmark_service(config: dict) -> dict:
+    """Runs `entrypoints.main` until its context has produced `jobs` outputs."""
+    from Pypeline import entrypoints
+
+    mp.set_start_method(config["start_method"], force=True)
+    counter = RedisCommandCounter()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results_filepath = os.path.join(directory, "notes.jsonl")
+        os.environ["PYPELINE_BENCH_JOBS"] = str(config["jobs"])
+        os.environ["PYPELINE_BENCH_RESULTS"] = results_filepath
+
+        start = time.time()
+        entrypoints.main(
+            0,
+            "bench",
+            kv=[f"{key}={value}" for key, value in scenario_kv(config["scenario"]).items()],
+            redis_hostname=config["redis_hostname"],
+            redis_port=config["redis_port"],
+            workers=config["workers"],
+            queue_limit=config["jobs"],
+            idle_timeout_s=0.1,
+        )
+        wall_s = time.time() - start
+
+        with open(results_filepath) as fio:
+            notes = [json.loads(line) for line in fio]
+
+    starts = [note for note in notes if note["note"] == "Start"]
+    finishes = [note for note in notes if note["note"] == "Finish"]
+    first_output = min(note["output_time"] for note in starts)
+    last_finish = max(note["time"] for note in finishes)
+    return {
+        "jobs_finished": len(finishes),
+        "wall_s": wall_s,
+        "throughput_jobs_per_s": len(finishes)/(last_finish - first_output),
+        # from the context's output to the job's start in a worker
+        "dispatch_latency_s": summarise([note["time"] - note["output_time"] for note in starts]),
+        "service_redis_ops_per_job": counter.count/config["jobs"],
+        "peak_rss_mb": {
+            "service": peak_rss_mb(resource.RUSAGE_SELF),
+            "workers": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        },
+    }
+
+
+def benchmark_worker(config: dict) -> dict:
+    """Calls `Pypeline.process` in this process, as an initialised pool worker would."""
+    import Pypeline
+    from Pypeline import process, initialise_worker, import_module
+    from Pypeline.dataclasses import ServiceIdentifier, JobParameters
+
+    service_id = ServiceIdentifier(socket.gethostname(), 0)
+    initialise_worker(service_id, config["redis_hostname"], config["redis_port"])
+    counter = RedisCommandCounter()
+
+    os.environ["PYPELINE_BENCH_JOBS"] = str(config["jobs"] + 1)
+    context_dict = {}
+    import_module("bench", modulePrefix="context", definition_dict=context_dict)
+    context = context_dict["bench"]
+    context.setup(service_id.hostname, service_id.enumeration)
+
+    kv = scenario_kv(config["scenario"])
+    stage_list = kv.pop("#STAGES").split(" ")
+
+    def run_job(job_id):
+        context_outputs = context.run()
+        job_parameters = JobParameters(
+            job_id=job_id,
+            redis_kvcache=kv,
+            context_name="bench",
+            context_output=context_outputs,
+            context_dehydrated=context.dehydrate(),
+            stage_list=stage_list,
+        )
+        start = time.perf_counter()
+        assert process(service_id.process_identifier(0), job_parameters, config["redis_hostname"], config["redis_port"])
+        return time.perf_counter() - start
+
+    # the first job imports the stages
+    run_job(0)
+    stages = [Pypeline.WORKER_STAGE_DICT[stage_name] for stage_name in stage_list]
+    for stage in stages:
+        stage.RUN_DURATIONS.clear()
+    counter.count = 0
+
+    process_durations = [run_job(job_id) for job_id in range(1, config["jobs"] + 1)]
+    stage_runs = sum(len(stage.RUN_DURATIONS) for stage in stages)
+    stage_duration = sum(sum(stage.RUN_DURATIONS) for stage in stages)
+    return {
+        "process_s": summarise(process_durations),
+        "throughput_jobs_per_s": len(process_durations)/sum(process_durations),
+        "stage_runs_per_job": stage_runs/config["jobs"],
+        # the time of a job that is not spent in the stages' `run()`
+        "framework_overhead_per_stage_run_s": (sum(process_durations) - stage_duration)/stage_runs,
+        "redis_ops_per_job": counter.count/config["jobs"],
+        "peak_rss_mb": {
+            "worker": peak_rss_mb(resource.RUSAGE_SELF),
+        },
+    }
+
+
+def run_one(config: dict) -> dict:
+    sys.path.insert(0, BENCHMARK_DIRECTORY)
+    if config["redis"] == "fake":
+        config["redis_hostname"], config["redis_port"] = start_fake_redis()
+
+    if config["path"] == "service":
+        return benchmark_service(config)
+    return benchmark_worker(config)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the service and worker paths of a Pypeline.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--paths",
+        nargs="+",
+        choices=["service", "worker"],
+        default=["service", "worker"],
+        help="The paths to benchmark.",
+    )
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        choices=list(SCENARIOS.keys()),
+        default=list(SCENARIOS.keys()),
+        help="The synthetic stages to benchmark.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 4],
+        help="The worker counts of the service path.",
+    )
+    parser.add_argument(
+        "--start-methods",
+        nargs="+",
+        choices=["fork", "spawn"],
+        default=["fork", "spawn"],
+        help="The multiprocessing start methods of the service path.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=50,
+        help="The number of jobs of each configuration.",
+    )
+    parser.add_argument(
+        "--redis",
+        choices=["fake", "server"],
+        default="fake",
+        help="Whether to use an in-process fakeredis server or an existing Redis server.",
+    )
+    parser.add_argument(
+        "--redis-hostname",
+        type=str,
+        default="localhost",
+        help="The hostname of the existing Redis server.",
+    )
+    parser.add_argument(
+        "--redis-port",
+        type=int,
+        default=6379,
+        help="The port of the existing Redis server.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="The file to write the JSON results to (otherwise stdout).",
+    )
+    parser.add_argument(
+        "--run-one",
+        type=str,
+        default=None,
+        help=argparse.SUPPRESS,
+    )
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        print(json.dumps(run_one(json.loads(args.run_one))))
+        return
+
+    base_config = {
+        "jobs": args.jobs,
+        "redis": args.redis,
+        "redis_hostname": args.redis_hostname,
+        "redis_port": args.redis_port,
+    }
+    configs = []
+    for scenario in args.scenarios:
+        if "service" in args.paths:
+            configs.extend(
+                dict(base_config, path="service", scenario=scenario, workers=workers, start_method=start_method)
+                for workers in args.workers
+                for start_method in args.start_methods
+            )
+        if "worker" in args.paths:
+            configs.append(dict(base_config, path="worker", scenario=scenario))
+
+    results = []
+    for config in configs:
+        print(f"Benchmarking {config}", file=sys.stderr)
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run-one", json.dumps(config)],
+            capture_output=True,
+            text=True,
+        )
+        result = dict(config)
+        if completed.returncode == 0:
+            result.update(json.loads(completed.stdout.strip().splitlines()[-1]))
+        else:
+            result["error"] = completed.stderr.strip().splitlines()[-1:]
+            print(completed.stderr, file=sys.stderr)
+        results.append(result)
+
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        pypeline_version = version("Pypeline")
+    except PackageNotFoundError:
+        pypeline_version = None
+
+    report = json.dumps(
+        {
+            "meta": {
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "pypeline": pypeline_version,
+            },
+            "results": results,
+        },
+        indent=2
+    )
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, "w") as fio:
+            fio.write(report)
+
+
+if __name__ == "__main__":
+    main_cli()
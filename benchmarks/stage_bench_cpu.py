@@ -0,0 +1,16 @@
+import time
+
+ENV_KEY = None
+ARG_KEY = "BENCH_CPU_ARG"
+INP_KEY = "BENCH_CPU_INP"
+NAME = "bench_cpu"
+
+RUN_DURATIONS = []
+
+def run(argstr, inputs, env, logger = None):
+    start = time.perf_counter()
+    total = 0
+    for i in range(int(argstr)):
+        total += i*i
+    RUN_DURATIONS.append(time.perf_counter() - start)
+    return [total]
@@ -0,0 +1,19 @@
+import sys, time, subprocess
+
+ENV_KEY = None
+ARG_KEY = "BENCH_DETACHED_ARG"
+INP_KEY = "BENCH_DETACHED_INP"
+NAME = "bench_detached&"
+
+POPENED = []
+RUN_DURATIONS = []
+
+def run(argstr, inputs, env, logger = None):
+    global POPENED
+    start = time.perf_counter()
+    POPENED = [
+        subprocess.Popen([sys.executable, "-c", ""])
+        for _ in range(int(argstr))
+    ]
+    RUN_DURATIONS.append(time.perf_counter() - start)
+    return list(inputs)
@@ -0,0 +1,14 @@
+import time
+
+ENV_KEY = None
+ARG_KEY = "BENCH_LARGE_ARG"
+INP_KEY = "BENCH_LARGE_INP"
+NAME = "bench_large"
+
+RUN_DURATIONS = []
+
+def run(argstr, inputs, env, logger = None):
+    start = time.perf_counter()
+    outputs = [bytes(int(argstr)*1024*1024)]
+    RUN_DURATIONS.append(time.perf_counter() - start)
+    return outputs
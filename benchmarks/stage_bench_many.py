@@ -0,0 +1,14 @@
+import time
+
+ENV_KEY = None
+ARG_KEY = "BENCH_MANY_ARG"
+INP_KEY = "BENCH_MANY_INP"
+NAME = "bench_many"
+
+RUN_DURATIONS = []
+
+def run(argstr, inputs, env, logger = None):
+    start = time.perf_counter()
+    outputs = list(range(int(argstr)))
+    RUN_DURATIONS.append(time.perf_counter() - start)
+    return outputs
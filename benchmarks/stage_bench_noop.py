@@ -0,0 +1,14 @@
+import time
+
+ENV_KEY = None
+ARG_KEY = None
+INP_KEY = "BENCH_NOOP_INP"
+NAME = "bench_noop"
+
+RUN_DURATIONS = []
+
+def run(argstr, inputs, env, logger = None):
+    start = time.perf_counter()
+    outputs = list(inputs)
+    RUN_DURATIONS.append(time.perf_counter() - start)
+    return outputs
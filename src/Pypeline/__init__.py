@@ -1,11 +1,30 @@
+import os
 import time
+import asyncio
+import hashlib
 import importlib
+import inspect
 import logging
+import math
+import re
+import resource
 import sys
+import tempfile
+import threading
 import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from types import ModuleType
+from typing import Dict, List, Optional, Tuple
 
 from .redis_interface import RedisServiceInterface
-from .dataclasses import ProcessIdentifier, ServiceIdentifier, JobParameters, ProcessNote, ProcessStatus, ProcessNoteMessage, StageTimestamp, JobEventMessage
+from .shared_output import SharedOutput, forget_inherited_shared_outputs, release_shared_outputs
+from .result_cache import ResultCache
+from .detached_processes import DetachedProcesses
+from .profiling import StageProfiler
+from .deadlines import JobDeadlines
+from .checkpoint import JobCheckpoints
+from .dataclasses import ProcessIdentifier, ServiceIdentifier, JobParameters, JobResult, WorkerEvent, ProcessNote, ProcessStatus, ProcessNoteMessage, StageTimestamp, JobEventMessage, ModuleCacheEntry, StageMode, MessageTransport
 
 
 class StageException(Exception):
@@ -24,17 +43,74 @@ class StageException(Exception):
         )
 
 
+MODULE_CACHE: Dict[str, ModuleCacheEntry] = {}
+
+def _module_source_changed(module: ModuleType) -> bool:
+    """
+    Whether the source file of the module differs from the version last loaded,
+    checking the modification time before the content hash.
+    """
+    entry = MODULE_CACHE.get(module.__name__)
+    if entry is None or entry.filepath is None:
+        return entry is None
+
+    try:
+        mtime = os.stat(entry.filepath).st_mtime
+        if mtime == entry.mtime:
+            return False
+        with open(entry.filepath, "rb") as fio:
+            content_hash = hashlib.sha256(fio.read()).hexdigest()
+    except OSError:
+        # let the reload report the missing file
+        return True
+
+    entry.mtime = mtime
+    return content_hash != entry.content_hash
+
+
+def _record_module_load(module: ModuleType, load_duration_s: float) -> ModuleCacheEntry:
+    filepath = getattr(module, "__file__", None)
+    mtime = None
+    content_hash = None
+    if filepath is not None:
+        mtime = os.stat(filepath).st_mtime
+        with open(filepath, "rb") as fio:
+            content_hash = hashlib.sha256(fio.read()).hexdigest()
+
+    entry = MODULE_CACHE.get(module.__name__)
+    if entry is None:
+        entry = ModuleCacheEntry(module_name=module.__name__)
+        MODULE_CACHE[module.__name__] = entry
+
+    entry.filepath = filepath
+    entry.mtime = mtime
+    entry.content_hash = content_hash
+    entry.load_count += 1
+    entry.load_duration_s = load_duration_s
+    entry.total_load_duration_s += load_duration_s
+    return entry
+
+
 def import_module(
     stagename,
     modulePrefix="stage",
     definition_dict=globals(),
     logger=None
 ):
+    """
+    Imports the `{modulePrefix}_{stagename}` module into the `definition_dict`,
+    reloading it only if its source has changed since it was last loaded.
+    Load durations are recorded in `MODULE_CACHE`.
+    """
     log_debug_func = print if logger is None else logger.debug
     log_error_func = print if logger is None else logger.error
-    if stagename not in definition_dict:  # stagename not in sys.modules:
+    module_name = f"{modulePrefix}_{stagename}"
+    module = definition_dict.get(stagename, sys.modules.get(module_name))
+    if module is None:
         try:
-            definition_dict[stagename] = importlib.import_module(f"{modulePrefix}_{stagename}")
+            checkpoint_time = time.time()
+            module = importlib.import_module(module_name)
+            entry = _record_module_load(module, time.time() - checkpoint_time)
         except ModuleNotFoundError as error:
             log_error_func(
                 f"Could not find {modulePrefix}_{stagename}.py:\n\t" +
@@ -47,12 +123,19 @@ def import_module(
             )
             raise error
 
-        log_debug_func(f"Imported {modulePrefix}_{stagename}.")
+        definition_dict[stagename] = module
+        log_debug_func(f"Imported {modulePrefix}_{stagename} in {entry.load_duration_s:0.3f} s.")
+
+        return True
 
+    if not _module_source_changed(module):
+        definition_dict[stagename] = module
         return True
 
     try:
-        definition_dict[stagename] = importlib.reload(definition_dict[stagename])
+        checkpoint_time = time.time()
+        module = importlib.reload(module)
+        entry = _record_module_load(module, time.time() - checkpoint_time)
     except ModuleNotFoundError:
         log_error_func(
             f"Could not find the {modulePrefix}_{stagename}.py module to reload, keeping existing version:\n\t" +
@@ -65,28 +148,105 @@ def import_module(
         )
         return False
 
-    log_debug_func(f"Reloaded {modulePrefix}_{stagename}.")
+    definition_dict[stagename] = module
+    log_debug_func(f"Reloaded {modulePrefix}_{stagename} in {entry.load_duration_s:0.3f} s (load #{entry.load_count}).")
     return True
 
 
+class InputPermutations:
+    """
+    The permutations of an input template's symbol-values, produced on demand in
+    the order that they are exhausted (the last symbol varying fastest).
+
+    Supports `len()`, indexing and resumption by `iterate(start)`, none of which
+    materialise the permutations.
+    """
+
+    def __init__(self, input_template_symbols: List[str], input_values: Dict[str, list]):
+        self.input_template_symbols = input_template_symbols
+        self.input_values = input_values
+        # a repeated symbol takes the same value at each of its positions
+        self._radix_symbols = list(dict.fromkeys(reversed(input_template_symbols)))
+        self._count = math.prod(
+            len(input_values[symbol])
+            for symbol in self._radix_symbols
+        )
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __repr__(self) -> str:
+        return f"InputPermutations('{' '.join(self.input_template_symbols)}', count={self._count})"
+
+    def _value_indices(self, index: int) -> Dict[str, int]:
+        value_indices = {}
+        for symbol in self._radix_symbols:
+            index, value_indices[symbol] = divmod(index, len(self.input_values[symbol]))
+        return value_indices
+
+    def _permutation(self, value_indices: Dict[str, int]) -> list:
+        inp = []
+        for symbol in self.input_template_symbols:
+            if symbol[0] == "*":
+                inp.extend(self.input_values[symbol][value_indices[symbol]])
+            else:
+                inp.append(self.input_values[symbol][value_indices[symbol]])
+        return inp
+
+    def __getitem__(self, index: int) -> list:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(f"Permutation index out of range: {index}/{self._count}")
+        return self._permutation(self._value_indices(index))
+
+    def __iter__(self):
+        return self.iterate()
+
+    def iterate(self, start: int = 0):
+        """Yields the permutations from the `start` index onwards."""
+        if start >= self._count:
+            return
+        value_indices = self._value_indices(start)
+        for _ in range(start, self._count):
+            yield self._permutation(value_indices)
+
+            for symbol in self._radix_symbols:
+                value_indices[symbol] += 1
+                if value_indices[symbol] < len(self.input_values[symbol]):
+                    break
+                value_indices[symbol] = 0
+
+
+def input_template_symbols(input_template) -> List[str]:
+    '''The symbols of an input template, which may already be tokenised (see `JobPlan`).'''
+    if isinstance(input_template, str):
+        return input_template.split(" ")
+    return list(input_template)
+
+
 def parse_input_template(
     input_template,
     pypeline_outputs,
     pypeline_lastinput,
     logger=None
 ):
+    '''
+    Returns:
+        InputPermutations
+            The (lazily produced) inputs of the template's permutations,
+            or False if a symbol has no values.
+    '''
     log_debug_func = print if logger is None else logger.debug
     log_error_func = print if logger is None else logger.error
 
     if input_template is None:
-        return [[]]
-    ret = []
+        return InputPermutations([], {})
     input_values = {}
-    value_indices = {}
 
     # Gather values for each
-    input_template_symbols = input_template.split(" ")
-    for symbol in input_template_symbols:
+    template_symbols = input_template_symbols(input_template)
+    for symbol in template_symbols:
         # TODO flatten this out (extract flagchar and process uniformly)
         if symbol in pypeline_outputs:
             if len(pypeline_outputs[symbol]) == 0:
@@ -119,42 +279,650 @@ def parse_input_template(
             )
             return False
 
-        value_indices[symbol] = 0
+    return InputPermutations(template_symbols, input_values)
 
-    input_template_symbols_rev = input_template_symbols[::-1]
 
-    fully_permutated = False
+# the keywords of a job's ARGUMENT and ENVIRONMENT values, see `process_unsafe`
+JOB_KEYWORDS = ("hnme", "inst", "beg", "times", "stages")
 
-    while not fully_permutated:
-        inp = []
-        for symbol in input_template_symbols:
-            if symbol[0] == "*":
-                inp.extend(input_values[symbol][value_indices[symbol]])
+
+def _keyword_value(keyvalue) -> str:
+    return (
+        " ".join(map(str, keyvalue))
+        if isinstance(keyvalue, list)
+        else str(keyvalue)
+    )
+
+
+class KeywordTemplate:
+    """
+    A string with `{opener}{keyword}{closer}` placeholders of the given keywords, split
+    up front so that `render` substitutes all of the keywords in a single pass.
+    """
+
+    def __init__(self, string: str, keywords, keyword_opener='$', keyword_closer='$'):
+        self.string = string
+        placeholders = "|".join(
+            re.escape(f"{keyword_opener}{keyword}{keyword_closer}")
+            for keyword in sorted(keywords, key=len, reverse=True)
+        )
+        # the literals are at the even indices, the placeholders at the odd
+        self._parts = re.split(f"({placeholders})", string) if len(placeholders) > 0 else [string]
+        self._keywords = {
+            index: self._parts[index][len(keyword_opener):len(self._parts[index]) - len(keyword_closer)]
+            for index in range(1, len(self._parts), 2)
+        }
+
+    def __repr__(self) -> str:
+        return f"KeywordTemplate({self.string!r})"
+
+    def render(self, keyword_dict) -> str:
+        if len(self._keywords) == 0:
+            return self.string
+        parts = list(self._parts)
+        for index, keyword in self._keywords.items():
+            if keyword in keyword_dict:
+                parts[index] = _keyword_value(keyword_dict[keyword])
+        return "".join(parts)
+
+
+def replace_keywords(keyword_dict, string, keyword_opener='$', keyword_closer='$'):
+    '''Replaces the keywords in the string (or renders the `KeywordTemplate`).'''
+    if not isinstance(string, KeywordTemplate):
+        string = KeywordTemplate(string, keyword_dict.keys(), keyword_opener, keyword_closer)
+    return string.render(keyword_dict)
+
+
+# the event loop (and the pid of the process running it) on which `async def run` stages are driven
+WORKER_EVENT_LOOP: Optional[asyncio.AbstractEventLoop] = None
+WORKER_EVENT_LOOP_PID: Optional[int] = None
+# the concurrency of an async stage's permutations when it does not declare CONCURRENCY
+ASYNC_STAGE_CONCURRENCY = 16
+
+def worker_event_loop() -> asyncio.AbstractEventLoop:
+    '''
+    The process' event loop, running on a daemon thread that is started on first use.
+    '''
+    global WORKER_EVENT_LOOP, WORKER_EVENT_LOOP_PID
+
+    if WORKER_EVENT_LOOP is None or WORKER_EVENT_LOOP_PID != os.getpid():
+        # a loop inherited from a forking parent has no thread running it
+        WORKER_EVENT_LOOP = asyncio.new_event_loop()
+        WORKER_EVENT_LOOP_PID = os.getpid()
+        threading.Thread(
+            target=WORKER_EVENT_LOOP.run_forever,
+            name="pypeline.event_loop",
+            daemon=True
+        ).start()
+    return WORKER_EVENT_LOOP
+
+
+def is_async_stage(stage) -> bool:
+    return inspect.iscoroutinefunction(getattr(stage, "run", None))
+
+
+def _result_cache_key(stage, arg, inp, env, logger) -> Optional[str]:
+    '''
+    The key of the permutation in the worker's result cache, or None if the stage
+    does not declare `CACHEABLE = True` (or there is no result cache).
+    '''
+    module_entry = MODULE_CACHE.get(stage.__name__)
+    if (
+        WORKER_RESULT_CACHE is None
+        or not getattr(stage, "CACHEABLE", False)
+        or module_entry is None
+        or module_entry.content_hash is None
+    ):
+        return None
+
+    try:
+        return ResultCache.key(module_entry.content_hash, stage.__name__, arg, inp, env)
+    except BaseException as err:
+        logger.warning(f"Not caching the results of the permutation: {repr(err)}")
+    return None
+
+
+def _stage_run_deadline(stage):
+    # the deadlines of the worker's job are only reported to (and enforced by) a service
+    if WORKER_JOB_DEADLINES is None:
+        return nullcontext()
+    return WORKER_JOB_DEADLINES.stage_run(stage)
+
+
+def _timed_run(stage, arg, inp, env, logger, profiler: Optional[StageProfiler] = None):
+    '''
+    Runs the stage, unless the worker's result cache holds its outputs for the
+    permutation (for stages that declare `CACHEABLE = True`).
+
+    A coroutine `run()` is driven on the `worker_event_loop`.
+
+    Params:
+        profiler: StageProfiler
+            Profiles the `run()`, if given
+
+    Returns:
+        Tuple[float, float, list, Optional[bool], Optional[StageProfile]]
+            The start and end times, the outputs, whether the result cache was hit
+            (None if it was not consulted) and the profile of the `run()`.
+    '''
+    if is_async_stage(stage):
+        return asyncio.run_coroutine_threadsafe(
+            _timed_run_async(stage, arg, inp, env, logger),
+            worker_event_loop()
+        ).result()
+
+    start = time.time()
+    cache_key = _result_cache_key(stage, arg, inp, env, logger)
+    if cache_key is not None:
+        hit, outputs = WORKER_RESULT_CACHE.get(cache_key)
+        if hit:
+            logger.debug(f"Result cache hit ({cache_key}).")
+            return start, time.time(), outputs, True, None
+
+    stage_profile = None
+    with _stage_run_deadline(stage):
+        if profiler is None:
+            outputs = stage.run(arg, inp, env, logger=logger)
+        else:
+            outputs, stage_profile = profiler.run(lambda: stage.run(arg, inp, env, logger=logger))
+    end = time.time()
+    if cache_key is None:
+        return start, end, outputs, None, stage_profile
+
+    WORKER_RESULT_CACHE.put(cache_key, outputs)
+    return start, end, outputs, False, stage_profile
+
+
+async def _timed_run_async(stage, arg, inp, env, logger, semaphore: Optional[asyncio.Semaphore] = None):
+    '''
+    The coroutine equivalent of `_timed_run`, for stages with an `async def run()`.
+
+    Params:
+        semaphore: asyncio.Semaphore
+            Held while the permutation runs, limiting the stage's concurrency
+    '''
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(1)
+
+    async with semaphore:
+        start = time.time()
+        cache_key = _result_cache_key(stage, arg, inp, env, logger)
+        if cache_key is not None:
+            hit, outputs = WORKER_RESULT_CACHE.get(cache_key)
+            if hit:
+                logger.debug(f"Result cache hit ({cache_key}).")
+                return start, time.time(), outputs, True, None
+
+        with _stage_run_deadline(stage):
+            outputs = await stage.run(arg, inp, env, logger=logger)
+        end = time.time()
+
+    if cache_key is None:
+        return start, end, outputs, None, None
+
+    WORKER_RESULT_CACHE.put(cache_key, outputs)
+    return start, end, outputs, False, None
+
+
+async def _new_semaphore(value: int) -> asyncio.Semaphore:
+    # created on the loop that it is used by (required before Python 3.10)
+    return asyncio.Semaphore(value)
+
+
+def stage_permutations(
+    input_templates,
+    args,
+    env,
+    pypeline_outputs,
+    pypeline_lastinput,
+    keywords,
+    logger=None
+):
+    '''
+    Yields the `(arg, inp, env)` permutations of a stage in the order of the
+    depth-first walk of `process_unsafe` (inputs, then input-templates, then arguments).
+    '''
+    if env is not None:
+        env = replace_keywords(keywords, env)
+
+    for arg in args:
+        if arg is not None:
+            arg = replace_keywords(keywords, arg)
+        for input_template in input_templates:
+            inputs = parse_input_template(
+                input_template, pypeline_outputs, pypeline_lastinput,
+                logger = logger
+            )
+            assert inputs
+            for inp in inputs:
+                yield arg, inp, env
+
+
+def batch_stage(
+    permutations,
+    stage,
+    stage_logger,
+    profiler: Optional[StageProfiler] = None
+):
+    '''
+    Runs every `(arg, inp, env)` permutation of a `BATCH` stage in a single `run()`,
+    which is given the list of the permutations' arguments and that of their inputs
+    (and the stage's environment) and returns the list of each permutation's outputs.
+
+    The duration of the `run()` is apportioned evenly to the permutations, the
+    profile (if any) being that of the first. The result cache is not consulted.
+
+    Returns:
+        List[Tuple[arg, inp, env, concurrent.futures.Future]]
+            The (resolved) future holds the `_timed_run` equivalent of the permutation.
+    '''
+    fanout = [
+        (arg, inp, env, Future())
+        for arg, inp, env in permutations
+    ]
+    args = [arg for arg, _, _, _ in fanout]
+    inps = [inp for _, inp, _, _ in fanout]
+    # the environment is common to the permutations (of which there is at least one)
+    env = fanout[0][2]
+
+    def run():
+        if is_async_stage(stage):
+            return asyncio.run_coroutine_threadsafe(
+                stage.run(args, inps, env, logger=stage_logger),
+                worker_event_loop()
+            ).result()
+        return stage.run(args, inps, env, logger=stage_logger)
+
+    start = time.time()
+    try:
+        stage_profile = None
+        with _stage_run_deadline(stage):
+            if profiler is None:
+                outputs_list = run()
+            else:
+                outputs_list, stage_profile = profiler.run(run)
+        if len(outputs_list) != len(fanout):
+            raise ValueError(f"The batched run() returned {len(outputs_list)} output lists for {len(fanout)} permutations.")
+    except BaseException as err:
+        for _, _, _, future in fanout:
+            future.set_exception(err)
+        return fanout
+    end = time.time()
+
+    duration_s = (end - start)/len(fanout)
+    for index, ((_, _, _, future), outputs) in enumerate(zip(fanout, outputs_list)):
+        future.set_result((
+            start + index*duration_s,
+            start + (index + 1)*duration_s,
+            outputs,
+            None,
+            stage_profile if index == 0 else None
+        ))
+    return fanout
+
+
+def fan_out_stage(
+    stage,
+    input_templates,
+    args,
+    env,
+    pypeline_outputs,
+    pypeline_lastinput,
+    keywords,
+    stage_logger,
+    logger=None,
+    profiler: Optional[StageProfiler] = None
+):
+    '''
+    Submits every input/argument permutation of a stage to a thread pool of
+    `stage.CONCURRENCY` workers, in the order of `stage_permutations`. The
+    permutations of an async stage are instead scheduled on the `worker_event_loop`,
+    with at most `stage.CONCURRENCY` (or `ASYNC_STAGE_CONCURRENCY`) running at once.
+
+    Keywords are replaced with the values at the time of the fan-out.
+
+    The permutations of a `BATCH` stage are instead run at once, see `batch_stage`.
+
+    Returns:
+        List[Tuple[arg, inp, env, concurrent.futures.Future]]
+            The future resolves to the `_timed_run` of the permutation.
+    '''
+    permutations = list(stage_permutations(
+        input_templates, args, env,
+        pypeline_outputs, pypeline_lastinput, keywords,
+        logger=logger
+    ))
+
+    if getattr(stage, "BATCH", False):
+        return batch_stage(permutations, stage, stage_logger, profiler=profiler)
+
+    if is_async_stage(stage):
+        loop = worker_event_loop()
+        semaphore = asyncio.run_coroutine_threadsafe(
+            _new_semaphore(getattr(stage, "CONCURRENCY", ASYNC_STAGE_CONCURRENCY)),
+            loop
+        ).result()
+        return [
+            (arg, inp, env, asyncio.run_coroutine_threadsafe(
+                _timed_run_async(stage, arg, inp, env, stage_logger, semaphore=semaphore),
+                loop
+            ))
+            for arg, inp, env in permutations
+        ]
+
+    executor = ThreadPoolExecutor(max_workers=stage.CONCURRENCY)
+    fanout = [
+        (arg, inp, env, executor.submit(_timed_run, stage, arg, inp, env, stage_logger, profiler))
+        for arg, inp, env in permutations
+    ]
+    # the submitted permutations still run
+    executor.shutdown(wait=False)
+    return fanout
+
+
+def stage_fans_out(stage, stage_name: str) -> bool:
+    '''
+    Whether the stage's permutations are run concurrently or together (see `fan_out_stage`):
+    those of async stages, `BATCH` stages and stages with a `CONCURRENCY` greater than 1,
+    excepting detached (`&`) stages.
+    '''
+    return (
+        stage_name[-1] != "&"
+        and (
+            is_async_stage(stage)
+            or getattr(stage, "BATCH", False)
+            or getattr(stage, "CONCURRENCY", 1) > 1
+        )
+    )
+
+
+def _module_load_count(module: ModuleType) -> int:
+    entry = MODULE_CACHE.get(module.__name__)
+    return 0 if entry is None else entry.load_count
+
+
+class JobPlan:
+    """
+    The parts of a job that are common to all jobs with the same `#STAGES` and values of
+    the stages' keys, compiled once and reused (see `JobPlan.for_job`):
+        - the stage modules
+        - the input-templates of each stage, tokenised
+        - the arguments and environment of each stage, as `KeywordTemplate`s
+        - the stages' ENV, INP and ARG keys, with their values
+    """
+
+    def __init__(
+        self,
+        stage_list: List[str],
+        redis_kvcache: Dict[str, str],
+        stage_dict: Dict[str, ModuleType]
+    ):
+        self.stages = {
+            stage_name: stage_dict[stage_name]
+            for stage_name in stage_list
+        }
+        # modules are reloaded in place, so their loads are compared
+        self.stage_loads = {
+            stage_name: _module_load_count(stage)
+            for stage_name, stage in self.stages.items()
+        }
+        self.stage_keys = [
+            getattr(stage, proc_key)
+            for stage in self.stages.values()
+            for proc_key in ["ENV_KEY", "INP_KEY", "ARG_KEY"]
+            if getattr(stage, proc_key, None) is not None
+        ]
+        self.key_values = {
+            key: redis_kvcache.get(key)
+            for key in self.stage_keys
+        }
+        self.input_templates: Dict[str, List[Optional[tuple]]] = {}
+        self.args: Dict[str, List[Optional[KeywordTemplate]]] = {}
+        self.envvars: Dict[str, Optional[KeywordTemplate]] = {}
+
+        for stage_name, stage in self.stages.items():
+            ## INP
+            if stage.INP_KEY is not None:
+                self.input_templates[stage_name] = [
+                    tuple(input_template.split(" "))
+                    for input_template in redis_kvcache[stage.INP_KEY].split(';')
+                ]
+            else:
+                self.input_templates[stage_name] = [None]
+
+            ## ARG
+            if stage.ARG_KEY is not None:
+                self.args[stage_name] = [
+                    KeywordTemplate(arg, JOB_KEYWORDS)
+                    for arg in redis_kvcache[stage.ARG_KEY].split(';')
+                ]
             else:
-                inp.append(input_values[symbol][value_indices[symbol]])
-        ret.append(inp)
+                self.args[stage_name] = [None]
 
-        for i, symbol in enumerate(input_template_symbols_rev):
-            value_indices[symbol] += 1
-            if value_indices[symbol] == len(input_values[symbol]):
-                value_indices[symbol] = 0
-                if i + 1 == len(input_template_symbols_rev):
-                    fully_permutated = True
+            ## ENV
+            if stage.ENV_KEY is not None:
+                self.envvars[stage_name] = KeywordTemplate(redis_kvcache[stage.ENV_KEY], JOB_KEYWORDS)
             else:
-                break
+                self.envvars[stage_name] = None
+
+    def matches(self, redis_kvcache: Dict[str, str], stage_dict: Dict[str, ModuleType]) -> bool:
+        """Whether the plan holds for the stage modules (which may have been reloaded) and key-values."""
+        return (
+            all(
+                stage_dict.get(stage_name) is stage
+                and _module_load_count(stage) == self.stage_loads[stage_name]
+                for stage_name, stage in self.stages.items()
+            )
+            and all(
+                redis_kvcache.get(key) == value
+                for key, value in self.key_values.items()
+            )
+        )
+
+    @staticmethod
+    def for_job(
+        job_parameters: JobParameters,
+        stage_dict: Dict[str, ModuleType],
+        logger: logging.Logger
+    ) -> "JobPlan":
+        '''
+        Imports (or reloads the changed) stages of the job, returning the cached plan
+        of its `stage_list` unless a stage or the value of one of their keys changed.
+        '''
+        for stage_name in job_parameters.stage_list:
+            try:
+                import_module(
+                    stage_name,
+                    definition_dict=stage_dict,
+                    logger=logger
+                )
+            except BaseException as error:
+                raise RuntimeError(f"Could not load stage: {stage_name}") from error
 
-    return ret
+        plan_key = tuple(job_parameters.stage_list)
+        job_plan = JOB_PLANS.get(plan_key)
+        if job_plan is None or not job_plan.matches(job_parameters.redis_kvcache, stage_dict):
+            job_plan = JobPlan(job_parameters.stage_list, job_parameters.redis_kvcache, stage_dict)
+            JOB_PLANS[plan_key] = job_plan
+            logger.debug(f"Compiled the plan of stages {job_parameters.stage_list}.")
+        return job_plan
 
 
-def replace_keywords(keyword_dict, string, keyword_opener='$', keyword_closer='$'):
-    for keyword, keyvalue in keyword_dict.items():
-        keyword_value = (
-            " ".join(map(str, keyvalue))
-            if isinstance(keyvalue, list)
-            else str(keyvalue)
+# the latest plan of each stage list
+JOB_PLANS: Dict[tuple, JobPlan] = {}
+
+
+def load_stage_parameters(
+    job_parameters: JobParameters,
+    stage_dict: dict,
+    logger: logging.Logger
+):
+    '''
+    Imports each stage of the job and loads the values of its INP, ARG and ENV keys,
+    from the job's (cached) `JobPlan`.
+
+    Returns:
+        Tuple[Dict[str, List[tuple]], Dict[str, List[KeywordTemplate]], Dict[str, KeywordTemplate]]
+            The (tokenised) input-templates, arguments and environment of each stage.
+    '''
+    job_plan = JobPlan.for_job(job_parameters, stage_dict, logger)
+    return job_plan.input_templates, job_plan.args, job_plan.envvars
+
+
+def _result_cache_counts(status: Optional[ProcessStatus]) -> dict:
+    if WORKER_RESULT_CACHE is None or status is None:
+        return {}
+    return {
+        "result_cache_hits": status.result_cache_hits,
+        "result_cache_misses": status.result_cache_misses,
+    }
+
+
+def note_process(
+    process_note: ProcessNote,
+    identifier: ProcessIdentifier,
+    job_parameters: JobParameters,
+    redis_interface: RedisServiceInterface,
+    logger: logging.Logger,
+    context,
+    stage_name: Optional[str] = None,
+    status: Optional[ProcessStatus] = None
+):
+    if hasattr(context, "note"):
+        context.note(
+            process_note,
+            process_id = identifier,
+            redis_kvcache = job_parameters.redis_kvcache,
+            logger = logger,
+        )
+
+    redis_interface.process_note_message = ProcessNoteMessage(
+        job_id=job_parameters.job_id,
+        process_note=process_note,
+        process_id=identifier.process_enumeration,
+        stage_name=stage_name,
+        error_message=None,
+        **_result_cache_counts(status),
+    )
+
+
+def run_stage_permutation(
+    identifier: ProcessIdentifier,
+    job_parameters: JobParameters,
+    redis_interface: RedisServiceInterface,
+    logger: logging.Logger,
+    context,
+    stage,
+    stage_name: str,
+    status: ProcessStatus,
+    keywords: dict,
+    arg,
+    inp,
+    env,
+    stage_future: Optional[Future] = None,
+    lock = None,
+    profiler: Optional[StageProfiler] = None
+):
+    '''
+    Runs a permutation of a stage (or collects the result of its fanned-out run),
+    publishing the stage's notes and updating the process status around it.
+
+    Params:
+        stage_future: Future
+            The fanned-out run of the permutation, see `fan_out_stage`
+        lock:
+            Held while the context, status and keywords are touched, when
+            permutations run on multiple threads
+        profiler: StageProfiler
+            Profiles the `run()`, with the profile summarised in the 'Stage Finish' note
+
+    Returns:
+        list
+            The outputs of the stage's `run()`
+    '''
+    if lock is None:
+        lock = nullcontext()
+    stage_logger = logging.getLogger(f"{identifier}.{stage_name}")
+
+    with lock:
+        if hasattr(context, "note"):
+            context.note(
+                ProcessNote.StageStart,
+                process_id = identifier,
+                redis_kvcache = job_parameters.redis_kvcache,
+                logger = logger,
+                stage = stage,
+                argvalue = arg,
+                inpvalue = inp,
+                envvalue = env,
+            )
+        redis_interface.process_note_message = ProcessNoteMessage(
+            job_id=job_parameters.job_id,
+            process_note=ProcessNote.StageStart,
+            process_id=identifier.process_enumeration,
+            stage_name=stage_name,
+            error_message=None,
+        )
+        stage_timestamp = StageTimestamp(
+            name=stage_name,
+            start=time.time(),
+            end=None
         )
-        string = string.replace(f"{keyword_opener}{keyword}{keyword_closer}", keyword_value)
-    return string
+        status.stage_timestamps.append(stage_timestamp)
+        redis_interface.process_status = status
+
+    try:
+        if stage_future is not None:
+            checkpoint_time, end_time, stage_output, cache_hit, stage_profile = stage_future.result()
+        else:
+            checkpoint_time, end_time, stage_output, cache_hit, stage_profile = _timed_run(stage, arg, inp, env, stage_logger, profiler)
+        stage_timestamp.start = checkpoint_time
+    except BaseException as err:
+        with lock:
+            if hasattr(context, "note"):
+                context.note(
+                    ProcessNote.StageError,
+                    process_id = identifier,
+                    redis_kvcache = job_parameters.redis_kvcache,
+                    logger = logger,
+                    stage = stage,
+                    error = err
+                )
+        raise StageException(stage_name, err) #TODO ensure this is the neatest error stack possible
+
+    with lock:
+        keywords["times"].append(end_time - checkpoint_time)
+        keywords["stages"].append(stage_name)
+        stage_timestamp.end = end_time
+        if cache_hit is not None:
+            status.result_cache_hits += int(cache_hit)
+            status.result_cache_misses += int(not cache_hit)
+        redis_interface.process_status = status
+
+        if hasattr(context, "note"):
+            context.note(
+                ProcessNote.StageFinish,
+                process_id = identifier,
+                redis_kvcache = job_parameters.redis_kvcache,
+                logger = logger,
+                stage = stage,
+                output = stage_output
+            )
+        redis_interface.process_note_message = ProcessNoteMessage(
+            job_id=job_parameters.job_id,
+            process_note=ProcessNote.StageFinish,
+            process_id=identifier.process_enumeration,
+            stage_name=stage_name,
+            error_message=None,
+            stage_profile=stage_profile,
+            **_result_cache_counts(status),
+        )
+        redis_interface.process_status = status
+
+    if stage_profile is not None:
+        logger.info(f"Profiled {stage_name} ({stage_profile.duration_s:0.3f} s) to {stage_profile.filepath}:\n" + "\n".join(stage_profile.top_functions))
+
+    return stage_output
 
 
 def get_proc_dict_progress_str(proc,
@@ -178,17 +946,28 @@ def get_stage_keys(
     definition_dict = None,
     logger=None
 ):
+    '''
+    The ENV, INP and ARG keys of the stages, cached per stage list until one of its
+    stages is reloaded (as is the `JobPlan` of the workers).
+    '''
     if definition_dict is None:
         definition_dict = {}
 
-    # clear unused redis-hash keys
-    rediskeys_in_use = []
+    stage_loads = {}
     for stage_name in stage_list_in_use:
-
         if stage_name == "skip":
             break
-        if stage_name not in definition_dict:
-            import_module(stage_name, definition_dict=definition_dict, logger=logger)
+        # reloads the stage if it has changed
+        import_module(stage_name, definition_dict=definition_dict, logger=logger)
+        stage_loads[stage_name] = _module_load_count(definition_dict[stage_name])
+
+    cache_key = tuple(stage_loads)
+    cached = STAGE_KEYS.get(cache_key)
+    if cached is not None and cached[0] == stage_loads:
+        return list(cached[1])
+
+    rediskeys_in_use = []
+    for stage_name in stage_loads:
         stage = definition_dict[stage_name]
 
         for proc_key in [
@@ -202,7 +981,208 @@ def get_stage_keys(
             if attr is not None:
                 rediskeys_in_use.append(attr)
 
-    return rediskeys_in_use
+    STAGE_KEYS[cache_key] = (stage_loads, rediskeys_in_use)
+    return list(rediskeys_in_use)
+
+# the stage keys of each stage list, and the loads of its stages that they hold for
+STAGE_KEYS: Dict[tuple, tuple] = {}
+
+WORKER_REDIS_INTERFACE: Optional[RedisServiceInterface] = None
+WORKER_STAGE_DICT: Dict[str, ModuleType] = {}
+WORKER_RESULT_CACHE: Optional[ResultCache] = None
+WORKER_PROFILE_DIRECTORY: Optional[str] = None
+WORKER_MAX_JOBS: Optional[int] = None
+WORKER_MAX_RSS_BYTES: Optional[int] = None
+WORKER_JOB_COUNT = 0
+# receives the worker's readiness, the deadlines of its jobs (see `JobDeadlines`) and its retirement
+WORKER_EVENT_QUEUE = None
+# the ID of the job that each of the service's slots runs (0 if none), see `_report_worker_event`
+WORKER_RUNNING_JOBS = None
+WORKER_JOB_DEADLINES: Optional[JobDeadlines] = None
+WORKER_CHECKPOINTS: Optional[JobCheckpoints] = None
+
+def _report_worker_event(
+    identifier: ProcessIdentifier,
+    job_id: int,
+    worker_event: WorkerEvent,
+    payload = None,
+    running: Optional[bool] = None
+):
+    '''
+    Reports the event of the worker's job on the WORKER_EVENT_QUEUE, and marks
+    whether the job is `running` in the WORKER_RUNNING_JOBS, if given.
+
+    The service only terminates a worker while holding the lock of the WORKER_RUNNING_JOBS
+    and while its slot is marked as running the job (see `ServiceScheduler._terminate`),
+    so a worker is not terminated once its job has ended, nor while it holds the lock of the
+    WORKER_EVENT_QUEUE.
+    '''
+    with WORKER_RUNNING_JOBS.get_lock() if WORKER_RUNNING_JOBS is not None else nullcontext():
+        if WORKER_RUNNING_JOBS is not None and running is not None:
+            WORKER_RUNNING_JOBS[identifier.process_enumeration] = job_id if running else 0
+        if WORKER_EVENT_QUEUE is not None:
+            WORKER_EVENT_QUEUE.put((os.getpid(), identifier.process_enumeration, job_id, worker_event, payload))
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux, and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss*1024
+
+def _worker_retirement(logger: logging.Logger) -> Tuple[Optional[str], bool]:
+    '''
+    Counts a job of the worker.
+
+    Returns:
+        str
+            Why the worker retires after the job, if it has crossed one of its limits.
+        bool
+            Whether the worker must exit by itself, rather than after the pool's
+            `maxtasksperchild` (the job count limit).
+    '''
+    global WORKER_JOB_COUNT
+    WORKER_JOB_COUNT += 1
+    if WORKER_MAX_JOBS is not None and WORKER_JOB_COUNT >= WORKER_MAX_JOBS:
+        reason = f"{WORKER_JOB_COUNT} job(s)"
+        exits = False
+    elif WORKER_MAX_RSS_BYTES is not None and peak_rss_bytes() >= WORKER_MAX_RSS_BYTES:
+        reason = f"a peak RSS of {peak_rss_bytes()/(1024*1024):0.1f} MB"
+        exits = True
+    else:
+        return None, False
+
+    logger.info(f"Retiring worker {os.getpid()} after {reason}.")
+    return reason, exits
+
+def warm_worker(
+    context_name: Optional[str],
+    stage_list: List[str],
+    definition_dict: Dict[str, ModuleType],
+    logger: logging.Logger
+):
+    '''
+    Imports the context and stages into the `definition_dict`, along with the modules
+    that each stage lists in its optional `PREWARM_IMPORTS`, so that the first job of
+    a worker does not pay for them. Failures are logged and left to that job.
+    '''
+    start = time.time()
+    if context_name is not None:
+        try:
+            import_module(context_name, modulePrefix="context", definition_dict=definition_dict, logger=logger)
+        except BaseException as err:
+            logger.warning(f"Could not pre-import context {context_name}: {repr(err)}")
+
+    for stage_name in stage_list:
+        if stage_name == "skip":
+            break
+        try:
+            import_module(stage_name, definition_dict=definition_dict, logger=logger)
+            for module_name in getattr(definition_dict[stage_name], "PREWARM_IMPORTS", []):
+                importlib.import_module(module_name)
+        except BaseException as err:
+            logger.warning(f"Could not pre-import stage {stage_name}: {repr(err)}")
+    logger.debug(f"Warmed worker {os.getpid()} in {time.time() - start:0.3f} s.")
+
+def initialise_worker(
+    service_id: ServiceIdentifier,
+    redis_hostname: str,
+    redis_port: int,
+    result_cache: Optional[ResultCache] = None,
+    profile_directory: Optional[str] = None,
+    message_transport: MessageTransport = MessageTransport.PubSub,
+    stream_maxlen: int = 10000,
+    event_queue = None,
+    running_jobs = None,
+    max_jobs: Optional[int] = None,
+    max_rss_mb: Optional[float] = None,
+    checkpoint_directory: Optional[str] = None
+):
+    '''
+    The initializer of a service's pool workers, creating the state that `process`
+    reuses across the jobs of the worker.
+
+    Params:
+        service_id: ServiceIdentifier,
+            The identifier of the service that pools the worker
+        redis_hostname: str
+        redis_port: int
+        result_cache: ResultCache
+            The cache of the results of `CACHEABLE` stages, if any
+        profile_directory: str
+            The directory that the profiles of stages (per #PROFILE) are written to
+        message_transport: MessageTransport
+            Whether the 'jobs' and 'notes' messages are published or added to streams
+        stream_maxlen: int
+            The approximate length that the streams are capped at
+        event_queue: multiprocessing.SimpleQueue
+            Receives the `(pid, process_id, job_id, WorkerEvent, payload)` events of the
+            worker, if given: `Warmed` (without a job) once it has imported the service's
+            current #CONTEXT and #STAGES (see `warm_worker`), or `Failed` (with the error)
+            if the worker could not be initialised, the `Deadline`s of each job
+            (see `JobDeadlines`), `Ended` once a job has ended and `Retired` with the
+            `JobResult` of the job after which it exits
+        running_jobs: multiprocessing.Array
+            The ID of the job that each slot of the service runs, which the worker
+            marks (see `_report_worker_event`), if given
+        max_jobs: int
+            The job count after which the worker retires, which must also be the
+            pool's `maxtasksperchild` (that exits the worker)
+        max_rss_mb: float
+            The peak RSS after which the worker retires, exiting by itself once it has
+            reported the `JobResult` of its job on the `event_queue` (which it requires)
+        checkpoint_directory: str
+            The directory that the jobs are checkpointed in (see `JobCheckpoints`), if any
+    '''
+    global WORKER_REDIS_INTERFACE, WORKER_STAGE_DICT, WORKER_RESULT_CACHE, WORKER_PROFILE_DIRECTORY
+    global WORKER_MAX_JOBS, WORKER_MAX_RSS_BYTES, WORKER_JOB_COUNT, WORKER_EVENT_QUEUE
+    global WORKER_RUNNING_JOBS, WORKER_CHECKPOINTS
+
+    logger = logging.getLogger(str(service_id))
+    try:
+        # workers only publish and set, so there is no need for the '/set' subscription
+        WORKER_REDIS_INTERFACE = RedisServiceInterface(
+            service_id,
+            subscribe_broadcast=False,
+            host=redis_hostname,
+            port=redis_port,
+            message_transport=message_transport,
+            stream_maxlen=stream_maxlen,
+        )
+        WORKER_STAGE_DICT = {}
+        WORKER_RESULT_CACHE = result_cache
+        WORKER_PROFILE_DIRECTORY = profile_directory
+        WORKER_MAX_JOBS = max_jobs
+        WORKER_MAX_RSS_BYTES = None if max_rss_mb is None or event_queue is None else int(max_rss_mb*1024*1024)
+        WORKER_JOB_COUNT = 0
+        WORKER_EVENT_QUEUE = event_queue
+        WORKER_RUNNING_JOBS = running_jobs
+        # the service's, which it releases
+        forget_inherited_shared_outputs()
+        WORKER_CHECKPOINTS = (
+            None
+            if checkpoint_directory is None
+            else JobCheckpoints(checkpoint_directory, service_id, logger=logger)
+        )
+    except BaseException as err:
+        # the worker exits (and the pool replaces it), which the service must not await the warming of
+        logger.error(f"Could not initialise worker {os.getpid()}: {repr(err)}")
+        if event_queue is not None:
+            event_queue.put((os.getpid(), None, None, WorkerEvent.Failed, repr(err)))
+        raise
+
+    try:
+        # those of the service now, rather than when the pool was created (workers are replaced)
+        stages_keyvalue = WORKER_REDIS_INTERFACE.get("#STAGES")
+        warm_worker(
+            WORKER_REDIS_INTERFACE.get("#CONTEXT"),
+            stages_keyvalue.split(" ") if stages_keyvalue is not None else [],
+            WORKER_STAGE_DICT,
+            logger
+        )
+    except BaseException as err:
+        logger.warning(f"Could not warm worker {os.getpid()}: {repr(err)}")
+    finally:
+        if WORKER_EVENT_QUEUE is not None:
+            WORKER_EVENT_QUEUE.put((os.getpid(), None, None, WorkerEvent.Warmed, None))
 
 def process(
     identifier: ProcessIdentifier,
@@ -212,6 +1192,22 @@ def process(
 ):
     '''
     This function wraps `process_unsafe` in a try-except block, handling any exceptions.
+    See `process_job`.
+
+    Returns:
+        bool
+            Whether an exception was raised or not.
+    '''
+    return process_job(identifier, job_parameters, redis_hostname, redis_port).successful
+
+def process_job(
+    identifier: ProcessIdentifier,
+    job_parameters: JobParameters,
+    redis_hostname: str,
+    redis_port: int
+) -> JobResult:
+    '''
+    This function wraps `process_unsafe` in a try-except block, handling any exceptions.
 
     Params:
         identifier: Identifier,
@@ -222,24 +1218,55 @@ def process(
         redis_port: int
     
         Logs with `logging.getLogger(str(identifier))`
+
+        The Redis connection and imported modules of a worker initialised with
+        `initialise_worker` are reused, otherwise they are created for the job.
     
     Returns:
-        bool
-            Whether an exception was raised or not.
+        JobResult
+            Whether an exception was raised or not, the final process status and
+            whether the worker retires after the job.
     '''
+    global WORKER_JOB_DEADLINES
     logger = logging.getLogger(str(identifier))
-    
-    redis_interface = RedisServiceInterface(
-        ServiceIdentifier(identifier.hostname, identifier.enumeration),
-        host=redis_hostname,
-        port=redis_port,
+    status = ProcessStatus(
+        job_id=job_parameters.job_id,
+        process_id=identifier.process_enumeration,
+        stage_timestamps=[]
     )
+    
+    if WORKER_REDIS_INTERFACE is not None:
+        redis_interface = WORKER_REDIS_INTERFACE
+        stage_dict = WORKER_STAGE_DICT
+    else:
+        redis_interface = RedisServiceInterface(
+            ServiceIdentifier(identifier.hostname, identifier.enumeration),
+            subscribe_broadcast=False,
+            host=redis_hostname,
+            port=redis_port,
+        )
+        stage_dict = {}
 
-    stage_dict = {}
+    # reloads the context if it has changed, as for the stages
     import_module(job_parameters.context_name, modulePrefix="context", definition_dict=stage_dict, logger=logger)
+    if WORKER_EVENT_QUEUE is not None:
+        # the deadlines are first reported as the job is marked as running
+        WORKER_JOB_DEADLINES = JobDeadlines(
+            job_parameters,
+            lambda deadline, cause: _report_worker_event(
+                identifier,
+                job_parameters.job_id,
+                WorkerEvent.Deadline,
+                None if deadline is None else (deadline, cause),
+                running=True
+            )
+        )
+
+    job_result = JobResult(successful=False, status=status)
+    interrupted = False
     try:
-        process_unsafe(identifier, job_parameters, redis_interface, logger, stage_dict)
-        return True
+        process_unsafe(identifier, job_parameters, redis_interface, logger, stage_dict, status=status)
+        job_result.successful = True
     except StageException as err:
         logger.error(f"StageException: {err}")
         logger.debug(f"Traceback: {traceback.format_exc()}")
@@ -253,6 +1280,8 @@ def process(
     except BaseException as err:
         logger.error(f"{err}")
         logger.debug(f"Traceback: {traceback.format_exc()}")
+        # the job of an interrupted service is resumed from its checkpoint
+        interrupted = isinstance(err, (KeyboardInterrupt, SystemExit))
 
         process_context = stage_dict[job_parameters.context_name]
         if hasattr(process_context, "note"):
@@ -270,14 +1299,30 @@ def process(
             stage_name=None,
             error_message=traceback.format_exc()
         )
-    return False
+    finally:
+        if WORKER_EVENT_QUEUE is not None:
+            # the service no longer terminates the worker for the job
+            _report_worker_event(identifier, job_parameters.job_id, WorkerEvent.Ended, running=False)
+        # the job owns its context's shared outputs and those that its stages created
+        release_shared_outputs(job_parameters.context_output)
+        release_shared_outputs()
+        WORKER_JOB_DEADLINES = None
+        if WORKER_CHECKPOINTS is not None and not interrupted:
+            WORKER_CHECKPOINTS.discard(job_parameters.job_id)
+    job_result.worker_retirement, worker_exits = _worker_retirement(logger)
+    if worker_exits:
+        # the pool replaces the worker, and the service completes the job of its report
+        _report_worker_event(identifier, job_parameters.job_id, WorkerEvent.Retired, job_result)
+        sys.exit()
+    return job_result
 
 def process_unsafe(
     identifier: ProcessIdentifier,
     job_parameters: JobParameters,
     redis_interface: RedisServiceInterface,
     logger: logging.Logger,
-    stage_dict: dict
+    stage_dict: dict,
+    status: Optional[ProcessStatus] = None
 ):
     '''
     This function raises errors as necessary 
@@ -290,14 +1335,17 @@ def process_unsafe(
         redis_interface: RedisProcessInterface
         logger: logging.Logger
         stage_dict:
-            The dictionary of modules, holding only the context stage.
+            The dictionary of modules, holding at least the context stage.
+        status: ProcessStatus
+            The status to update, a new one if not given
     '''
     logger.debug(f"{identifier} starting: {job_parameters}")
-    status = ProcessStatus(
-        job_id=job_parameters.job_id,
-        process_id=identifier.process_enumeration,
-        stage_timestamps=[]
-    )
+    if status is None:
+        status = ProcessStatus(
+            job_id=job_parameters.job_id,
+            process_id=identifier.process_enumeration,
+            stage_timestamps=[]
+        )
 
     redis_interface.process_note_message = ProcessNoteMessage(
         job_id=job_parameters.job_id,
@@ -327,15 +1375,48 @@ def process_unsafe(
         "stages": [],
     }
 
-    pypeline_envvar = {}
-    pypeline_input_templates = {}
+    pypeline_input_templates, pypeline_args, pypeline_envvar = load_stage_parameters(
+        job_parameters,
+        stage_dict,
+        logger
+    )
+    stage_profilers = {
+        stage_name: StageProfiler.for_stage(
+            job_parameters,
+            identifier,
+            stage_dict[stage_name],
+            stage_name,
+            WORKER_PROFILE_DIRECTORY if WORKER_PROFILE_DIRECTORY is not None else tempfile.gettempdir(),
+            logger
+        )
+        for stage_name in job_parameters.stage_list
+    }
+
+    if job_parameters.stage_mode == StageMode.DAG:
+        stage_name = process_dag(
+            identifier,
+            job_parameters,
+            redis_interface,
+            logger,
+            stage_dict,
+            context,
+            status,
+            keywords,
+            pypeline_input_templates,
+            pypeline_args,
+            pypeline_envvar,
+            stage_profilers,
+        )
+        note_process(ProcessNote.Finish, identifier, job_parameters, redis_interface, logger, context, stage_name=stage_name, status=status)
+        return
+
     pypeline_input_templateindices = {}
     pypeline_inputs = {}
     pypeline_inputindices = {}
     pypeline_lastinput = {}
-    pypeline_args = {}
     pypeline_argindices = {}
-    pypeline_stage_popened = {}
+    detached_processes = DetachedProcesses(status, logger)
+    pypeline_stage_fanouts = {}
 
     stage_index = 0
     stage_outputs = {
@@ -343,63 +1424,45 @@ def process_unsafe(
     }
 
     for stage_name in job_parameters.stage_list:
-        try:
-            import_module(
-                stage_name,
-                definition_dict=stage_dict,
-                logger=logger
-            )
-        except BaseException as error:
-            raise RuntimeError(f"Could not load stage: {stage_name}") from error
-
-        envkey = stage_dict[stage_name].ENV_KEY
-        inpkey = stage_dict[stage_name].INP_KEY
-        argkey = stage_dict[stage_name].ARG_KEY
-
-        # Load INP, ARG and ENV key's value for the process if applicable
-        ## INP
-        if inpkey is not None:
-            pypeline_input_templates[stage_name] = job_parameters.redis_kvcache[inpkey].split(';')
-        else:
-            pypeline_input_templates[stage_name] = [None]
         pypeline_input_templateindices[stage_name] = 0
-        
-        ## ARG
-        if argkey is not None:
-            pypeline_args[stage_name] = job_parameters.redis_kvcache[argkey].split(';')
-        else:
-            pypeline_args[stage_name] = [None]
         pypeline_argindices[stage_name] = 0
+        pypeline_inputindices[stage_name] = 0
 
-        ## ENV
-        if envkey is not None:
-            pypeline_envvar[stage_name] = job_parameters.redis_kvcache[envkey]
+    checkpoints = WORKER_CHECKPOINTS
+    if any(stage_name[-1] == "&" for stage_name in job_parameters.stage_list):
+        # detached processes do not outlive the worker
+        checkpoints = None
+    if checkpoints is not None and job_parameters.resume:
+        checkpoint = checkpoints.load(job_parameters.job_id)
+        if checkpoint is None:
+            logger.warning(f"Job {job_parameters.job_id} has no checkpoint, so it is processed afresh.")
         else:
-            pypeline_envvar[stage_name] = None
-        
-        pypeline_inputindices[stage_name] = 0
-    
+            stage_index = checkpoint["stage_index"]
+            pypeline_input_templateindices = checkpoint["input_templateindices"]
+            pypeline_inputs = checkpoint["inputs"]
+            pypeline_inputindices = checkpoint["inputindices"]
+            pypeline_lastinput = checkpoint["lastinput"]
+            pypeline_argindices = checkpoint["argindices"]
+            stage_outputs.update(checkpoint["stage_outputs"])
+            keywords.update({key: checkpoint[key] for key in ["beg", "times", "stages"]})
+            status.stage_timestamps = checkpoint["stage_timestamps"]
+            status.resumed_run_count = len(status.stage_timestamps)
+            redis_interface.process_status = status
+            logger.info(f"Resuming job {job_parameters.job_id} at {job_parameters.stage_list[stage_index]}, after {len(status.stage_timestamps)} stage run(s).")
+    # what changed since the last checkpoint record: the stages with new inputs and outputs, and the number of runs
+    journal_inputs = set()
+    journal_outputs = set()
+    journaled_run_count = len(status.stage_timestamps)
+
     while True:
         stage_name = job_parameters.stage_list[stage_index]
 
-        # wait on any previous POPENED
+        # wait on any previous POPENED, down to the stage's limit
         #TODO consider removing detached stage capabilities...
-        if stage_name[-1] == "&" and stage_name in pypeline_stage_popened:
+        if stage_name[-1] == "&" and len(detached_processes.live(stage_name)) > 0:
+            redis_interface.process_status = status
+            detached_processes.wait(stage_name, limit=getattr(stage_dict[stage_name], "DETACHED_LIMIT", 1))
             redis_interface.process_status = status
-            for popenIdx, popen in enumerate(pypeline_stage_popened[stage_name]):
-                poll_count = 0
-                while popen.poll() is None:
-                    if poll_count == 0:
-                        logger.debug(
-                            "Polling previous %s stage's detached process for completion (#%d)"
-                            % (stage_name, popenIdx)
-                        )
-                    poll_count = (poll_count + 1) % 10
-                    time.sleep(1)
-            logger.debug(
-                "%s's %d process(es) are complete."
-                % (stage_name, len(pypeline_stage_popened[stage_name]))
-            )
 
         context.setupstage(stage_dict[stage_name], logger=logger) # TODO let the context do this in the note function
 
@@ -414,94 +1477,80 @@ def process_unsafe(
             )
             logger.debug(f"{stage_name} inputs: {pypeline_inputs[stage_name]}")
             assert pypeline_inputs[stage_name]
+            journal_inputs.add(stage_name)
 
         inp = pypeline_inputs[stage_name][pypeline_inputindices[stage_name]]
-        pypeline_lastinput[stage_name] = inp
 
         arg = pypeline_args[stage_name][pypeline_argindices[stage_name]]
         if arg is not None:
             arg = replace_keywords(keywords, arg)
-        logger.debug(f"{stage_name} arg: {arg}")
 
         env = pypeline_envvar[stage_name]
         if env is not None:
             env = replace_keywords(keywords, env)
 
-        # Run the process        
-        if hasattr(context, "note"):
-            context.note(
-                ProcessNote.StageStart,
-                process_id = identifier,
-                redis_kvcache = job_parameters.redis_kvcache,
-                logger = logger,
-                stage = stage_dict[stage_name],
-                argvalue = arg,
-                inpvalue = inp,
-                envvalue = env,
-            )
-        redis_interface.process_note_message = ProcessNoteMessage(
-            job_id=job_parameters.job_id,
-            process_note=ProcessNote.StageStart,
-            process_id=identifier.process_enumeration,
-            stage_name=stage_name,
-            error_message=None,
-        )
-        status.stage_timestamps.append(
-            StageTimestamp(
-                name=stage_name,
-                start=time.time(),
-                end=None
+        # Run all of the stage's permutations concurrently, if it opts in
+        if (
+            stage_fans_out(stage_dict[stage_name], stage_name)
+            and len(pypeline_stage_fanouts.get(stage_name, [])) == 0
+            and pypeline_inputindices[stage_name] == 0
+            and pypeline_input_templateindices[stage_name] == 0
+            and pypeline_argindices[stage_name] == 0
+        ):
+            pypeline_stage_fanouts[stage_name] = fan_out_stage(
+                stage_dict[stage_name],
+                pypeline_input_templates[stage_name],
+                pypeline_args[stage_name],
+                pypeline_envvar[stage_name],
+                stage_outputs,
+                pypeline_lastinput,
+                keywords,
+                logging.getLogger(f"{identifier}.{stage_name}"),
+                logger=logger,
+                profiler=stage_profilers[stage_name]
             )
-        )
-        redis_interface.process_status = status
+            logger.debug(f"{stage_name} fanned out {len(pypeline_stage_fanouts[stage_name])} permutations.")
 
-        stage_logger = logging.getLogger(f"{identifier}.{stage_name}")
+        stage_future = None
+        if len(pypeline_stage_fanouts.get(stage_name, [])) > 0:
+            arg, inp, env, stage_future = pypeline_stage_fanouts[stage_name].pop(0)
 
-        checkpoint_time = time.time()
-        try:
-            stage_outputs[stage_name] = stage_dict[stage_name].run(arg, inp, env, logger=stage_logger)
-        except BaseException as err:
-            if hasattr(context, "note"):
-                context.note(
-                    ProcessNote.StageError,
-                    process_id = identifier,
-                    redis_kvcache = job_parameters.redis_kvcache,
-                    logger = logger,
-                    stage = stage_dict[stage_name],
-                    error = err
-                )
-            raise StageException(stage_name, err) #TODO ensure this is the neatest error stack possible
+        pypeline_lastinput[stage_name] = inp
+        logger.debug(f"{stage_name} arg: {arg}")
 
-        keywords["times"].append(time.time() - checkpoint_time)
-        keywords["stages"].append(stage_name)
-        status.stage_timestamps[-1].end = time.time()
-        redis_interface.process_status = status
+        # Run the process
+        permutation_start = time.time()
+        try:
+            stage_outputs[stage_name] = run_stage_permutation(
+                identifier,
+                job_parameters,
+                redis_interface,
+                logger,
+                context,
+                stage_dict[stage_name],
+                stage_name,
+                status,
+                keywords,
+                arg,
+                inp,
+                env,
+                stage_future=stage_future,
+                profiler=stage_profilers[stage_name]
+            )
+        except StageException:
+            for stage_fanout in pypeline_stage_fanouts.values():
+                for fanout in stage_fanout:
+                    fanout[-1].cancel()
+            raise
+        journal_outputs.add(stage_name)
 
         if stage_name[-1] == "&":
-            pypeline_stage_popened[stage_name] = stage_dict[stage_name].POPENED
+            captured = detached_processes.capture(stage_name, stage_dict[stage_name].POPENED, permutation_start)
             logger.info(
                 "Captured %s's %d detached processes."
-                % (stage_name, len(stage_dict[stage_name].POPENED))
+                % (stage_name, captured)
             )
 
-        if hasattr(context, "note"):
-            context.note(
-                ProcessNote.StageFinish,
-                process_id = identifier,
-                redis_kvcache = job_parameters.redis_kvcache,
-                logger = logger,
-                stage = stage_dict[stage_name],
-                output = stage_outputs[stage_name]
-            )
-        redis_interface.process_note_message = ProcessNoteMessage(
-            job_id=job_parameters.job_id,
-            process_note=ProcessNote.StageFinish,
-            process_id=identifier.process_enumeration,
-            stage_name=stage_name,
-            error_message=None,
-        )
-        redis_interface.process_status = status
-
         # Increment through inputs, overflow increment through arguments
         pypeline_inputindices[stage_name] += 1
         if pypeline_inputindices[stage_name] >= len(pypeline_inputs[stage_name]):
@@ -548,6 +1597,7 @@ def process_unsafe(
             # Break if there are no novel process argument-input permutations
             if stage_index < 0:
                 logger.debug("Processing Done!")
+                detached_processes.reap()
                 redis_interface.process_status = status
                 break
             progress_str = get_proc_dict_progress_str(
@@ -563,18 +1613,297 @@ def process_unsafe(
 
             logger.debug(f"Rewound to {job_parameters.stage_list[stage_index]}")
 
-    if hasattr(context, "note"):
-        context.note(
-            ProcessNote.Finish,
-            process_id = identifier,
-            redis_kvcache = job_parameters.redis_kvcache,
-            logger = logger,
-        )
-    
-    redis_interface.process_note_message = ProcessNoteMessage(
-        job_id=job_parameters.job_id,
-        process_note=ProcessNote.Finish,
-        process_id=identifier.process_enumeration,
-        stage_name=stage_name,
-        error_message=None,
-    )
\ No newline at end of file
+        # the cursor of the next permutation and the changes to the outputs that it can
+        # reference, unless permutations of a fanned-out stage are in flight
+        if checkpoints is not None and all(len(fanouts) == 0 for fanouts in pypeline_stage_fanouts.values()):
+            checkpointed = checkpoints.append(
+                job_parameters,
+                {
+                    "stage_index": stage_index,
+                    "input_templateindices": pypeline_input_templateindices,
+                    "inputindices": pypeline_inputindices,
+                    "argindices": pypeline_argindices,
+                    "inputs": {name: pypeline_inputs[name] for name in journal_inputs},
+                    "lastinput": {name: pypeline_lastinput[name] for name in journal_outputs},
+                    "stage_outputs": {name: stage_outputs[name] for name in journal_outputs},
+                    "beg": keywords["beg"],
+                    "times": keywords["times"][journaled_run_count:],
+                    "stages": keywords["stages"][journaled_run_count:],
+                    "stage_timestamps": status.stage_timestamps[journaled_run_count:],
+                }
+            )
+            if not checkpointed:
+                # the last checkpoint (if any) stands, which is consistent if behind
+                checkpoints = None
+            journal_inputs.clear()
+            journal_outputs.clear()
+            journaled_run_count = len(status.stage_timestamps)
+
+    note_process(ProcessNote.Finish, identifier, job_parameters, redis_interface, logger, context, stage_name=stage_name, status=status)
+
+def input_template_references(input_template) -> List[str]:
+    '''
+    The names of the stages referenced in an input template, sans modifiers.
+    Verbatim (`&`) words are not references.
+    '''
+    if input_template is None:
+        return []
+    references = []
+    for symbol in input_template_symbols(input_template):
+        if len(symbol) == 0 or symbol[0] == "&":
+            continue
+        if symbol[0] in ["^", "*"]:
+            symbol = symbol[1:]
+        if symbol not in references:
+            references.append(symbol)
+    return references
+
+
+def plan_stage_dag(
+    context_name: str,
+    stage_list: List[str],
+    input_templates: Dict[str, List[str]]
+):
+    '''
+    Arranges the stages as a tree rooted at the context, with each stage being a
+    child of the stage it depends on (the references in its input templates).
+
+    A stage that depends on stages in separate branches is a 'join': it is a child of
+    the branches' closest common ancestor and runs after the branches, with all of the
+    outputs that each branch's stage produced (and the last input of each, for `^`).
+
+    Returns:
+        Tuple[Dict[str, List[str]], Dict[str, List[str]]]
+            The children of each stage (and the context), and the dependencies of each
+            join that are collected from the branches.
+    '''
+    ancestry = {context_name: [context_name]}
+    children = {context_name: []}
+    join_dependencies = {}
+
+    for stage_index, stage_name in enumerate(stage_list):
+        dependencies = []
+        for input_template in input_templates[stage_name]:
+            for reference in input_template_references(input_template):
+                if reference != context_name and reference not in stage_list[0:stage_index]:
+                    raise ValueError(f"`{stage_name}` depends on `{reference}`, which is not a preceding stage.")
+                if reference not in dependencies:
+                    dependencies.append(reference)
+
+        if len(dependencies) == 0:
+            dependencies = [context_name]
+
+        parent = None
+        for dependency in dependencies:
+            if all(d in ancestry[dependency] for d in dependencies):
+                parent = dependency
+                break
+        if parent is None:
+            # the closest common ancestor
+            common_ancestry = [
+                ancestor
+                for ancestor in ancestry[dependencies[0]]
+                if all(ancestor in ancestry[d] for d in dependencies[1:])
+            ]
+            parent = common_ancestry[-1]
+            join_dependencies[stage_name] = [
+                d
+                for d in dependencies
+                if d not in ancestry[parent]
+            ]
+
+        ancestry[stage_name] = ancestry[parent] + [stage_name]
+        children[parent].append(stage_name)
+        children[stage_name] = []
+
+    return children, join_dependencies
+
+
+def process_dag(
+    identifier: ProcessIdentifier,
+    job_parameters: JobParameters,
+    redis_interface: RedisServiceInterface,
+    logger: logging.Logger,
+    stage_dict: dict,
+    context,
+    status: ProcessStatus,
+    keywords: dict,
+    pypeline_input_templates: Dict[str, List[str]],
+    pypeline_args: Dict[str, List[str]],
+    pypeline_envvar: Dict[str, str],
+    stage_profilers: Dict[str, Optional[StageProfiler]],
+):
+    '''
+    Runs the stages of the job per `plan_stage_dag`, with sibling branches running
+    concurrently on threads. A stage runs for each permutation of its parent, once
+    its inputs are ready.
+
+    Returns:
+        str
+            The name of the last stage run
+    '''
+    children, join_dependencies = plan_stage_dag(
+        job_parameters.context_name,
+        job_parameters.stage_list,
+        pypeline_input_templates
+    )
+    logger.debug(f"Stage DAG: {children} (joins: {join_dependencies})")
+
+    lock = threading.Lock()
+    aborted = threading.Event()
+    detached_processes = DetachedProcesses(status, logger)
+    last_stage_name = [None]
+
+    # the outputs and last inputs (see `parse_input_template`) collected from runs of the stages
+    def extend_collected(collected, collected_lastinput, run):
+        outputs, lastinput = run
+        for stage_name, stage_outputs in outputs.items():
+            collected.setdefault(stage_name, []).extend(stage_outputs)
+        collected_lastinput.update(lastinput)
+
+    def run_children(parent, stage_outputs, pypeline_lastinput):
+        collected = {}
+        collected_lastinput = {}
+        branches = [
+            stage_name
+            for stage_name in children[parent]
+            if stage_name not in join_dependencies
+        ]
+        if len(branches) == 1:
+            extend_collected(collected, collected_lastinput, run_stage(branches[0], stage_outputs, pypeline_lastinput))
+        elif len(branches) > 1:
+            with ThreadPoolExecutor(max_workers=len(branches)) as executor:
+                futures = [
+                    executor.submit(run_stage, stage_name, stage_outputs, pypeline_lastinput)
+                    for stage_name in branches
+                ]
+                try:
+                    for future in futures:
+                        extend_collected(collected, collected_lastinput, future.result())
+                except BaseException:
+                    aborted.set()
+                    raise
+
+        for stage_name in children[parent]:
+            if stage_name not in join_dependencies:
+                continue
+            join_outputs = dict(stage_outputs)
+            join_outputs.update({
+                dependency: collected.get(dependency, [])
+                for dependency in join_dependencies[stage_name]
+            })
+            join_lastinput = dict(pypeline_lastinput)
+            join_lastinput.update({
+                dependency: collected_lastinput[dependency]
+                for dependency in join_dependencies[stage_name]
+                if dependency in collected_lastinput
+            })
+            extend_collected(
+                collected,
+                collected_lastinput,
+                run_stage(stage_name, join_outputs, join_lastinput)
+            )
+
+        return collected, collected_lastinput
+
+    def run_stage(stage_name, stage_outputs, pypeline_lastinput):
+        stage = stage_dict[stage_name]
+        collected = {stage_name: []}
+        collected_lastinput = {}
+
+        with lock:
+            context.setupstage(stage, logger=logger)
+
+        if stage_fans_out(stage, stage_name):
+            permutations = fan_out_stage(
+                stage,
+                pypeline_input_templates[stage_name],
+                pypeline_args[stage_name],
+                pypeline_envvar[stage_name],
+                stage_outputs,
+                pypeline_lastinput,
+                keywords,
+                logging.getLogger(f"{identifier}.{stage_name}"),
+                logger=logger,
+                profiler=stage_profilers[stage_name]
+            )
+        else:
+            permutations = (
+                (arg, inp, env, None)
+                for arg, inp, env in stage_permutations(
+                    pypeline_input_templates[stage_name],
+                    pypeline_args[stage_name],
+                    pypeline_envvar[stage_name],
+                    stage_outputs,
+                    pypeline_lastinput,
+                    keywords,
+                    logger=logger
+                )
+            )
+
+        for arg, inp, env, stage_future in permutations:
+            if aborted.is_set():
+                if stage_future is not None:
+                    stage_future.cancel()
+                continue
+
+            # wait on any previous POPENED, down to the stage's limit
+            if stage_name[-1] == "&":
+                detached_processes.wait(stage_name, limit=getattr(stage, "DETACHED_LIMIT", 1))
+
+            logger.debug(f"{stage_name} arg: {arg}")
+            permutation_start = time.time()
+            try:
+                outputs = run_stage_permutation(
+                    identifier,
+                    job_parameters,
+                    redis_interface,
+                    logger,
+                    context,
+                    stage,
+                    stage_name,
+                    status,
+                    keywords,
+                    arg,
+                    inp,
+                    env,
+                    stage_future=stage_future,
+                    lock=lock,
+                    profiler=stage_profilers[stage_name]
+                )
+            except BaseException:
+                aborted.set()
+                raise
+            last_stage_name[0] = stage_name
+
+            if stage_name[-1] == "&":
+                with lock:
+                    captured = detached_processes.capture(stage_name, stage.POPENED, permutation_start)
+                logger.info(
+                    "Captured %s's %d detached processes."
+                    % (stage_name, captured)
+                )
+
+            collected[stage_name].extend(outputs)
+            collected_lastinput[stage_name] = inp
+            stage_lastinput = dict(pypeline_lastinput)
+            stage_lastinput[stage_name] = inp
+            stage_outputs_next = dict(stage_outputs)
+            stage_outputs_next[stage_name] = outputs
+            extend_collected(
+                collected,
+                collected_lastinput,
+                run_children(stage_name, stage_outputs_next, stage_lastinput)
+            )
+
+        return collected, collected_lastinput
+
+    run_children(
+        job_parameters.context_name,
+        {job_parameters.context_name: job_parameters.context_output},
+        {}
+    )
+    logger.debug("Processing Done!")
+    detached_processes.reap()
+    redis_interface.process_status = status
+    return last_stage_name[0]
@@ -0,0 +1,144 @@
+import os
+import glob
+import pickle
+import logging
+from typing import List, Optional
+
+from .dataclasses import JobParameters, ServiceIdentifier
+from .shared_output import find_shared_outputs
+
+
+class JobCheckpoints:
+    """
+    The on-disk checkpoints of a service's in-flight jobs, from which the jobs are
+    resumed after the service restarts.
+
+    A checkpoint is a journal: the job's parameters, followed by a record appended
+    after each 'Stage Finish' of what changed in the state of its linear stage
+    permutations (their indices, the new inputs and stage outputs, and the new
+    timestamps). So the cost of a checkpoint is that of the permutation, rather than
+    of the job so far. The records are merged by `load` (see `append`).
+
+    A checkpoint is discarded once the job completes, errors or is terminated, so the
+    checkpoints that remain at start-up are those of the jobs that the previous
+    service did not finish.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        service_id: ServiceIdentifier,
+        logger: Optional[logging.Logger] = None
+    ):
+        self.directory = os.path.join(directory, f"pypeline_{service_id.hostname}_{service_id.enumeration}")
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _filepath(self, job_id: int) -> str:
+        return os.path.join(self.directory, f"job_{job_id}.pkl")
+
+    def append(self, job_parameters: JobParameters, record: dict) -> bool:
+        """
+        Journals the changes to the job's state, which `load` merges in order:
+        a list extends that of the state, a dict updates that of the state and
+        any other value replaces that of the state.
+
+        Returns:
+            bool
+                Whether the record was written, which it is not if it holds
+                SharedOutput handles (which do not outlive the service) or cannot be pickled.
+        """
+        if len(find_shared_outputs(job_parameters.context_output)) > 0 or len(find_shared_outputs(record)) > 0:
+            self.logger.debug(f"Not checkpointing job {job_parameters.job_id}, which holds SharedOutput handles.")
+            return False
+
+        filepath = self._filepath(job_parameters.job_id)
+        try:
+            data = pickle.dumps(record)
+        except BaseException as err:
+            self.logger.warning(f"Could not checkpoint job {job_parameters.job_id}: {repr(err)}")
+            return False
+
+        if os.path.exists(filepath):
+            try:
+                with open(filepath, "ab") as fio:
+                    fio.write(data)
+            except BaseException as err:
+                self.logger.warning(f"Could not checkpoint job {job_parameters.job_id} in {filepath}: {repr(err)}")
+                return False
+            return True
+
+        # the journal starts with the job's parameters and first record, atomically
+        temp_filepath = f"{filepath}.{os.getpid()}.tmp"
+        try:
+            with open(temp_filepath, "wb") as fio:
+                pickle.dump(job_parameters, fio)
+                fio.write(data)
+            os.replace(temp_filepath, filepath)
+        except BaseException as err:
+            self.logger.warning(f"Could not checkpoint job {job_parameters.job_id} in {filepath}: {repr(err)}")
+            self._remove(temp_filepath)
+            return False
+        return True
+
+    def load(self, job_id: int) -> Optional[dict]:
+        """
+        The checkpointed state of the job, if any.
+
+        A record torn by the interruption of the service is truncated from the journal,
+        so that the records appended as the job resumes follow the state that they change.
+        """
+        filepath = self._filepath(job_id)
+        state = {}
+        try:
+            with open(filepath, "r+b") as fio:
+                pickle.load(fio)
+                while True:
+                    offset = fio.tell()
+                    try:
+                        record = pickle.load(fio)
+                    except EOFError:
+                        break
+                    except BaseException as err:
+                        self.logger.warning(f"Truncating the torn record of checkpoint {filepath}: {repr(err)}")
+                        fio.truncate(offset)
+                        break
+                    for key, value in record.items():
+                        if isinstance(value, list) and key in state:
+                            state[key].extend(value)
+                        elif isinstance(value, dict) and key in state:
+                            state[key].update(value)
+                        else:
+                            state[key] = value
+        except FileNotFoundError:
+            return None
+        except BaseException as err:
+            self.logger.warning(f"Discarding the unreadable checkpoint {filepath}: {repr(err)}")
+            self._remove(filepath)
+            return None
+        return state
+
+    def discard(self, job_id: int):
+        self._remove(self._filepath(job_id))
+
+    def unfinished(self) -> List[JobParameters]:
+        """The parameters of the checkpointed jobs, in the order of their IDs, marked to be resumed."""
+        jobs = []
+        for filepath in glob.glob(os.path.join(self.directory, "job_*.pkl")):
+            try:
+                with open(filepath, "rb") as fio:
+                    job_parameters = pickle.load(fio)
+            except BaseException as err:
+                self.logger.warning(f"Discarding the unreadable checkpoint {filepath}: {repr(err)}")
+                self._remove(filepath)
+                continue
+            job_parameters.resume = True
+            jobs.append(job_parameters)
+        return sorted(jobs, key=lambda job_parameters: job_parameters.job_id)
+
+    @staticmethod
+    def _remove(filepath: str):
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
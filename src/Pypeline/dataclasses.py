@@ -1,8 +1,11 @@
 from typing import Dict, List, Optional, Union
 import re
+import json
+import uuid
+import hashlib
 from enum import Enum
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 ### Process Classes
 
@@ -47,15 +50,45 @@ class StageTimestamp(BaseModel):
     end: Optional[float]
 
 
+class DetachedProcessStatus(BaseModel):
+    stage_name: str
+    pid: int
+    start: float
+    end: Optional[float] = None
+    returncode: Optional[int] = None
+
+
 class ProcessStatus(BaseModel):
     job_id: int
     process_id: int
-    stage_timestamps: List[StageTimestamp]
+    stage_timestamps: List[StageTimestamp] = []
+    resumed_run_count: int = 0 # the stage runs (of stage_timestamps) before the job resumed from its checkpoint
+    result_cache_hits: int = 0
+    result_cache_misses: int = 0
+    detached_processes: List[DetachedProcessStatus] = []
+
+    # identifies the job's run that the status is of, see `RedisServiceInterface.write_process_status`
+    _run_token: str = PrivateAttr(default_factory=lambda: uuid.uuid4().hex)
 
     def __str__(self) -> str:
         return self.model_dump_json()
 
+class JobResult(BaseModel):
+    successful: bool
+    status: Optional[ProcessStatus] = None
+    worker_retirement: Optional[str] = None # why the worker retires after the job, if it does
+
+class WorkerEvent(str, Enum):
+    """The events that the pool's workers report to the service (see `initialise_worker`)."""
+    Warmed = "warmed"
+    Failed = "failed" # to initialise
+    Deadline = "deadline"
+    Ended = "ended"
+    Retired = "retired"
+
 class ProcessState(str, Enum):
+    Warming = "warming"
+    Recycling = "recycling"
     Idle = "idle"
     Busy = "busy"
     Finished = "finished"
@@ -68,23 +101,50 @@ class ProcessNote(str, Enum):
     StageError = "Stage Error"
     Finish = "Finish"
     Error = "Error"
+    Timeout = "Timeout"
+    Cancelled = "Cancelled"
 
     @staticmethod
     def string(note: "ProcessNote") -> str:
         return note.value
 
+class StageProfile(BaseModel):
+    stage_name: str
+    filepath: Optional[str]
+    duration_s: float
+    top_functions: List[str]
+    memory_peak_bytes: Optional[int] = None
+    top_allocations: List[str] = []
+
 class ProcessNoteMessage(BaseModel):
     job_id: int
     process_id: int
     process_note: ProcessNote
     stage_name: Optional[str]
     error_message: Optional[str]
+    result_cache_hits: Optional[int] = None
+    result_cache_misses: Optional[int] = None
+    stage_profile: Optional[StageProfile] = None
 
     def __str__(self) -> str:
         return self.model_dump_json()
 
+class ModuleCacheEntry(BaseModel):
+    module_name: str
+    filepath: Optional[str] = None
+    mtime: Optional[float] = None
+    content_hash: Optional[str] = None
+    load_count: int = 0
+    load_duration_s: float = 0.0
+    total_load_duration_s: float = 0.0
+
 ### Job classes
 
+class StageMode(str, Enum):
+    Linear = "linear"
+    DAG = "dag"
+
+
 class JobParameters(BaseModel):
     job_id: int
     redis_kvcache: Dict[str, str]
@@ -92,6 +152,16 @@ class JobParameters(BaseModel):
     context_output: list
     context_dehydrated: Union[tuple, dict, list] # context.dehydrate()
     stage_list: List[str]
+    stage_mode: StageMode = StageMode.Linear
+    priority: int = 0
+    profile_stages: List[str] = [] # the stages to profile, '*' for all
+    profile_memory: bool = False
+    timeout_s: Optional[float] = None # the job's wall-clock timeout
+    stage_timeouts_s: Dict[str, float] = {} # the timeouts of each `run()` of the stages, over their TIMEOUT
+    resume: bool = False # whether to resume from the job's checkpoint, see `JobCheckpoints`
+
+    def redis_kvcache_hash(self) -> str:
+        return hashlib.sha256(json.dumps(self.redis_kvcache, sort_keys=True).encode()).hexdigest()
 
 
 class JobEvent(str, Enum):
@@ -103,9 +173,19 @@ class JobEvent(str, Enum):
 class JobEventMessage(BaseModel):
     event: JobEvent
     job_parameters: JobParameters
+    redis_kvcache_hash: Optional[str] = None # that of the job's redis_kvcache, which is serialised empty
 
     def __str__(self) -> str:
-        return self.model_dump_json()
+        return self.model_copy(
+            update={
+                "job_parameters": self.job_parameters.model_copy(update={"redis_kvcache": {}}),
+                "redis_kvcache_hash": (
+                    self.redis_kvcache_hash
+                    if self.redis_kvcache_hash is not None
+                    else self.job_parameters.redis_kvcache_hash()
+                ),
+            }
+        ).model_dump_json()
 
 ### Service entrypoint classes
 
@@ -147,21 +227,44 @@ class ServiceIdentifier(BaseModel):
         return hash(self.__str__())
 
 
+class QueueOverflowPolicy(str, Enum):
+    DropNewest = "drop-newest"
+    DropOldest = "drop-oldest"
+    Block = "block"
+    Spill = "spill"
+
+
+class MessageTransport(str, Enum):
+    PubSub = "pubsub"
+    Streams = "streams"
+
+
 class ServiceStatus(BaseModel):
     workers_busy_count: int
     workers_total_count: int
-    process_job_queue: List
+    jobs_queued_count: int
+    queue_wait_mean_s: Optional[float] = None
+    queue_wait_max_s: Optional[float] = None
 
     def __str__(self) -> str:
-        return f"{self.workers_busy_count}/{self.workers_total_count} ({len(self.process_job_queue)} queued)"
+        s = f"{self.workers_busy_count}/{self.workers_total_count} ({self.jobs_queued_count} queued)"
+        if self.queue_wait_mean_s is not None:
+            s += f" waited {self.queue_wait_mean_s:0.3f}/{self.queue_wait_max_s:0.3f} s (mean/max)"
+        return s
 
     @staticmethod
     def from_str(s) -> "ServiceStatus":
-        m = re.match(r"(?P<workers_busy_count>\d+)/(?P<workers_total_count>\d+) \((?P<jobs_queued_count>\d+) queued\)", s)
+        m = re.match(
+            r"(?P<workers_busy_count>\d+)/(?P<workers_total_count>\d+) \((?P<jobs_queued_count>\d+) queued\)"
+            r"( waited (?P<queue_wait_mean_s>[\d.]+)/(?P<queue_wait_max_s>[\d.]+) s \(mean/max\))?",
+            s
+        )
         if m is None:
             raise ValueError(f"Incompatible string: '{s}'")
         return ServiceStatus(
             workers_busy_count=int(m.group("workers_busy_count")),
             workers_total_count=int(m.group("workers_total_count")),
             jobs_queued_count=int(m.group("jobs_queued_count")),
+            queue_wait_mean_s=float(m.group("queue_wait_mean_s")) if m.group("queue_wait_mean_s") is not None else None,
+            queue_wait_max_s=float(m.group("queue_wait_max_s")) if m.group("queue_wait_max_s") is not None else None,
         )
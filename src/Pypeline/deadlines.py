@@ -0,0 +1,72 @@
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+from types import ModuleType
+from typing import Callable, Dict, Optional, Tuple
+
+from .dataclasses import JobParameters
+
+
+def stage_timeout_s(job_parameters: JobParameters, stage: ModuleType) -> Optional[float]:
+    '''The wall-clock timeout of each `run()` of the stage: that of the job's `stage_timeouts_s`, else its `TIMEOUT`.'''
+    stage_name = stage.__name__[len("stage_"):]
+    return job_parameters.stage_timeouts_s.get(stage_name, getattr(stage, "TIMEOUT", None))
+
+
+class JobDeadlines:
+    """
+    The wall-clock deadlines of a job in a worker: that of the job's `timeout_s` and
+    those of the `run()`s in progress of the stages that have a timeout.
+
+    The earliest deadline (and its cause) is reported whenever it changes, and once
+    up front, to the service which terminates the worker if the deadline passes.
+    """
+
+    def __init__(
+        self,
+        job_parameters: JobParameters,
+        report: Callable[[Optional[float], Optional[str]], None]
+    ):
+        self.job_parameters = job_parameters
+        self.report = report
+        self._deadlines: Dict[int, Tuple[float, str]] = {}
+        self._sequence = itertools.count()
+        self._reported = None
+        self._lock = threading.Lock()
+
+        with self._lock:
+            if job_parameters.timeout_s is not None:
+                self._deadlines[next(self._sequence)] = (
+                    time.time() + job_parameters.timeout_s,
+                    f"the job's timeout of {job_parameters.timeout_s} s"
+                )
+            self._report()
+
+    def _report(self):
+        earliest = min(self._deadlines.values(), default=(None, None))
+        if earliest != self._reported:
+            self._reported = earliest
+            self.report(*earliest)
+
+    @contextmanager
+    def stage_run(self, stage: ModuleType):
+        '''Holds the deadline of a `run()` of the stage, if it has a timeout.'''
+        timeout_s = stage_timeout_s(self.job_parameters, stage)
+        if timeout_s is None:
+            yield
+            return
+
+        with self._lock:
+            key = next(self._sequence)
+            self._deadlines[key] = (
+                time.time() + timeout_s,
+                f"{stage.__name__[len('stage_'):]}'s timeout of {timeout_s} s"
+            )
+            self._report()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._deadlines.pop(key)
+                self._report()
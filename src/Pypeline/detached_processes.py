@@ -0,0 +1,163 @@
+import os
+import time
+import logging
+import selectors
+import threading
+import weakref
+from subprocess import Popen
+from typing import Dict, List, Optional
+
+from .dataclasses import ProcessStatus, DetachedProcessStatus
+
+
+def wait_for_any_exit(popens: List[Popen], timeout_s: Optional[float] = None) -> List[Popen]:
+    '''
+    Blocks until at least one of the processes has exited (or the timeout lapses).
+    The exits are awaited on pidfds where the platform supports them, otherwise
+    the processes are polled with a backoff.
+
+    Returns:
+        List[Popen]
+            The exited (and reaped) processes.
+    '''
+    exited = [popen for popen in popens if popen.poll() is not None]
+    if len(exited) > 0 or len(popens) == 0:
+        return exited
+
+    if hasattr(os, "pidfd_open"):
+        try:
+            return _wait_on_pidfds(popens, timeout_s)
+        except OSError:
+            # e.g. kernels older than 5.3
+            pass
+    return _wait_on_polls(popens, timeout_s)
+
+
+def _wait_on_pidfds(popens: List[Popen], timeout_s: Optional[float]) -> List[Popen]:
+    pidfds = []
+    try:
+        with selectors.DefaultSelector() as selector:
+            for popen in popens:
+                pidfd = os.pidfd_open(popen.pid)
+                pidfds.append(pidfd)
+                selector.register(pidfd, selectors.EVENT_READ, popen)
+
+            ready = selector.select(timeout_s)
+    finally:
+        for pidfd in pidfds:
+            os.close(pidfd)
+
+    # a readable pidfd is an exited process, which `wait()` reaps without blocking
+    for key, _ in ready:
+        key.data.wait()
+    return [popen for popen in popens if popen.poll() is not None]
+
+
+def _wait_on_polls(popens: List[Popen], timeout_s: Optional[float]) -> List[Popen]:
+    deadline = None if timeout_s is None else time.time() + timeout_s
+    period_s = 0.01
+    while True:
+        exited = [popen for popen in popens if popen.poll() is not None]
+        if len(exited) > 0:
+            return exited
+        if deadline is not None and time.time() >= deadline:
+            return []
+        time.sleep(
+            period_s if deadline is None else max(0, min(period_s, deadline - time.time()))
+        )
+        period_s = min(period_s*2, 0.1)
+
+
+class DetachedProcesses:
+    """
+    Tracks the processes that the detached (`&`) stages of a job spawn in their
+    `POPENED`, recording each one's run time and exit code in the process status.
+    """
+
+    def __init__(self, status: ProcessStatus, logger: logging.Logger):
+        self.status = status
+        self.logger = logger
+        self._live: Dict[str, List[Popen]] = {}
+        # keyed on the (strongly referenced) Popen objects, not their `id()`s, which are
+        # reused once a reaped Popen is freed (e.g. by `POPENED.clear()`)
+        self._statuses: Dict[Popen, DetachedProcessStatus] = {}
+        # those reaped, which stay in a stage's POPENED until it lets them go
+        self._reaped = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def capture(self, stage_name: str, popened: List[Popen], start: float) -> int:
+        '''
+        Tracks the processes of the stage's `POPENED` that are not yet tracked.
+
+        Params:
+            start: float
+                The time at which the stage's `run()` (that spawned the processes) started
+
+        Returns:
+            int
+                The number of newly tracked processes.
+        '''
+        captured = 0
+        with self._lock:
+            live = self._live.setdefault(stage_name, [])
+            for popen in popened:
+                if popen in self._statuses or popen in self._reaped:
+                    continue
+                detached_status = DetachedProcessStatus(
+                    stage_name=stage_name,
+                    pid=popen.pid,
+                    start=start
+                )
+                self._statuses[popen] = detached_status
+                self.status.detached_processes.append(detached_status)
+                live.append(popen)
+                captured += 1
+        self.reap()
+        return captured
+
+    def live(self, stage_name: str) -> List[Popen]:
+        with self._lock:
+            return list(self._live.get(stage_name, []))
+
+    def _record_exits(self, stage_name: str, exited: List[Popen]):
+        now = time.time()
+        with self._lock:
+            live = self._live.get(stage_name, [])
+            for popen in exited:
+                if popen not in live:
+                    continue
+                live.remove(popen)
+                detached_status = self._statuses.pop(popen)
+                self._reaped.add(popen)
+                detached_status.end = now
+                detached_status.returncode = popen.returncode
+                log = self.logger.warning if popen.returncode != 0 else self.logger.debug
+                log(f"{stage_name}'s detached process {popen.pid} exited with {popen.returncode} after {now - detached_status.start:0.3f} s.")
+
+    def reap(self):
+        '''Records the exits of the processes that have exited, without blocking.'''
+        with self._lock:
+            stage_lives = {
+                stage_name: list(live)
+                for stage_name, live in self._live.items()
+            }
+        for stage_name, live in stage_lives.items():
+            self._record_exits(
+                stage_name,
+                [popen for popen in live if popen.poll() is not None]
+            )
+
+    def wait(self, stage_name: str, limit: int = 1):
+        '''
+        Blocks until fewer than `limit` of the stage's detached processes are live.
+        '''
+        limit = max(limit, 1)
+        live = self.live(stage_name)
+        if len(live) < limit:
+            return
+
+        self.logger.debug(f"Awaiting {len(live) - limit + 1} of {stage_name}'s {len(live)} detached process(es).")
+        while len(live) >= limit:
+            self._record_exits(stage_name, wait_for_any_exit(live))
+            live = self.live(stage_name)
+        self.logger.debug(f"{stage_name} has {len(live)} live detached process(es).")
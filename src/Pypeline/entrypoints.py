@@ -1,4 +1,5 @@
 import os
+import time
 import argparse
 import socket
 import logging
@@ -8,9 +9,16 @@ from datetime import datetime
 import multiprocessing as mp
 from typing import List, Optional
 
-from . import import_module, get_stage_keys, process as PypelineProcess
+from . import import_module, get_stage_keys, initialise_worker
 from .redis_interface import RedisServiceInterface
-from .dataclasses import ServiceIdentifier, ServiceStatus, ProcessState, JobEvent, JobEventMessage, ProcessNote, JobParameters
+from .dataclasses import ServiceIdentifier, JobEvent, JobEventMessage, ProcessNote, ProcessNoteMessage, JobParameters, StageMode, QueueOverflowPolicy, MessageTransport
+from .scheduler import ServiceScheduler, ServiceEvent, ContextRunner
+from .job_queue import JobQueue
+from .redis_job_queue import RedisJobQueue
+from .shared_output import release_shared_outputs
+from .result_cache import ResultCache
+from .checkpoint import JobCheckpoints
+from .metrics import ServiceMetrics, JobOutcome
 from .log_formatter import LogFormatter
 
 
@@ -37,6 +45,90 @@ def main_cli():
         default=10,
         help="The limit of the process queue.",
     )
+    parser.add_argument(
+        "--queue-overflow-policy",
+        choices=[policy.value for policy in QueueOverflowPolicy],
+        default=QueueOverflowPolicy.DropNewest.value,
+        help="What happens to jobs once the process queue is at its limit.",
+    )
+    parser.add_argument(
+        "--queue-spill-directory",
+        type=str,
+        default=None,
+        help="The directory in which the 'spill' overflow policy pickles jobs.",
+    )
+    parser.add_argument(
+        "--cluster",
+        type=str,
+        default=None,
+        help="The name of a cluster of services that share a job queue in Redis (limited by --queue-limit), instead of queueing locally.",
+    )
+    parser.add_argument(
+        "--cluster-lease-timeout",
+        type=float,
+        default=60.0,
+        help="The seconds after which the job of a cluster service that has stopped renewing its lease is requeued.",
+    )
+    parser.add_argument(
+        "--max-jobs-per-worker",
+        type=int,
+        default=None,
+        help="The number of jobs after which a worker is replaced (unlimited if not given).",
+    )
+    parser.add_argument(
+        "--max-worker-rss",
+        type=float,
+        default=None,
+        help="The peak RSS (in megabytes) after which a worker is replaced, checked after each job (unlimited if not given).",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=1.0,
+        help="The seconds to wait for an event before refreshing from the Redis hash.",
+    )
+    parser.add_argument(
+        "--heartbeat-period",
+        type=float,
+        default=1.0,
+        help="The seconds between writes of the PULSE heartbeat (and unchanged status fields).",
+    )
+    parser.add_argument(
+        "--result-cache-directory",
+        type=str,
+        default=None,
+        help="The directory in which to cache the results of CACHEABLE stages (disabled if not given).",
+    )
+    parser.add_argument(
+        "--result-cache-size",
+        type=int,
+        default=1024,
+        help="The megabytes that the result cache is limited to.",
+    )
+    parser.add_argument(
+        "--result-cache-days",
+        type=float,
+        default=7,
+        help="The number of days that result cache entries are kept for.",
+    )
+    parser.add_argument(
+        "--checkpoint-directory",
+        type=str,
+        default=None,
+        help="The directory in which to checkpoint jobs after each stage, to resume them after a restart (disabled if not given).",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="The port on which to serve Prometheus metrics (disabled if not given).",
+    )
+    parser.add_argument(
+        "--metrics-hostname",
+        type=str,
+        default="127.0.0.1",
+        help="The hostname on which to serve Prometheus metrics.",
+    )
     parser.add_argument(
         "--log-directory",
         type=str,
@@ -68,6 +160,18 @@ def main_cli():
         default=6379,
         help="The port of the Redis server.",
     )
+    parser.add_argument(
+        "--message-transport",
+        choices=[transport.value for transport in MessageTransport],
+        default=MessageTransport.PubSub.value,
+        help="Whether the 'jobs' and 'notes' messages are published, or added to streams (which clients read in batches).",
+    )
+    parser.add_argument(
+        "--stream-maxlen",
+        type=int,
+        default=10000,
+        help="The approximate length that the 'jobs' and 'notes' streams are capped at.",
+    )
     parser.add_argument(
         "-v",
         "--verbosity",
@@ -90,13 +194,41 @@ def main_cli():
         kv = args.kv,
         redis_hostname = args.redis_hostname,
         redis_port = args.redis_port,
+        message_transport = MessageTransport(args.message_transport),
+        stream_maxlen = args.stream_maxlen,
         workers = args.workers,
+        max_jobs_per_worker = args.max_jobs_per_worker,
+        max_worker_rss_mb = args.max_worker_rss,
         queue_limit = args.queue_limit,
+        queue_overflow_policy = QueueOverflowPolicy(args.queue_overflow_policy),
+        queue_spill_directory = args.queue_spill_directory,
+        cluster = args.cluster,
+        cluster_lease_timeout_s = args.cluster_lease_timeout,
+        idle_timeout_s = args.idle_timeout,
+        heartbeat_period_s = args.heartbeat_period,
+        result_cache_directory = args.result_cache_directory,
+        result_cache_size_mb = args.result_cache_size,
+        result_cache_days = args.result_cache_days,
+        checkpoint_directory = args.checkpoint_directory,
+        metrics_port = args.metrics_port,
+        metrics_hostname = args.metrics_hostname,
         verbosity = args.verbosity,
         log_directory = args.log_directory,
         log_backup_days = args.log_backup_days,
     )
 
+def note_dropped_job(context_runner: ContextRunner, queue_limit: int, logger: logging.Logger):
+    message = f"Queue limit of {queue_limit} reached."
+    logger.warning(message)
+
+    context_runner.call( # TODO change to service note
+        "note",
+        ProcessNote.Error,
+        process_id = None,
+        logger = logger,
+        error = RuntimeError(message),
+    )
+
 def main(
     instance: int,
     context: str,
@@ -104,8 +236,24 @@ def main(
     multiprocessing_start_method: str = "fork",
     redis_hostname: str = "redishost",
     redis_port: int = 6379,
+    message_transport: MessageTransport = MessageTransport.PubSub,
+    stream_maxlen: int = 10000,
     workers: int = 4,
+    max_jobs_per_worker: Optional[int] = None,
+    max_worker_rss_mb: Optional[float] = None,
     queue_limit: int = 10,
+    queue_overflow_policy: QueueOverflowPolicy = QueueOverflowPolicy.DropNewest,
+    queue_spill_directory: Optional[str] = None,
+    cluster: Optional[str] = None,
+    cluster_lease_timeout_s: float = 60.0,
+    idle_timeout_s: float = 1.0,
+    heartbeat_period_s: float = 1.0,
+    result_cache_directory: Optional[str] = None,
+    result_cache_size_mb: int = 1024,
+    result_cache_days: float = 7,
+    checkpoint_directory: Optional[str] = None,
+    metrics_port: Optional[int] = None,
+    metrics_hostname: str = "127.0.0.1",
     verbosity: int = 0,
     log_directory: Optional[str] = None,
     log_backup_days: int = 7,
@@ -146,8 +294,16 @@ def main(
 
     logger.setLevel(logger_level)
     logger.warning("Start up.")
-    pool = mp.Pool(processes=workers)
-
+    result_cache = None
+    if result_cache_directory is not None:
+        result_cache = ResultCache(
+            result_cache_directory,
+            max_size_bytes=result_cache_size_mb*1024*1024,
+            max_age_s=result_cache_days*24*60*60
+        )
+    checkpoints = None
+    if checkpoint_directory is not None:
+        checkpoints = JobCheckpoints(checkpoint_directory, service_id, logger=logger)
     context_dict = {}
     context_name = context
     assert import_module(context_name, modulePrefix="context", definition_dict=context_dict, logger=logger)
@@ -162,6 +318,8 @@ def main(
         service_id,
         host=redis_hostname,
         port=redis_port,
+        message_transport=message_transport,
+        stream_maxlen=stream_maxlen,
     )
 
     redis_interface.context = context_name
@@ -170,64 +328,184 @@ def main(
         delim_idx = kvstr.index("=")
         redis_interface.set(kvstr[0:delim_idx], kvstr[delim_idx + 1 :])
 
+    # the workers import the current context and stages before reporting that they are ready,
+    # then report the deadlines of their jobs and their retirement
+    event_queue = mp.SimpleQueue()
+    # the jobs that the workers mark as running, before they are terminated for them
+    running_jobs = mp.Array("q", workers)
+    pool = mp.Pool(
+        processes=workers,
+        initializer=initialise_worker,
+        initargs=(
+            service_id,
+            redis_hostname,
+            redis_port,
+            result_cache,
+            log_directory,
+            message_transport,
+            stream_maxlen,
+            event_queue,
+            running_jobs,
+            max_jobs_per_worker,
+            max_worker_rss_mb,
+            checkpoint_directory
+        ),
+        # workers retire after their job count limit (or exit by themselves over the RSS limit),
+        # to be replaced by the pool
+        maxtasksperchild=max_jobs_per_worker
+    )
+
     previous_stage_list = None
+    # the stage modules whose keys are passed to jobs and kept, resolved once (and reloaded if changed)
+    stage_dict = {}
     cleanup_stability_factor = 5
     process_changed_count = 0
-    process_asyncobj_jobs: List[Optional[mp.pool.ApplyResult]] = [None]*workers
-    process_states = [ProcessState.Idle]*workers
-    status = ServiceStatus(
-        workers_busy_count=0,
-        workers_total_count=workers,
-        process_job_queue=[]
+    if cluster is None:
+        job_queue = JobQueue(
+            queue_limit,
+            overflow_policy=queue_overflow_policy,
+            spill_directory=queue_spill_directory,
+            logger=logger
+        )
+    else:
+        job_queue = RedisJobQueue(
+            cluster,
+            str(service_id),
+            queue_limit,
+            overflow_policy=queue_overflow_policy,
+            lease_timeout_s=cluster_lease_timeout_s,
+            logger=logger,
+            host=redis_hostname,
+            port=redis_port,
+        )
+        logger.info(f"Sharing the job queue of cluster '{cluster}'.")
+    scheduler = ServiceScheduler(
+        pool,
+        service_id,
+        workers,
+        job_queue,
+        redis_hostname,
+        redis_port,
+        logger,
+        warming=True,
+        running_jobs=running_jobs
+    )
+    scheduler.watch_workers(event_queue)
+    context_runner = ContextRunner(
+        service_id,
+        context_name,
+        context,
+        scheduler,
+        logger
     )
     job_id = 1
+    if checkpoints is not None:
+        # the jobs that the previous service did not finish, resumed ahead of new ones
+        # (and locally, rather than through a cluster's queue, as only this service has the checkpoints)
+        for params in checkpoints.unfinished():
+            logger.warning(f"Resuming job {params.job_id} from its checkpoint.")
+            job_id = max(job_id, params.job_id + 1)
+            redis_interface.job_event_message = JobEventMessage(
+                event=JobEvent.Queue,
+                job_parameters=params
+            )
+            scheduler.resume(params)
 
     sys.excepthook = lambda *args: logger.error("".join(traceback.format_exception(*args)))
     # this happens after exception_hook even in the event of an exception
     atexit.register(lambda: logger.warning("Exiting."))
 
-    context_outputs = None
+    metrics = None
+    metrics_server = None
+    if metrics_port is not None:
+        metrics = ServiceMetrics()
+        metrics_server = metrics.serve(metrics_hostname, metrics_port)
+        logger.info(f"Serving metrics on http://{metrics_hostname}:{metrics_port}/metrics")
+
+    context_finished = False
+    heartbeat_time = 0
     with pool:
+        context_runner.request(redis_interface.context, redis_interface.context_environment)
+        context_runner.start()
+        redis_interface.listen_broadcast_set_messages(
+            lambda message: scheduler.post(ServiceEvent.SetMessage, message)
+        )
+
         while True:
-            for process_id in range(len(process_asyncobj_jobs)):
-                process_async_obj = process_asyncobj_jobs[process_id]
-                if process_async_obj is not None and process_async_obj.ready():
-                    successful = process_async_obj.get() # process is safely wrapped
-                    logger.info(f"Process #{process_id} has {'completed' if successful else 'failed'}.")
-
-                    process_states[process_id] = ProcessState.Finished
-                    if not successful:
-                        process_states[process_id] = ProcessState.Errored
-
-                    process_asyncobj_jobs[process_id] = None
-                    status.workers_busy_count -= 1
-
-                if process_asyncobj_jobs[process_id] is None and len(status.process_job_queue) > 0:
-                    job_parameters = status.process_job_queue.pop(0)
-                    logger.info(f"Spawning Process #{process_id}")
-                    process_asyncobj_jobs[process_id] = pool.apply_async(
-                        PypelineProcess,
-                        (
-                            service_id.process_identifier(process_id),
-                            job_parameters,
-                            redis_hostname,
-                            redis_port
-                        )
+            scheduler.check_deadlines()
+            # Wait on worker completion, broadcast sets and context outputs (or the next deadline)
+            try:
+                events = scheduler.wait(
+                    min(
+                        idle_timeout_s,
+                        max(0, heartbeat_time + heartbeat_period_s - time.time()),
+                        max(0, scheduler.next_deadline() - time.time()),
                     )
-                    process_states[process_id] = ProcessState.Busy
-                    status.workers_busy_count += 1
-
-            redis_interface.process_broadcast_set_messages(0.1)
-            stage_list = redis_interface.stages
-            redis_interface.pulse = datetime.now()
-            redis_interface.status = status
-            redis_interface.processes = process_states
+                )
+            except KeyboardInterrupt:
+                logger.info("Keyboard Interrupt. Awaiting processes...")
+                context_runner.stop()
+                context_finished = True
+                events = []
+
+            context_outputs_list = []
+            for event, payload in events:
+                if event == ServiceEvent.ProcessComplete:
+                    if metrics is not None:
+                        metrics.observe_job_result(payload[1])
+                elif event == ServiceEvent.ProcessTerminated:
+                    process_id, job_parameters, process_note, reason = payload
+                    redis_interface.process_note_message = ProcessNoteMessage(
+                        job_id=job_parameters.job_id,
+                        process_id=process_id,
+                        process_note=process_note,
+                        stage_name=None,
+                        error_message=f"Terminated for {reason}.",
+                    )
+                    context_runner.call(
+                        "note",
+                        process_note,
+                        process_id = service_id.process_identifier(process_id),
+                        logger = logger,
+                        error = TimeoutError(reason) if process_note == ProcessNote.Timeout else RuntimeError(reason),
+                    )
+                    # the terminated worker did not release the job's shared outputs, nor discard its checkpoint
+                    release_shared_outputs(job_parameters.context_output)
+                    if checkpoints is not None:
+                        checkpoints.discard(job_parameters.job_id)
+                elif event == ServiceEvent.SetMessage:
+                    redis_interface.process_broadcast_set_message(payload)
+                elif event == ServiceEvent.ContextRejected:
+                    redis_interface.context = payload
+                elif event == ServiceEvent.ContextOutput:
+                    context_outputs_list.append(payload)
+                elif event == ServiceEvent.ContextFinished:
+                    context_finished = True
+                    logger.warning(f"{context_runner.context_name}.run() returned False. Awaiting processes: {scheduler.snapshot()[0]})")
+
+            status, process_states = scheduler.snapshot()
+            if metrics is not None:
+                metrics.set_status(status)
+            pulse = None
+            if time.time() - heartbeat_time >= heartbeat_period_s:
+                heartbeat_time = time.time()
+                pulse = datetime.now()
+            hash_values = redis_interface.tick(status, process_states, pulse=pulse)
+            stage_list = hash_values["#STAGES"].split(" ") if hash_values["#STAGES"] is not None else None
+            if cluster is not None:
+                # pull the jobs that the other services of the cluster have queued
+                scheduler.dispatch()
+            if hash_values["#CANCEL"] is not None:
+                try:
+                    scheduler.cancel([int(job_id) for job_id in hash_values["#CANCEL"].split()])
+                except ValueError:
+                    logger.warning(f"#CANCEL must be a space delimited list of job IDs, not '{hash_values['#CANCEL']}'.")
 
-            if context_outputs is False:
-                if status.workers_busy_count > 0:
+            if context_finished and len(context_outputs_list) == 0:
+                if scheduler.busy():
                     # continue to wait on processes
                     continue
-                logger.warning(f"{context_name}.run() returned False. Exiting")
+                logger.warning(f"{context_runner.context_name}.run() returned False. Exiting")
                 break
 
             process_changed = (
@@ -244,97 +522,131 @@ def main(
 
                 exclusion_list = get_stage_keys(
                     stage_list,
+                    definition_dict=stage_dict,
                     logger=logger
                 )
                 exclusion_list.extend(redis_interface.REDIS_HASH_KEYS)
                 logger.debug(f"Clear all except: {exclusion_list}")
                 redis_interface.clear(exclusion_list)
 
-            new_context_name = redis_interface.context
-            if new_context_name != context_name:
-                try:
-                    import_module(new_context_name, modulePrefix="context", definition_dict=context_dict, logger=logger)
+            context_runner.request(hash_values["#CONTEXT"], hash_values["#CONTEXTENV"])
 
-                    context_name = new_context_name
-                    context = context_dict.pop(context_name)
-                    context.setup(
-                        service_id.hostname,
-                        service_id.enumeration,
+            for context_name, context_outputs, context_dehydrated, context_environment, priority in context_outputs_list:
+                if cluster is not None:
+                    # the cluster's counter keeps the job IDs (cancelled, noted and checkpointed by) unique across its services
+                    job_id = job_queue.next_job_id()
+                redis_kvcache = redis_interface.get_all()
+                stages_keyvalue = redis_kvcache.get("#STAGES", None)
+                stage_mode = StageMode.Linear
+                try:
+                    stage_mode = StageMode(redis_kvcache.get("#STAGEMODE", StageMode.Linear))
+                except ValueError:
+                    logger.warning(f"#STAGEMODE is not one of {[mode.value for mode in StageMode]}, defaulting to '{stage_mode.value}'.")
+                # the stage names (or '*') to profile, with '+memory' to trace allocations too
+                profile_stages = redis_kvcache.get("#PROFILE", "").split()
+                profile_memory = "+memory" in profile_stages
+                if profile_memory:
+                    profile_stages.remove("+memory")
+
+                # the job's timeout and those of stages' `run()`s (as 'stage=seconds')
+                timeout_s = None
+                stage_timeouts_s = {}
+                for token in redis_kvcache.get("#TIMEOUT", "").split():
+                    try:
+                        if "=" in token:
+                            stage_name, stage_timeout_s = token.split("=", 1)
+                            stage_timeouts_s[stage_name] = float(stage_timeout_s)
+                        else:
+                            timeout_s = float(token)
+                    except ValueError:
+                        logger.warning(f"Ignoring '{token}' of #TIMEOUT, which is not 'seconds' or 'stage=seconds'.")
+
+                for key in redis_interface.REDIS_HASH_KEYS:
+                    redis_kvcache.pop(key, None)
+                # the job only carries the keys of its stages and those that the context lists in REDIS_KEYS
+                try:
+                    job_keys = get_stage_keys(
+                        stages_keyvalue.split(" ") if stages_keyvalue is not None else [],
+                        definition_dict=stage_dict,
                         logger=logger
                     )
-                except:
-                    logger.warning(f"Could not load new Context: `{new_context_name}`. Maintaining current Context: `{context_name}`.")
-                    redis_interface.context = context_name
-
-            # Wait until the process-stage returns outputs
-            context_environment = redis_interface.context_environment
-            try:
-                context_outputs = context.run(
-                    env=context_environment,
-                    logger=logger
+                except BaseException as err:
+                    # the worker reports the stage that cannot be loaded
+                    logger.warning(f"Passing all keys to job {job_id}, as its stages' keys could not be resolved: {repr(err)}")
+                else:
+                    job_keys.extend(getattr(context_runner.context, "REDIS_KEYS", []))
+                    redis_kvcache = {
+                        key: redis_kvcache[key]
+                        for key in job_keys
+                        if key in redis_kvcache
+                    }
+
+                params = JobParameters(
+                    job_id=job_id,
+                    redis_kvcache=redis_kvcache,
+                    context_name=context_name,
+                    context_output=context_outputs,
+                    context_dehydrated=context_dehydrated,
+                    stage_list=stages_keyvalue.split(" ") if stages_keyvalue is not None else [],
+                    stage_mode=stage_mode,
+                    priority=priority,
+                    profile_stages=profile_stages,
+                    profile_memory=profile_memory,
+                    timeout_s=timeout_s,
+                    stage_timeouts_s=stage_timeouts_s
                 )
-            except KeyboardInterrupt:
-                logger.info("Keyboard Interrupt. Awaiting processes...")
-                context_outputs = False
-                continue
+                job_id += 1
+                event = JobEvent.Queue
 
-            if context_outputs is None:
-                # logger.debug(f"{context_name}.run() returned None.")
-                continue
-            if context_outputs is False:
-                logger.warning(f"{context_name}.run() returned False. Awaiting processes: {status})")
-                continue
+                if stages_keyvalue is None or "skip" in stages_keyvalue[0:4]:
+                    logger.info(f"#STAGES key begins with 'skip' or is missing. Not processing. ('{stages_keyvalue}')")
+                    event=JobEvent.Skip
 
-            redis_kvcache = redis_interface.get_all()
-            stages_keyvalue = redis_kvcache.get("#STAGES", None)
-            
-            for key in redis_interface.REDIS_HASH_KEYS:
-                redis_kvcache.pop(key, None)
-
-            params = JobParameters(
-                job_id=job_id,
-                redis_kvcache=redis_kvcache,
-                context_name=context_name,
-                context_output=context_outputs,
-                context_dehydrated=context.dehydrate(),
-                stage_list=stages_keyvalue.split(" ") if stages_keyvalue is not None else []
-            )
-            job_id += 1
-            event = JobEvent.Queue
-
-            if stages_keyvalue is None or "skip" in stages_keyvalue[0:4]:
-                logger.info(f"#STAGES key begins with 'skip' or is missing. Not processing. ('{stages_keyvalue}')")
-                event=JobEvent.Skip
-
-            elif len(status.process_job_queue) == queue_limit:
-                message = f"Queue limit of {queue_limit} reached."
-                logger.warning(message)
-
-                event=JobEvent.Drop
-                if hasattr(context, "note"):
-                    context.note( # TODO change to service note
-                        ProcessNote.Error,
-                        process_id = None,
-                        logger = logger,
-                        error = RuntimeError(message),
-                    )
+                elif not scheduler.admits(params):
+                    event=JobEvent.Drop
+                    note_dropped_job(context_runner, queue_limit, logger)
 
-            job_event_message = JobEventMessage(
-                event=event,
-                job_parameters=params,
-                context_environment=context_environment
-            )
-            logger.debug(f"job_event_message: {job_event_message}")
-            redis_interface.job_event_message = job_event_message
-            if event != JobEvent.Queue:
-                continue
+                job_event_message = JobEventMessage(
+                    event=event,
+                    job_parameters=params,
+                    context_environment=context_environment
+                )
+                logger.debug(f"job_event_message: {job_event_message}")
+                redis_interface.job_event_message = job_event_message
+                if metrics is not None:
+                    metrics.count_job({
+                        JobEvent.Queue: JobOutcome.Queued,
+                        JobEvent.Drop: JobOutcome.Dropped,
+                        JobEvent.Skip: JobOutcome.Skipped,
+                    }[event])
+                # a queued job takes ownership of the shared outputs
+                release_shared_outputs(context_outputs, unlink=event != JobEvent.Queue)
+                if event != JobEvent.Queue:
+                    continue
+
+                dropped_params = scheduler.enqueue(params)
+                if dropped_params is not None:
+                    note_dropped_job(context_runner, queue_limit, logger)
+                    redis_interface.job_event_message = JobEventMessage(
+                        event=JobEvent.Drop,
+                        job_parameters=dropped_params,
+                        context_environment=context_environment
+                    )
+                    release_shared_outputs(dropped_params.context_output)
+                    if checkpoints is not None:
+                        checkpoints.discard(dropped_params.job_id)
+                    if metrics is not None:
+                        metrics.count_job(JobOutcome.Dropped)
 
-            status.process_job_queue.append(params)
-    
     atexit.unregister(lambda: logger.warning("Exiting."))
+    if cluster is not None:
+        job_queue.close()
     pool.close()
     logger.warning("Finished.")
     pool.join()
-    if hasattr(context, "reset"):
-        context.reset()
+    event_queue.put(None)
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    if hasattr(context_runner.context, "reset"):
+        context_runner.context.reset()
     logger.handlers.clear()
@@ -0,0 +1,138 @@
+import os
+import time
+import glob
+import heapq
+import pickle
+import logging
+import itertools
+import threading
+from collections import deque
+from typing import List, Optional, Tuple
+
+from .dataclasses import JobParameters, QueueOverflowPolicy
+
+
+class JobQueue:
+    """
+    A priority queue of jobs: higher `JobParameters.priority` first, then first-in-first-out.
+
+    Once `limit` jobs are queued, the `overflow_policy` applies:
+        - DropNewest: the incoming job is not admitted
+        - DropOldest: the oldest of the lowest priority jobs is dropped (the incoming job,
+          if its priority is lower than that of every queued job)
+        - Block: jobs are admitted, and `wait_for_space` blocks until the queue is below its limit
+        - Spill: jobs are pickled to the `spill_directory` until they are popped
+
+    Tracks the time that popped jobs waited in the queue.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        overflow_policy: QueueOverflowPolicy = QueueOverflowPolicy.DropNewest,
+        spill_directory: Optional[str] = None,
+        wait_window: int = 100,
+        logger: Optional[logging.Logger] = None,
+    ):
+        if overflow_policy == QueueOverflowPolicy.Spill and spill_directory is None:
+            raise ValueError("The spill overflow policy requires a spill directory.")
+
+        self.limit = limit
+        self.overflow_policy = overflow_policy
+        self.spill_directory = spill_directory
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+
+        # entries are (-priority, sequence, enqueue_time, job_parameters or spill filepath)
+        self._heap: List[Tuple[int, int, float, JobParameters]] = []
+        self._spilled: List[Tuple[int, int, float, str]] = []
+        self._sequence = itertools.count()
+        self._wait_times_s = deque(maxlen=wait_window)
+        self._space = threading.Condition()
+
+        if self.spill_directory is not None:
+            os.makedirs(self.spill_directory, exist_ok=True)
+            stale_filepaths = glob.glob(os.path.join(self.spill_directory, "job_*.pkl"))
+            if len(stale_filepaths) > 0:
+                # their context outputs do not outlive the previous service
+                self.logger.warning(f"Removing {len(stale_filepaths)} stale spilled job(s) from {self.spill_directory}.")
+                for filepath in stale_filepaths:
+                    os.remove(filepath)
+
+    def __len__(self) -> int:
+        return len(self._heap) + len(self._spilled)
+
+    def full(self) -> bool:
+        return len(self) >= self.limit
+
+    def admits(self, job_parameters: JobParameters) -> bool:
+        """Whether a push of the job would queue it."""
+        return not (self.full() and self.overflow_policy == QueueOverflowPolicy.DropNewest)
+
+    def push(self, job_parameters: JobParameters) -> Optional[JobParameters]:
+        """
+        Returns:
+            JobParameters
+                The job dropped to respect the queue's limit, if any.
+        """
+        entry = (-job_parameters.priority, next(self._sequence), time.time(), job_parameters)
+        dropped = None
+
+        if self.full():
+            if self.overflow_policy == QueueOverflowPolicy.DropNewest or (
+                self.overflow_policy == QueueOverflowPolicy.DropOldest and len(self._heap) == 0
+            ):
+                return job_parameters
+            if self.overflow_policy == QueueOverflowPolicy.DropOldest:
+                # the lowest priority then oldest is the largest (-priority, -sequence), which
+                # is the incoming job only if it has a lower priority than all of the queued jobs
+                oldest_index = max(
+                    range(len(self._heap)),
+                    key=lambda i: (self._heap[i][0], -self._heap[i][1])
+                )
+                if entry[0] > self._heap[oldest_index][0]:
+                    return job_parameters
+                dropped = self._heap.pop(oldest_index)[-1]
+                heapq.heapify(self._heap)
+            elif self.overflow_policy == QueueOverflowPolicy.Spill:
+                filepath = os.path.join(self.spill_directory, f"job_{job_parameters.job_id}_{entry[1]}.pkl")
+                with open(filepath, "wb") as fio:
+                    pickle.dump(job_parameters, fio)
+                heapq.heappush(self._spilled, entry[0:3] + (filepath,))
+                return None
+
+        heapq.heappush(self._heap, entry)
+        return dropped
+
+    def pop(self) -> Optional[JobParameters]:
+        if len(self) == 0:
+            return None
+
+        if len(self._spilled) > 0 and (len(self._heap) == 0 or self._spilled[0][0:2] < self._heap[0][0:2]):
+            _, _, enqueue_time, filepath = heapq.heappop(self._spilled)
+            with open(filepath, "rb") as fio:
+                job_parameters = pickle.load(fio)
+            os.remove(filepath)
+        else:
+            _, _, enqueue_time, job_parameters = heapq.heappop(self._heap)
+
+        self._wait_times_s.append(time.time() - enqueue_time)
+        with self._space:
+            self._space.notify_all()
+        return job_parameters
+
+    def complete(self, job_parameters: JobParameters):
+        """Popped jobs are not leased (see `RedisJobQueue.complete`), so there is nothing to end."""
+        pass
+
+    def wait_for_space(self, timeout_s: Optional[float] = None) -> bool:
+        """Blocks while the queue of the block overflow policy is full, returning whether there is space."""
+        if self.overflow_policy != QueueOverflowPolicy.Block:
+            return True
+        with self._space:
+            return self._space.wait_for(lambda: not self.full(), timeout=timeout_s)
+
+    def wait_time_statistics(self) -> Tuple[Optional[float], Optional[float]]:
+        """The mean and maximum wait (in seconds) of the recently popped jobs."""
+        if len(self._wait_times_s) == 0:
+            return None, None
+        return sum(self._wait_times_s)/len(self._wait_times_s), max(self._wait_times_s)
@@ -0,0 +1,129 @@
+import threading
+from enum import Enum
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+from .dataclasses import JobResult, ServiceStatus
+
+
+class JobOutcome(str, Enum):
+    Queued = "queued"
+    Dropped = "dropped"
+    Skipped = "skipped"
+    Completed = "completed"
+    Errored = "errored"
+
+
+class ServiceMetrics:
+    """
+    The metrics of a service, rendered in the Prometheus text exposition format:
+        - pypeline_jobs_total{outcome}: the jobs queued, dropped, skipped, completed and errored
+        - pypeline_workers_busy, pypeline_workers_total and pypeline_jobs_queued
+        - pypeline_stage_duration_seconds{stage}: a histogram of the `run()` durations of
+          each stage, from the `StageTimestamp`s of the completed processes (for a resumed
+          job, only those of the runs made after the resume)
+    """
+
+    STAGE_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+    def __init__(self):
+        self.job_counts: Dict[JobOutcome, int] = {
+            outcome: 0
+            for outcome in JobOutcome
+        }
+        self.status = None
+        # per stage: the bucket counts (the last being +Inf), sum and count
+        self.stage_durations: Dict[str, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def count_job(self, outcome: JobOutcome):
+        with self._lock:
+            self.job_counts[outcome] += 1
+
+    def set_status(self, status: ServiceStatus):
+        with self._lock:
+            self.status = status
+
+    def observe_stage_duration(self, stage_name: str, duration_s: float):
+        with self._lock:
+            buckets, total_s, count = self.stage_durations.get(
+                stage_name,
+                ([0]*(len(self.STAGE_DURATION_BUCKETS) + 1), 0.0, 0)
+            )
+            for bucket_index, upper_bound in enumerate(self.STAGE_DURATION_BUCKETS):
+                if duration_s <= upper_bound:
+                    break
+            else:
+                bucket_index = len(self.STAGE_DURATION_BUCKETS)
+            buckets[bucket_index] += 1
+            self.stage_durations[stage_name] = (buckets, total_s + duration_s, count + 1)
+
+    def observe_job_result(self, job_result: JobResult):
+        self.count_job(JobOutcome.Completed if job_result.successful else JobOutcome.Errored)
+        if job_result.status is None:
+            return
+        for stage_timestamp in job_result.status.stage_timestamps[job_result.status.resumed_run_count:]:
+            if stage_timestamp.end is not None:
+                self.observe_stage_duration(stage_timestamp.name, stage_timestamp.end - stage_timestamp.start)
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [
+                "# HELP pypeline_jobs_total The jobs of the service, by outcome.",
+                "# TYPE pypeline_jobs_total counter",
+            ]
+            lines.extend(
+                f'pypeline_jobs_total{{outcome="{outcome.value}"}} {count}'
+                for outcome, count in self.job_counts.items()
+            )
+
+            if self.status is not None:
+                for name, help, value in [
+                    ("pypeline_workers_busy", "The workers processing a job.", self.status.workers_busy_count),
+                    ("pypeline_workers_total", "The workers of the service.", self.status.workers_total_count),
+                    ("pypeline_jobs_queued", "The jobs awaiting a worker.", self.status.jobs_queued_count),
+                ]:
+                    lines.extend([
+                        f"# HELP {name} {help}",
+                        f"# TYPE {name} gauge",
+                        f"{name} {value}",
+                    ])
+
+            lines.extend([
+                "# HELP pypeline_stage_duration_seconds The durations of the stages' `run()`.",
+                "# TYPE pypeline_stage_duration_seconds histogram",
+            ])
+            for stage_name, (buckets, total_s, count) in self.stage_durations.items():
+                stage_label = stage_name.replace("\\", "\\\\").replace('"', '\\"')
+                cumulative_count = 0
+                for upper_bound, bucket_count in zip(self.STAGE_DURATION_BUCKETS + ("+Inf",), buckets):
+                    cumulative_count += bucket_count
+                    lines.append(f'pypeline_stage_duration_seconds_bucket{{stage="{stage_label}",le="{upper_bound}"}} {cumulative_count}')
+                lines.append(f'pypeline_stage_duration_seconds_sum{{stage="{stage_label}"}} {total_s}')
+                lines.append(f'pypeline_stage_duration_seconds_count{{stage="{stage_label}"}} {count}')
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, hostname: str, port: int) -> ThreadingHTTPServer:
+        '''Serves the metrics at `http://{hostname}:{port}/metrics` from a daemon thread.'''
+        metrics = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ["/", "/metrics"]:
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((hostname, port), MetricsRequestHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="pypeline.metrics", daemon=True).start()
+        return server
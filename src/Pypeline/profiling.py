@@ -0,0 +1,135 @@
+import io
+import os
+import time
+import pstats
+import cProfile
+import inspect
+import logging
+import itertools
+import threading
+import tracemalloc
+from typing import Callable, List, Optional, Tuple
+
+from .dataclasses import JobParameters, ProcessIdentifier, StageProfile
+
+# only one profiler can be active at a time (since Python 3.12), so profiled runs are serialised
+PROFILE_LOCK = threading.Lock()
+PROFILE_TOP_COUNT = 10
+_profile_sequence = itertools.count()
+
+
+def profiles_stage(job_parameters: JobParameters, stage_name: str) -> bool:
+    return "*" in job_parameters.profile_stages or stage_name in job_parameters.profile_stages
+
+
+class StageProfiler:
+    """
+    Wraps the `run()` of a stage with cProfile (and optionally tracemalloc), writing
+    the profile to a file and summarising it in a `StageProfile`.
+
+    Created with `StageProfiler.for_stage`, which returns None for the stages that
+    are not profiled.
+    """
+
+    def __init__(
+        self,
+        stage_name: str,
+        memory: bool,
+        directory: str,
+        filename_prefix: str,
+        logger: logging.Logger
+    ):
+        self.stage_name = stage_name
+        self.memory = memory
+        self.directory = directory
+        self.filename_prefix = filename_prefix
+        self.logger = logger
+
+    @staticmethod
+    def for_stage(
+        job_parameters: JobParameters,
+        identifier: ProcessIdentifier,
+        stage,
+        stage_name: str,
+        directory: str,
+        logger: logging.Logger
+    ) -> Optional["StageProfiler"]:
+        if not profiles_stage(job_parameters, stage_name):
+            return None
+        if inspect.iscoroutinefunction(stage.run):
+            logger.warning(f"Not profiling {stage_name}: the `run()` of async stages cannot be profiled.")
+            return None
+
+        safe_stage_name = stage_name.replace("&", "")
+        return StageProfiler(
+            stage_name,
+            job_parameters.profile_memory,
+            directory,
+            f"profile_{identifier.hostname}_{identifier.enumeration}.{identifier.process_enumeration}_job{job_parameters.job_id}_{safe_stage_name}",
+            logger
+        )
+
+    def run(self, run: Callable) -> Tuple[object, StageProfile]:
+        '''
+        Returns:
+            Tuple[object, StageProfile]
+                The return of `run()` and the profile of it.
+        '''
+        with PROFILE_LOCK:
+            tracing_memory = self.memory and not tracemalloc.is_tracing()
+            if tracing_memory:
+                tracemalloc.start()
+            elif self.memory:
+                tracemalloc.reset_peak()
+
+            profiler = cProfile.Profile()
+            start = time.time()
+            try:
+                profiler.enable()
+                try:
+                    outputs = run()
+                finally:
+                    profiler.disable()
+            finally:
+                duration_s = time.time() - start
+                memory_peak_bytes = None
+                top_allocations = []
+                if self.memory:
+                    memory_peak_bytes = tracemalloc.get_traced_memory()[1]
+                    top_allocations = [
+                        str(statistic)
+                        for statistic in tracemalloc.take_snapshot().statistics("lineno")[0:PROFILE_TOP_COUNT]
+                    ]
+                if tracing_memory:
+                    tracemalloc.stop()
+
+        return outputs, StageProfile(
+            stage_name=self.stage_name,
+            filepath=self._dump(profiler),
+            duration_s=duration_s,
+            top_functions=self._top_functions(profiler),
+            memory_peak_bytes=memory_peak_bytes,
+            top_allocations=top_allocations,
+        )
+
+    def _dump(self, profiler: cProfile.Profile) -> Optional[str]:
+        filepath = os.path.join(
+            self.directory,
+            f"{self.filename_prefix}_{next(_profile_sequence)}.prof"
+        )
+        try:
+            profiler.dump_stats(filepath)
+        except OSError as err:
+            self.logger.warning(f"Could not write the profile of {self.stage_name} to {filepath}: {repr(err)}")
+            return None
+        return filepath
+
+    @staticmethod
+    def _top_functions(profiler: cProfile.Profile) -> List[str]:
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE)
+        return [
+            f"{stats.stats[function][3]:0.6f} s cumulative, {stats.stats[function][1]} call(s): {pstats.func_std_string(function)}"
+            for function in stats.fcn_list[0:PROFILE_TOP_COUNT]
+        ]
@@ -1,16 +1,22 @@
 from typing import List, Dict, Optional, Callable, Any
 from datetime import datetime
+import collections
+import socket
 import json
+import os
+import threading
 
 import redis
 
-from .dataclasses import ServiceIdentifier, ProcessIdentifier, ServiceStatus, ProcessState, ProcessStatus, JobEventMessage, ProcessNoteMessage
+from .dataclasses import ServiceIdentifier, ProcessIdentifier, ServiceStatus, ProcessState, ProcessStatus, StageTimestamp, JobEventMessage, ProcessNoteMessage, MessageTransport
 
 
 class _RedisStatusInterface:
     def __init__(self, redis_address: str, *channel_subscriptions: List[str], **redis_kwargs):
         redis_kwargs["decode_responses"] = redis_kwargs.get("decode_responses", True)
         ignore_subscribe_messages = redis_kwargs.pop("ignore_subscribe_messages", True)
+        self.message_transport = MessageTransport(redis_kwargs.pop("message_transport", MessageTransport.PubSub))
+        self.stream_maxlen = redis_kwargs.pop("stream_maxlen", 10000)
         self.redis_obj = redis.Redis(**redis_kwargs)
         self.redis_address = redis_address
         self.rh_status = f"pypeline://{self.redis_address}/status"
@@ -51,6 +57,25 @@ class _RedisStatusInterface:
     def get_all(self):
         return self.redis_obj.hgetall(self.rh_status)
 
+    def _stage_timestamps_key(self, process_id: int) -> str:
+        return f"{self.rh_status}/{process_id}/stage_timestamps"
+
+    def read_process_status(self, process_id: int) -> ProcessStatus:
+        """Assembles the full ProcessStatus from its `STATUS:{process_id}` field and stage-timestamp list."""
+        pipe = self.redis_obj.pipeline(transaction=False)
+        pipe.hget(self.rh_status, f"STATUS:{process_id}")
+        pipe.lrange(self._stage_timestamps_key(process_id), 0, -1)
+        status_str, stage_timestamp_strs = pipe.execute()
+        if status_str is None:
+            raise KeyError(f"STATUS:{process_id}")
+
+        status = ProcessStatus.model_validate_json(status_str)
+        status.stage_timestamps = [
+            StageTimestamp.model_validate_json(stage_timestamp_str)
+            for stage_timestamp_str in stage_timestamp_strs
+        ]
+        return status
+
     def clear(self, exclusion_list=[]):
         all_keys = self.redis_obj.hkeys(self.rh_status)
         keys_to_clear = [key for key in all_keys if key not in exclusion_list]
@@ -58,7 +83,15 @@ class _RedisStatusInterface:
             self.redis_obj.hdel(self.rh_status, *keys_to_clear)
     
     def publish(self, channel, message, assertion_tuple=(True, "")):
+        """Publishes to the channel, or appends to its stream (capped at `stream_maxlen`) under the Streams transport."""
         assert assertion_tuple[0], assertion_tuple[1]
+        if self.message_transport == MessageTransport.Streams:
+            return self.redis_obj.xadd(
+                f"pypeline://{self.redis_address}/{channel}",
+                {"data": message},
+                maxlen=self.stream_maxlen,
+                approximate=True
+            )
         return self.redis_obj.publish(f"pypeline://{self.redis_address}/{channel}", message)
 
     def get_message(self,
@@ -73,30 +106,148 @@ class _RedisStatusInterface:
 
 
 class RedisServiceInterface(_RedisStatusInterface):
-    REDIS_HASH_KEYS = ["#CONTEXT", "#CONTEXTENV", "#STAGES", "STATUS", "PULSE", "PROCESSES"]
+    REDIS_HASH_KEYS = ["#CONTEXT", "#CONTEXTENV", "#STAGES", "#STAGEMODE", "#PROFILE", "#TIMEOUT", "#CANCEL", "STATUS", "PULSE", "PROCESSES"]
+    TICK_KEYS = ["#CONTEXT", "#CONTEXTENV", "#STAGES"]
+    # the keys that are read and cleared by each tick, being one-off requests
+    TICK_TAKE_KEYS = ["#CANCEL"]
 
-    def __init__(self, id: ServiceIdentifier, **redis_kwargs):
+    def __init__(self, id: ServiceIdentifier, subscribe_broadcast: bool = True, **redis_kwargs):
         if not isinstance(id, ServiceIdentifier):
             raise ValueError("Interface ID must be an instance of ProcessIdentifier")
-        super().__init__(id.redis_address(), "/set", **redis_kwargs)
+        channel_subscriptions = ["/set"] if subscribe_broadcast else []
+        super().__init__(id.redis_address(), *channel_subscriptions, **redis_kwargs)
         self.id = id
-
+        self._tick_written = {}
+        # per process: what has been written of the job's status, see `write_process_status`
+        self._process_status_written = {}
+        self._process_status_lock = threading.Lock()
+
+    def _processes_str(self, value: List[ProcessState]) -> str:
+        return json.dumps({
+            str(self.id.process_identifier(i)): v
+            for i, v in enumerate(value)
+        })
+
+    def tick(
+        self,
+        status: ServiceStatus,
+        processes: List[ProcessState],
+        pulse: Optional[datetime] = None
+    ) -> Dict[str, Optional[str]]:
+        """Writes the service fields and reads the `TICK_KEYS` (and takes the `TICK_TAKE_KEYS`) in a single round trip.
+
+        STATUS and PROCESSES are only written when their values have changed since
+        the last tick, unless a `pulse` is given, which rewrites all of them.
+
+        Returns:
+            Dict[str, Optional[str]]
+                The values of the `TICK_KEYS` and `TICK_TAKE_KEYS`, None for those that are missing.
+        """
+        fields = {
+            "STATUS": str(status),
+            "PROCESSES": self._processes_str(processes),
+        }
+        if pulse is not None:
+            fields["PULSE"] = pulse.strftime("%Y/%m/%d %H:%M:%S")
+        else:
+            fields = {
+                key: value
+                for key, value in fields.items()
+                if self._tick_written.get(key) != value
+            }
+
+        pipe = self.redis_obj.pipeline(transaction=True)
+        if len(fields) > 0:
+            pipe.hset(self.rh_status, mapping=fields)
+        pipe.hmget(self.rh_status, self.TICK_KEYS + self.TICK_TAKE_KEYS)
+        pipe.hdel(self.rh_status, *self.TICK_TAKE_KEYS)
+        values = pipe.execute()[-2]
+
+        self._tick_written.update(fields)
+        return dict(zip(self.TICK_KEYS + self.TICK_TAKE_KEYS, values))
+
+
+    def write_process_status(self, status: ProcessStatus):
+        """Writes the status incrementally, in a single round trip.
+
+        The `STATUS:{process_id}` field holds the status without its stage timestamps,
+        which are appended to a list as they are added (and updated while unfinished),
+        so that a job's writes do not grow with its permutations.
+        """
+        assert isinstance(status, ProcessStatus), "Must be instance of ProcessStatus"
+        with self._process_status_lock:
+            list_key = self._stage_timestamps_key(status.process_id)
+            pipe = self.redis_obj.pipeline(transaction=False)
+
+            written = self._process_status_written.get(status.process_id)
+            # rather than the `id()` of the status, which a later status can reuse
+            if written is None or written["run"] != status._run_token:
+                written = {
+                    "run": status._run_token,
+                    "count": 0,
+                    # the index and serialisation of the unfinished stage timestamps
+                    "pending": {},
+                    "head": None,
+                }
+                self._process_status_written[status.process_id] = written
+                pipe.delete(list_key)
+
+            pending = written["pending"]
+            for index, stage_timestamp_str in list(pending.items()):
+                stage_timestamp = status.stage_timestamps[index]
+                current_str = stage_timestamp.model_dump_json()
+                if current_str != stage_timestamp_str:
+                    pipe.lset(list_key, index, current_str)
+                    pending[index] = current_str
+                if stage_timestamp.end is not None:
+                    pending.pop(index)
+
+            new_stage_timestamps = status.stage_timestamps[written["count"]:]
+            if len(new_stage_timestamps) > 0:
+                new_stage_timestamp_strs = [
+                    stage_timestamp.model_dump_json()
+                    for stage_timestamp in new_stage_timestamps
+                ]
+                pipe.rpush(list_key, *new_stage_timestamp_strs)
+                for index, stage_timestamp in enumerate(new_stage_timestamps, start=written["count"]):
+                    if stage_timestamp.end is None:
+                        pending[index] = new_stage_timestamp_strs[index - written["count"]]
+                written["count"] += len(new_stage_timestamps)
+
+            head = status.model_dump_json(exclude={"stage_timestamps"})
+            # the head is rewritten with any change, in case the field was cleared
+            if head != written["head"] or len(pipe) > 0:
+                pipe.hset(self.rh_status, f"STATUS:{status.process_id}", head)
+                written["head"] = head
+                pipe.execute()
+
+    def process_broadcast_set_message(self, message):
+        if isinstance(message.get("data"), bytes):
+            message["data"]  = message["data"].decode()
+        # TODO rather implement redis_obj.hset(, mapping={})
+        for keyvaluestr in message["data"].split("\n"):
+            parts = keyvaluestr.split("=")
+            self.set(parts[0], '='.join(parts[1:]))
 
     def process_broadcast_set_messages(self, timeout_s):
         message = self.rc_subscriptions["/set"].get_message(timeout=timeout_s)
         if message is None:
             return False
         while message is not None:
-            if isinstance(message.get("data"), bytes):
-                message["data"]  = message["data"].decode()
-            # TODO rather implement redis_obj.hset(, mapping={})
-            for keyvaluestr in message["data"].split("\n"):
-                parts = keyvaluestr.split("=")
-                self.set(parts[0], '='.join(parts[1:]))
-
+            self.process_broadcast_set_message(message)
             message = self.rc_subscriptions["/set"].get_message(timeout=timeout_s)
         return True
 
+    def listen_broadcast_set_messages(self, handler: Callable[[dict], None]) -> threading.Thread:
+        """Starts a daemon thread that blocks on the '/set' subscription, passing each message to `handler`."""
+        def _listen():
+            for message in self.rc_subscriptions["/set"].listen():
+                handler(message)
+
+        thread = threading.Thread(target=_listen, name=f"{self.id}./set", daemon=True)
+        thread.start()
+        return thread
+
     job_event_message: JobEventMessage = property(
         fget=None,
         fset=lambda self, value: self.publish(
@@ -157,10 +308,7 @@ class RedisServiceInterface(_RedisStatusInterface):
         },
         fset=lambda self, value: self.set(
             "PROCESSES",
-            json.dumps({
-                str(self.id.process_identifier(i)): v
-                for i, v in enumerate(value)
-            }),
+            self._processes_str(value),
             assertion_tuple=(
                 all(map(
                     lambda v: isinstance(v, ProcessState),
@@ -189,32 +337,144 @@ class RedisServiceInterface(_RedisStatusInterface):
 
     process_status: ProcessStatus = property(
         fget=lambda self: [
-            ProcessStatus(**json.loads[self.__getitem__(f"STATUS:{process_id}")])
+            self.read_process_status(process_id)
             for process_id in range(self.status.workers_total_count)
         ],
-        fset=lambda self, value: self.set(
-            f"STATUS:{value.process_id}",
-            str(value),
-            assertion_tuple=(isinstance(value, ProcessStatus), f"Must be instance of ProcessStatus")
-        ),
+        fset=lambda self, value: self.write_process_status(value),
         fdel=None,
-        doc="ProcessStatus object."
+        doc="ProcessStatus object, written incrementally (see `write_process_status`)."
     )
 
 class RedisClientInterface(_RedisStatusInterface):
+    """
+    Under the Streams transport (`message_transport="streams"`), the 'jobs' and 'notes'
+    messages are read from their streams in batches of up to `batch_size`. Clients that
+    share a `consumer_group` share its messages, each being read by one of them, and a
+    message is acknowledged with the next read after it has been got. Without a consumer
+    group, a client reads every message added after its creation.
+    """
 
     def __init__(self, id: ServiceIdentifier, **redis_kwargs):
         if not isinstance(id, ServiceIdentifier):
             raise ValueError("Interface ID must be an instance of ProcessIdentifier")
         self.timeout_s = redis_kwargs.pop("timeout_s", 0.5)
+        self.batch_size = redis_kwargs.pop("batch_size", 100)
+        self.consumer_group = redis_kwargs.pop("consumer_group", None)
+        self.consumer_name = redis_kwargs.pop("consumer_name", f"{socket.gethostname()}:{os.getpid()}")
+        message_channels = [
+            f"{id.redis_address()}/jobs",
+            f"{id.redis_address()}/notes",
+        ]
+        streamed = MessageTransport(redis_kwargs.get("message_transport", MessageTransport.PubSub)) == MessageTransport.Streams
         super().__init__(
             id.redis_address(),
             "/set",
-            f"{id.redis_address()}/jobs",
-            f"{id.redis_address()}/notes",
+            *([] if streamed else message_channels),
             **redis_kwargs
         )
         self.id = id
+        # per streamed channel: the ID to read after, the messages read but not yet got
+        # and the IDs of those got but not yet acknowledged
+        self._stream_ids = {}
+        self._stream_buffers = {}
+        self._stream_acks = {}
+        if streamed:
+            for channel in message_channels:
+                self._join_stream(channel)
+
+    def _join_stream(self, channel: str):
+        stream_key = f"pypeline://{channel}"
+        self._stream_buffers[channel] = collections.deque()
+        self._stream_acks[channel] = []
+        if self.consumer_group is None:
+            last_entries = self.redis_obj.xrevrange(stream_key, count=1)
+            self._stream_ids[channel] = last_entries[0][0] if len(last_entries) > 0 else "0-0"
+            return
+
+        try:
+            self.redis_obj.xgroup_create(stream_key, self.consumer_group, id="$", mkstream=True)
+        except redis.ResponseError as err:
+            if "BUSYGROUP" not in str(err):
+                raise
+        # first re-read the messages that this consumer was given but did not acknowledge
+        self._stream_ids[channel] = "0"
+
+    def _read_stream(self, channel: str, count: int, timeout_s: Optional[float]) -> List[dict]:
+        stream_key = f"pypeline://{channel}"
+        block_ms = None if timeout_s == 0 else (0 if timeout_s is None else max(1, int(timeout_s*1000)))
+        while True:
+            if self.consumer_group is None:
+                entries = self.redis_obj.xread(
+                    {stream_key: self._stream_ids[channel]},
+                    count=count,
+                    block=block_ms
+                )
+            else:
+                pending = self._stream_ids[channel] == "0"
+                pipe = self.redis_obj.pipeline(transaction=False)
+                acks = self._stream_acks[channel]
+                if len(acks) > 0:
+                    pipe.xack(stream_key, self.consumer_group, *acks)
+                pipe.xreadgroup(
+                    self.consumer_group,
+                    self.consumer_name,
+                    {stream_key: self._stream_ids[channel]},
+                    count=count,
+                    block=None if pending else block_ms
+                )
+                entries = pipe.execute()[-1]
+                self._stream_acks[channel] = []
+
+            entries = entries[0][1] if entries else []
+            if self.consumer_group is not None and pending and len(entries) == 0:
+                self._stream_ids[channel] = ">"
+                continue
+            break
+
+        if self.consumer_group is None and len(entries) > 0:
+            self._stream_ids[channel] = entries[-1][0]
+        return [
+            {"type": "stream", "channel": stream_key, "id": entry_id, "data": fields["data"]}
+            for entry_id, fields in entries
+        ]
+
+    def get_messages(self,
+        channel,
+        data_constructor: Optional[Callable[[str], Any]] = None,
+        timeout_s: Optional[float] = None,
+        count: Optional[int] = None
+    ) -> List[Any]:
+        """Gets up to `count` (default `batch_size`) messages, only blocking (up to `timeout_s`) for the first."""
+        count = self.batch_size if count is None else count
+        if channel in self._stream_buffers:
+            buffer = self._stream_buffers[channel]
+            if len(buffer) == 0:
+                buffer.extend(self._read_stream(channel, max(count, self.batch_size), timeout_s))
+            messages = [buffer.popleft() for _ in range(min(count, len(buffer)))]
+            if self.consumer_group is not None:
+                self._stream_acks[channel].extend(message["id"] for message in messages)
+        else:
+            messages = []
+            message = self.rc_subscriptions[channel].get_message(timeout=timeout_s)
+            while message is not None:
+                messages.append(message)
+                if len(messages) >= count:
+                    break
+                message = self.rc_subscriptions[channel].get_message(timeout=0)
+
+        if data_constructor is not None:
+            return [data_constructor(message["data"]) for message in messages]
+        return messages
+
+    def get_message(self,
+        channel,
+        data_constructor: Optional[Callable[[str], Any]] = None,
+        timeout_s: Optional[float] = None
+    ):
+        if channel not in self._stream_buffers:
+            return super().get_message(channel, data_constructor=data_constructor, timeout_s=timeout_s)
+        messages = self.get_messages(channel, data_constructor=data_constructor, timeout_s=timeout_s, count=1)
+        return messages[0] if len(messages) > 0 else None
 
     @staticmethod
     def broadcast(keyvalues: Dict[str, str], redis_obj=None, **redis_kwargs):
@@ -240,6 +500,17 @@ class RedisClientInterface(_RedisStatusInterface):
         doc="Gets `JobEventMessage` from the 'jobs' channel."
     )
 
+    job_event_messages: List[JobEventMessage] = property(
+        fget=lambda self: self.get_messages(
+            f"{self.id.redis_address()}/jobs",
+            data_constructor=lambda data_str: JobEventMessage(**json.loads(data_str)),
+            timeout_s=self.timeout_s
+        ),
+        fset=None,
+        fdel=None,
+        doc="Gets a batch of up to `batch_size` `JobEventMessage`s from the 'jobs' channel."
+    )
+
     context: str = property(
         fget=lambda self: self.__getitem__("#CONTEXT"),
         fset=lambda self, value: self.__setitem__("#CONTEXT", value),
@@ -269,7 +540,7 @@ class RedisClientInterface(_RedisStatusInterface):
     )
 
     status: ServiceStatus = property(
-        fget=lambda self: ServiceStatus(**json.loads(self.__getitem__("STATUS"))),
+        fget=lambda self: ServiceStatus.from_str(self.__getitem__("STATUS")),
         fset=None,
         fdel=None,
         doc="ServiceStatus object."
@@ -296,9 +567,20 @@ class RedisClientInterface(_RedisStatusInterface):
         doc="Publishes `ProcessNoteMessage` under the 'notes' channel."
     )
 
+    process_note_messages: List[ProcessNoteMessage] = property(
+        fget=lambda self: self.get_messages(
+            f"{self.id.redis_address()}/notes",
+            data_constructor=lambda data_str: ProcessNoteMessage(**json.loads(data_str)),
+            timeout_s=self.timeout_s
+        ),
+        fset=None,
+        fdel=None,
+        doc="Gets a batch of up to `batch_size` `ProcessNoteMessage`s from the 'notes' channel."
+    )
+
     process_status: List[ProcessStatus] = property(
         fget=lambda self: [
-            ProcessStatus(**json.loads[self.__getitem__(f"STATUS:{process_id}")])
+            self.read_process_status(process_id)
             for process_id in range(self.status.workers_total_count)
         ],
         fset=None,
@@ -0,0 +1,236 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+import redis
+
+from .dataclasses import JobParameters, QueueOverflowPolicy
+
+# KEYS: queue, jobs; ARGV: member, score, job, limit, overflow policy
+# Returns the dropped job, if any.
+_PUSH_SCRIPT = """
+local limit = tonumber(ARGV[4])
+if limit > 0 and redis.call('ZCARD', KEYS[1]) >= limit then
+    if ARGV[5] == 'drop-newest' then
+        return ARGV[3]
+    end
+    if ARGV[5] == 'drop-oldest' then
+        -- the lowest priority is the highest score, of which the oldest is the first member
+        local lowest = redis.call('ZRANGE', KEYS[1], 0, 0, 'REV', 'WITHSCORES')
+        -- the incoming job is the one dropped if nothing is queued, or its priority is lower still
+        if #lowest == 0 or tonumber(ARGV[2]) > tonumber(lowest[2]) then
+            return ARGV[3]
+        end
+        local oldest = redis.call('ZRANGE', KEYS[1], lowest[2], lowest[2], 'BYSCORE', 'LIMIT', 0, 1)[1]
+        local dropped = redis.call('HGET', KEYS[2], oldest)
+        redis.call('ZREM', KEYS[1], oldest)
+        redis.call('HDEL', KEYS[2], oldest)
+        redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+        redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+        return dropped
+    end
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+return false
+"""
+
+# KEYS: queue, jobs, leases, leased scores; ARGV: now, lease deadline
+# Requeues the jobs of lapsed leases, then leases the first queued job.
+# Returns {member, job, requeued count}, or {false, false, requeued count}.
+_POP_SCRIPT = """
+local lapsed = redis.call('ZRANGE', KEYS[3], '-inf', ARGV[1], 'BYSCORE')
+for _, member in ipairs(lapsed) do
+    redis.call('ZADD', KEYS[1], redis.call('HGET', KEYS[4], member), member)
+    redis.call('ZREM', KEYS[3], member)
+    redis.call('HDEL', KEYS[4], member)
+end
+while true do
+    local popped = redis.call('ZPOPMIN', KEYS[1])
+    if #popped == 0 then
+        return {false, false, #lapsed}
+    end
+    local job = redis.call('HGET', KEYS[2], popped[1])
+    if job then
+        redis.call('ZADD', KEYS[3], ARGV[2], popped[1])
+        redis.call('HSET', KEYS[4], popped[1], popped[2])
+        return {popped[1], job, #lapsed}
+    end
+end
+"""
+
+
+class RedisJobQueue:
+    """
+    A `JobQueue` in Redis, shared by the services of a cluster: each service pushes
+    the jobs of its context and pops jobs while it has free workers.
+
+    The queue is ordered as the `JobQueue` (higher `JobParameters.priority` first, then
+    first-in-first-out) and its `limit` is cluster-wide. The DropNewest, DropOldest and
+    Block overflow policies apply, Redis being where the jobs would be spilled.
+
+    A popped job is leased for `lease_timeout_s`, its lease being renewed in the
+    background until the job is `complete`. The job of a lapsed lease (that of a
+    service that died) is requeued by the next pop of any of the services, so a job
+    is processed at least once.
+
+    The jobs are serialised as JSON (unpickling them would run whatever any client of
+    the Redis server wrote), so the context outputs must be JSON-serialisable and
+    meaningful on every host (e.g. paths on a shared filesystem, rather than
+    `SharedOutput`s). The services number their jobs from a counter of the cluster's
+    (see `next_job_id`), so that job IDs are unique across the cluster.
+    """
+
+    def __init__(
+        self,
+        cluster_name: str,
+        holder: str,
+        limit: int,
+        overflow_policy: QueueOverflowPolicy = QueueOverflowPolicy.DropNewest,
+        lease_timeout_s: float = 60.0,
+        wait_window: int = 100,
+        logger: Optional[logging.Logger] = None,
+        **redis_kwargs
+    ):
+        if overflow_policy == QueueOverflowPolicy.Spill:
+            raise ValueError("The spill overflow policy does not apply to a cluster's queue.")
+
+        self.cluster_name = cluster_name
+        self.holder = holder
+        self.limit = limit
+        self.overflow_policy = overflow_policy
+        self.lease_timeout_s = lease_timeout_s
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+
+        # the members are compared as bytes, so the responses are not decoded
+        redis_kwargs["decode_responses"] = False
+        self.redis_obj = redis.Redis(**redis_kwargs)
+        rh_cluster = f"pypeline:///cluster/{cluster_name}"
+        self.rz_queue = f"{rh_cluster}/queue"
+        self.rh_jobs = f"{rh_cluster}/jobs"
+        self.rz_leases = f"{rh_cluster}/leases"
+        self.rh_leased_scores = f"{rh_cluster}/leased_scores"
+        self.r_job_id = f"{rh_cluster}/job_id"
+        self._push_script = self.redis_obj.register_script(_PUSH_SCRIPT)
+        self._pop_script = self.redis_obj.register_script(_POP_SCRIPT)
+
+        self._sequence = 0
+        self._wait_times_s = deque(maxlen=wait_window)
+        # the members of the leased jobs, by their job IDs
+        self._leased: Dict[int, bytes] = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._renewer = threading.Thread(
+            target=self._renew_leases,
+            name=f"{holder}.leases",
+            daemon=True
+        )
+        self._renewer.start()
+
+    def __len__(self) -> int:
+        return self.redis_obj.zcard(self.rz_queue)
+
+    def full(self) -> bool:
+        return len(self) >= self.limit
+
+    def next_job_id(self) -> int:
+        """The next job ID of the cluster, unique across its services (and their restarts)."""
+        return self.redis_obj.incr(self.r_job_id)
+
+    def admits(self, job_parameters: JobParameters) -> bool:
+        """Whether a push of the job would queue it."""
+        return not (self.overflow_policy == QueueOverflowPolicy.DropNewest and self.full())
+
+    def push(self, job_parameters: JobParameters) -> Optional[JobParameters]:
+        """
+        Returns:
+            JobParameters
+                The job dropped to respect the queue's limit, if any (perhaps that of
+                another service).
+        """
+        self._sequence += 1
+        # members sort by their enqueue time, for first-in-first-out within a priority
+        member = f"{time.time_ns():020d}:{self.holder}:{job_parameters.job_id}:{self._sequence}"
+        dropped = self._push_script(
+            keys=[self.rz_queue, self.rh_jobs],
+            args=[
+                member,
+                -job_parameters.priority,
+                job_parameters.model_dump_json(),
+                self.limit if self.overflow_policy != QueueOverflowPolicy.Block else 0,
+                self.overflow_policy.value,
+            ]
+        )
+        if dropped is None:
+            return None
+        return JobParameters.model_validate_json(dropped)
+
+    def pop(self) -> Optional[JobParameters]:
+        now = time.time()
+        member, job, requeued_count = self._pop_script(
+            keys=[self.rz_queue, self.rh_jobs, self.rz_leases, self.rh_leased_scores],
+            args=[now, now + self.lease_timeout_s]
+        )
+        if requeued_count > 0:
+            self.logger.warning(f"Requeued {requeued_count} job(s) of lapsed leases in cluster '{self.cluster_name}'.")
+        if member is None:
+            return None
+
+        job_parameters = JobParameters.model_validate_json(job)
+        with self._lock:
+            self._leased[job_parameters.job_id] = member
+        self._wait_times_s.append(now - int(member.split(b":", 1)[0])/1e9)
+        return job_parameters
+
+    def complete(self, job_parameters: JobParameters):
+        """Ends the lease of the popped job, removing it from the cluster."""
+        with self._lock:
+            member = self._leased.pop(job_parameters.job_id, None)
+        if member is None:
+            return
+        pipe = self.redis_obj.pipeline(transaction=True)
+        pipe.zrem(self.rz_leases, member)
+        pipe.hdel(self.rh_leased_scores, member)
+        # in case the lease lapsed and the job was requeued
+        pipe.zrem(self.rz_queue, member)
+        pipe.hdel(self.rh_jobs, member)
+        pipe.execute()
+
+    def _renew_leases(self):
+        while not self._closed.wait(self.lease_timeout_s/3):
+            with self._lock:
+                members = list(self._leased.values())
+            if len(members) == 0:
+                continue
+            deadline = time.time() + self.lease_timeout_s
+            try:
+                # only the leases that have not lapsed
+                self.redis_obj.zadd(self.rz_leases, {member: deadline for member in members}, xx=True)
+            except redis.RedisError as err:
+                self.logger.error(f"Could not renew the leases of {len(members)} job(s): {repr(err)}")
+
+    def close(self):
+        self._closed.set()
+
+    def wait_for_space(self, timeout_s: Optional[float] = None) -> bool:
+        """Blocks while the queue of the block overflow policy is full, returning whether there is space."""
+        if self.overflow_policy != QueueOverflowPolicy.Block:
+            return True
+        deadline = None if timeout_s is None else time.time() + timeout_s
+        period_s = 0.01
+        while self.full():
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(
+                period_s if deadline is None else max(0, min(period_s, deadline - time.time()))
+            )
+            period_s = min(period_s*2, 0.5)
+        return True
+
+    def wait_time_statistics(self) -> Tuple[Optional[float], Optional[float]]:
+        """The mean and maximum wait (in seconds) of the jobs recently popped by this service."""
+        if len(self._wait_times_s) == 0:
+            return None, None
+        return sum(self._wait_times_s)/len(self._wait_times_s), max(self._wait_times_s)
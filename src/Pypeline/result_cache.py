@@ -0,0 +1,152 @@
+import os
+import time
+import pickle
+import hashlib
+import logging
+from typing import Any, Optional, Tuple
+
+from .shared_output import SharedOutput, find_shared_outputs
+
+
+def _hash_value(hasher, value):
+    # shared outputs are addressed by their content, not their (per-job) name
+    if isinstance(value, SharedOutput):
+        hasher.update(b"SharedOutput")
+        hasher.update(value.buffer)
+    elif isinstance(value, (list, tuple)):
+        hasher.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            _hash_value(hasher, item)
+    else:
+        hasher.update(pickle.dumps(value))
+
+
+class ResultCache:
+    """
+    A content-addressed, on-disk cache of stage `run()` outputs. Entries are keyed on
+    the stage module's source hash and the `(arg, inp, env)` of the run, and evicted
+    least-recently-used first once older than `max_age_s` or in excess of
+    `max_size_bytes`.
+
+    The directory can be shared by the workers of a service. Each tracks the size of
+    the directory from its last scan (see `evict`) plus that of its own puts, and
+    rescans it once that exceeds `max_size_bytes` or `evict_period_s` after the last
+    scan (to account for the puts of the other workers).
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_size_bytes: int = 1 << 30,
+        max_age_s: float = 7*24*60*60,
+        evict_period_s: float = 60.0,
+        logger: Optional[logging.Logger] = None
+    ):
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        self.max_age_s = max_age_s
+        self.evict_period_s = evict_period_s
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        os.makedirs(self.directory, exist_ok=True)
+
+        # the tracked size of the directory (None until it is scanned), and when to rescan it
+        self._size_bytes: Optional[int] = None
+        self._evict_time = 0.0
+
+    @staticmethod
+    def key(source_hash: str, stage_name: str, arg, inp, env) -> str:
+        hasher = hashlib.sha256()
+        hasher.update(source_hash.encode())
+        hasher.update(stage_name.encode())
+        for value in (arg, inp, env):
+            _hash_value(hasher, value)
+        return hasher.hexdigest()
+
+    def _filepath(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Returns:
+            Tuple[bool, Any]
+                Whether the key was a hit, and the cached outputs if so.
+        """
+        filepath = self._filepath(key)
+        try:
+            # expired entries are not read
+            if time.time() - os.stat(filepath).st_mtime > self.max_age_s:
+                self._remove(filepath)
+                return False, None
+            with open(filepath, "rb") as fio:
+                outputs = pickle.load(fio)
+        except FileNotFoundError:
+            return False, None
+        except BaseException as err:
+            self.logger.warning(f"Discarding unreadable result cache entry {filepath}: {repr(err)}")
+            self._remove(filepath)
+            return False, None
+
+        # the modification time orders the entries for eviction
+        os.utime(filepath)
+        return True, outputs
+
+    def put(self, key: str, outputs):
+        if len(find_shared_outputs(outputs)) > 0:
+            # shared outputs are unlinked when their job finishes
+            self.logger.debug("Not caching outputs that hold SharedOutput handles.")
+            return
+
+        filepath = self._filepath(key)
+        temp_filepath = f"{filepath}.{os.getpid()}.tmp"
+        try:
+            with open(temp_filepath, "wb") as fio:
+                pickle.dump(outputs, fio)
+                size = fio.tell()
+            try:
+                # that of the entry being replaced
+                size -= os.stat(filepath).st_size
+            except FileNotFoundError:
+                pass
+            os.replace(temp_filepath, filepath)
+        except BaseException as err:
+            self.logger.warning(f"Could not cache outputs in {filepath}: {repr(err)}")
+            self._remove(temp_filepath)
+            return
+
+        if self._size_bytes is not None:
+            self._size_bytes += size
+        if (
+            self._size_bytes is None
+            or self._size_bytes > self.max_size_bytes
+            or time.time() >= self._evict_time
+        ):
+            self.evict()
+
+    def evict(self):
+        """Scans the directory, removing the entries that are expired or in excess of the size limit."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".pkl"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        now = time.time()
+        total_size = sum(size for _, size, _ in entries)
+        for mtime, size, filepath in sorted(entries):
+            if now - mtime <= self.max_age_s and total_size <= self.max_size_bytes:
+                break
+            self._remove(filepath)
+            total_size -= size
+        self._size_bytes = total_size
+        self._evict_time = now + self.evict_period_s
+
+    @staticmethod
+    def _remove(filepath: str):
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,541 @@
+import os
+import math
+import time
+import signal
+import logging
+import itertools
+import queue
+import platform
+import threading
+import multiprocessing as mp
+from collections import deque
+from enum import Enum
+from functools import partial
+from typing import Any, List, Optional, Set, Tuple, Union
+from multiprocessing.pool import Pool, ApplyResult
+
+from . import import_module, process_job as PypelineProcess
+from .dataclasses import ServiceIdentifier, ServiceStatus, ProcessState, ProcessNote, JobParameters, JobResult, WorkerEvent
+from .job_queue import JobQueue
+from .shared_output import release_process_shared_outputs
+from .redis_job_queue import RedisJobQueue
+
+
+def _pool_tasks(pool: Pool) -> dict:
+    '''
+    The tasks that the pool awaits, by their `ApplyResult._job`: `Pool` has no API to
+    abandon the task of a worker that was killed (or that exited by itself), so this
+    relies on the internals of CPython's pool (from 3.8), raising should they change.
+    '''
+    tasks = getattr(pool, "_cache", None)
+    if not isinstance(tasks, dict):
+        raise RuntimeError(
+            f"The pool of Python {platform.python_version()} does not keep its tasks in a `_cache`, "
+            "so the tasks of terminated workers cannot be discarded."
+        )
+    return tasks
+
+
+def _discard_pool_task(pool: Pool, async_result: ApplyResult):
+    '''
+    Discards the task of an exited (or killed) worker, which the pool would otherwise
+    await until it is terminated (its `join()` would block). The pool replaces the
+    worker, as it does those that exit after their `maxtasksperchild`.
+    '''
+    job = getattr(async_result, "_job", None)
+    if job is None:
+        raise RuntimeError(
+            f"The pool tasks of Python {platform.python_version()} are not identified by an `ApplyResult._job`, "
+            "so the tasks of terminated workers cannot be discarded."
+        )
+    _pool_tasks(pool).pop(job, None)
+
+
+class ServiceEvent(str, Enum):
+    ProcessComplete = "process complete"
+    ProcessTerminated = "process terminated"
+    SetMessage = "set message"
+    ContextOutput = "context output"
+    ContextRejected = "context rejected"
+    ContextFinished = "context finished"
+
+
+class ServiceScheduler:
+    """Dispatches queued jobs to the worker pool as soon as a worker is free.
+
+    Workers are reaped by the pool's completion callbacks, which also backfill the
+    freed slot from the queue, and an `events` queue wakes the service loop.
+
+    With `warming`, the slots start out `Warming` and are not dispatched to until a
+    worker reports that it has warmed (see `watch_workers`), so that jobs wait in
+    the queue rather than behind the imports of a cold worker. Likewise the slot of
+    a job whose worker retires is `Recycling` until the replacement worker has warmed.
+    A slot is not held for longer than `warm_timeout_s` (see `check_deadlines`), nor
+    for a worker that failed to initialise.
+    A worker that retires by exiting reports the result of its job, which is completed
+    without awaiting the pool.
+
+    The workers report the deadlines of their jobs (see `JobDeadlines`), and the worker
+    of a job that passes its deadline (see `check_deadlines`) or that is cancelled is
+    terminated, its slot being freed without awaiting the pool. The workers mark the
+    jobs that they run in the shared `running_jobs` (see `initialise_worker`), which
+    is checked before a worker is terminated.
+
+    The jobs resumed from this service's checkpoints (see `resume`) are dispatched
+    ahead of the queue, bypassing it, as only this service holds their checkpoints.
+    """
+
+    def __init__(
+        self,
+        pool: Pool,
+        service_id: ServiceIdentifier,
+        workers: int,
+        job_queue: Union[JobQueue, RedisJobQueue],
+        redis_hostname: str,
+        redis_port: int,
+        logger: logging.Logger,
+        warming: bool = False,
+        running_jobs = None,
+        warm_timeout_s: float = 60.0,
+    ):
+        # rather than once a worker is terminated
+        _pool_tasks(pool)
+        self.pool = pool
+        self.service_id = service_id
+        self.job_queue = job_queue
+        self.redis_hostname = redis_hostname
+        self.redis_port = redis_port
+        self.logger = logger
+        # the ID of the job that each slot's worker runs (0 if none), given to the workers
+        self.running_jobs = running_jobs if running_jobs is not None else mp.Array("q", workers)
+
+        self.events = queue.Queue()
+        self.process_asyncobj_jobs: List[Optional[ApplyResult]] = [None]*workers
+        self.process_jobs: List[Optional[JobParameters]] = [None]*workers
+        # per slot: the dispatch that a completion callback must match, and the worker's reports
+        self.process_dispatch_ids: List[Optional[int]] = [None]*workers
+        self.process_pids: List[Optional[int]] = [None]*workers
+        self.process_deadlines: List[Optional[Tuple[float, str]]] = [None]*workers
+        self.process_states = [ProcessState.Warming if warming else ProcessState.Idle]*workers
+        # when each `Warming` or `Recycling` slot started awaiting its worker
+        self.warm_timeout_s = warm_timeout_s
+        self.process_warming_since: List[Optional[float]] = [time.time() if warming else None]*workers
+        self.workers_busy_count = 0
+        # the jobs resumed from checkpoints, which bypass the (perhaps shared) job queue
+        self._resuming = deque()
+        # warmed workers that arrived before the slot of the worker that they replace was recycled
+        self._warmed_surplus_count = 0
+        self._dispatch_sequence = itertools.count()
+        # the IDs of the jobs to cancel once their workers have reported
+        self._cancelling: Set[int] = set()
+        # callbacks arrive on the pool's result-handler thread
+        self._lock = threading.RLock()
+
+    def post(self, event: ServiceEvent, payload: Any = None):
+        self.events.put((event, payload))
+
+    def wait(self, timeout_s: Optional[float] = None) -> List[Tuple[ServiceEvent, Any]]:
+        """Blocks until an event is posted (or the timeout lapses), then returns all pending events."""
+        try:
+            events = [self.events.get(timeout=timeout_s)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def admits(self, job_parameters: JobParameters) -> bool:
+        with self._lock:
+            return self.job_queue.admits(job_parameters)
+
+    def busy(self) -> bool:
+        with self._lock:
+            return (
+                self.workers_busy_count > 0
+                or len(self._resuming) > 0
+                or len(self.job_queue) > 0
+                or not self.events.empty()
+            )
+
+    def snapshot(self) -> Tuple[ServiceStatus, List[ProcessState]]:
+        with self._lock:
+            queue_wait_mean_s, queue_wait_max_s = self.job_queue.wait_time_statistics()
+            return ServiceStatus(
+                workers_busy_count=self.workers_busy_count,
+                workers_total_count=len(self.process_states),
+                jobs_queued_count=len(self._resuming) + len(self.job_queue),
+                queue_wait_mean_s=queue_wait_mean_s,
+                queue_wait_max_s=queue_wait_max_s,
+            ), list(self.process_states)
+
+    def enqueue(self, job_parameters: JobParameters) -> Optional[JobParameters]:
+        """
+        Returns:
+            JobParameters
+                The job dropped by the queue's overflow policy, if any.
+        """
+        with self._lock:
+            dropped = self.job_queue.push(job_parameters)
+            self.dispatch()
+        return dropped
+
+    def resume(self, job_parameters: JobParameters):
+        """Dispatches the job resumed from this service's checkpoint ahead of those of the queue."""
+        with self._lock:
+            self._resuming.append(job_parameters)
+            self.dispatch()
+
+    def dispatch(self):
+        with self._lock:
+            for process_id, process_async_obj in enumerate(self.process_asyncobj_jobs):
+                if process_async_obj is not None or self.process_states[process_id] in [ProcessState.Warming, ProcessState.Recycling]:
+                    continue
+
+                if len(self._resuming) > 0:
+                    job_parameters = self._resuming.popleft()
+                else:
+                    job_parameters = self.job_queue.pop()
+                if job_parameters is None:
+                    break
+                self.logger.info(f"Spawning Process #{process_id}")
+                dispatch_id = next(self._dispatch_sequence)
+                self.process_dispatch_ids[process_id] = dispatch_id
+                self.process_asyncobj_jobs[process_id] = self.pool.apply_async(
+                    PypelineProcess,
+                    (
+                        self.service_id.process_identifier(process_id),
+                        job_parameters,
+                        self.redis_hostname,
+                        self.redis_port
+                    ),
+                    callback=partial(self._on_process_complete, process_id, dispatch_id),
+                    error_callback=partial(self._on_process_error, process_id, dispatch_id),
+                )
+                self.process_jobs[process_id] = job_parameters
+                self.process_states[process_id] = ProcessState.Busy
+                self.workers_busy_count += 1
+
+    def worker_warmed(self):
+        with self._lock:
+            for state in [ProcessState.Warming, ProcessState.Recycling]:
+                if state in self.process_states:
+                    process_id = self.process_states.index(state)
+                    self.process_states[process_id] = ProcessState.Idle
+                    self.process_warming_since[process_id] = None
+                    break
+            else:
+                self._warmed_surplus_count += 1
+                return
+            self.dispatch()
+
+    def watch_workers(self, event_queue) -> threading.Thread:
+        """
+        Starts a daemon thread that handles the events of the workers on the `event_queue`
+        (see `initialise_worker`), until it gets None.
+        """
+        def _watch():
+            while True:
+                event = event_queue.get()
+                if event is None:
+                    return
+                pid, process_id, job_id, worker_event, payload = event
+                if worker_event == WorkerEvent.Warmed:
+                    self.logger.debug(f"Worker {pid} has warmed.")
+                    self.worker_warmed()
+                    continue
+                if worker_event == WorkerEvent.Failed:
+                    # the pool replaces the worker, whose slot is not held for it
+                    self.logger.error(f"Worker {pid} failed to initialise: {payload}")
+                    self.worker_warmed()
+                    continue
+
+                with self._lock:
+                    job_parameters = self.process_jobs[process_id]
+                    if job_parameters is None or job_parameters.job_id != job_id:
+                        # the report of a job that has since completed
+                        continue
+                    if worker_event == WorkerEvent.Retired:
+                        self._retired(process_id, payload)
+                    elif worker_event == WorkerEvent.Ended:
+                        # the worker may be given another job before the pool completes this one
+                        self.process_pids[process_id] = None
+                        self.process_deadlines[process_id] = None
+                    else:
+                        self.process_pids[process_id] = pid
+                        self.process_deadlines[process_id] = payload
+
+        thread = threading.Thread(target=_watch, name=f"{self.service_id}.workers", daemon=True)
+        thread.start()
+        return thread
+
+    def cancel(self, job_ids: List[int]):
+        """Terminates the workers of the jobs, once they have reported that they are running them."""
+        with self._lock:
+            self._cancelling.update(job_ids)
+            self.check_deadlines()
+
+    def next_deadline(self) -> float:
+        with self._lock:
+            return min(
+                [deadline[0] for deadline in self.process_deadlines if deadline is not None]
+                + [
+                    warming_since + self.warm_timeout_s
+                    for warming_since in self.process_warming_since
+                    if warming_since is not None
+                ],
+                default=math.inf
+            )
+
+    def check_deadlines(self):
+        """
+        Terminates the workers of the jobs that are past their deadlines, or that are being
+        cancelled, and stops holding the slots of workers that are yet to warm after `warm_timeout_s`.
+        """
+        now = time.time()
+        with self._lock:
+            warming_timed_out = False
+            for process_id, warming_since in enumerate(self.process_warming_since):
+                if warming_since is not None and warming_since + self.warm_timeout_s <= now:
+                    self.logger.warning(f"Process #{process_id}'s worker has not warmed within {self.warm_timeout_s} s, dispatching to the slot regardless.")
+                    self.process_states[process_id] = ProcessState.Idle
+                    self.process_warming_since[process_id] = None
+                    # a late report of the worker is then surplus
+                    self._warmed_surplus_count += 1
+                    warming_timed_out = True
+            if warming_timed_out:
+                self.dispatch()
+
+            for process_id, deadline in enumerate(self.process_deadlines):
+                if deadline is not None and deadline[0] <= now:
+                    self._terminate(process_id, ProcessNote.Timeout, f"exceeding {deadline[1]}")
+
+            for job_id in list(self._cancelling):
+                process_ids = [
+                    process_id
+                    for process_id, job_parameters in enumerate(self.process_jobs)
+                    if job_parameters is not None and job_parameters.job_id == job_id
+                ]
+                if len(process_ids) == 0:
+                    self.logger.warning(f"Not cancelling job {job_id}: it is not running.")
+                    self._cancelling.discard(job_id)
+                elif self._terminate(process_ids[0], ProcessNote.Cancelled, "cancellation (#CANCEL)"):
+                    self._cancelling.discard(job_id)
+
+    def _terminate(self, process_id: int, process_note: ProcessNote, reason: str) -> bool:
+        """
+        Returns whether the worker of the slot's job was terminated (it must have reported
+        its PID, and still be marked as running the job).
+        """
+        pid = self.process_pids[process_id]
+        if pid is None:
+            return False
+
+        job_parameters = self.process_jobs[process_id]
+        # the worker does not end the job (nor report its events) while the lock is held
+        with self.running_jobs.get_lock():
+            if self.running_jobs[process_id] != job_parameters.job_id:
+                # the job has ended, its completion is on the way
+                return False
+            self.logger.warning(f"Terminating Process #{process_id} (job {job_parameters.job_id}, worker {pid}) for {reason}.")
+            try:
+                # the pool replaces the worker
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            self.running_jobs[process_id] = 0
+        released_count = release_process_shared_outputs(pid)
+        if released_count > 0:
+            self.logger.info(f"Released the {released_count} shared output(s) of Process #{process_id}'s worker.")
+
+        job_result = JobResult(successful=False, worker_retirement=reason)
+        _discard_pool_task(self.pool, self.process_asyncobj_jobs[process_id])
+        self._complete(process_id, job_result)
+        self.post(ServiceEvent.ProcessTerminated, (process_id, job_parameters, process_note, reason))
+        self.post(ServiceEvent.ProcessComplete, (process_id, job_result))
+        return True
+
+    def _retired(self, process_id: int, job_result: JobResult):
+        """Completes the job of a worker that exited by itself after reporting its result."""
+        with self._lock:
+            _discard_pool_task(self.pool, self.process_asyncobj_jobs[process_id])
+            self._complete(process_id, job_result)
+        self.post(ServiceEvent.ProcessComplete, (process_id, job_result))
+
+    def _complete(self, process_id: int, job_result: JobResult):
+        with self._lock:
+            self.logger.info(f"Process #{process_id} has {'completed' if job_result.successful else 'failed'}.")
+
+            self.process_states[process_id] = ProcessState.Finished
+            if not job_result.successful:
+                self.process_states[process_id] = ProcessState.Errored
+            if job_result.worker_retirement is not None:
+                self.logger.info(f"Process #{process_id}'s worker is being recycled after {job_result.worker_retirement}.")
+                if self._warmed_surplus_count > 0:
+                    self._warmed_surplus_count -= 1
+                else:
+                    self.process_states[process_id] = ProcessState.Recycling
+                    self.process_warming_since[process_id] = time.time()
+
+            self.job_queue.complete(self.process_jobs[process_id])
+            self.process_asyncobj_jobs[process_id] = None
+            self.process_jobs[process_id] = None
+            self.process_dispatch_ids[process_id] = None
+            self.process_pids[process_id] = None
+            self.process_deadlines[process_id] = None
+            self.workers_busy_count -= 1
+            self.dispatch()
+
+    def _on_process_complete(self, process_id: int, dispatch_id: int, job_result: JobResult):
+        with self._lock:
+            if self.process_dispatch_ids[process_id] != dispatch_id:
+                # the job's worker was terminated
+                return
+            self._complete(process_id, job_result)
+        self.post(ServiceEvent.ProcessComplete, (process_id, job_result))
+
+    def _on_process_error(self, process_id: int, dispatch_id: int, error: BaseException):
+        # `process_job` is safely wrapped, so this is a failure outside of it (e.g. pickling)
+        self.logger.error(f"Process #{process_id} raised: {repr(error)}")
+        self._on_process_complete(process_id, dispatch_id, JobResult(successful=False))
+
+
+class ContextRunner(threading.Thread):
+    """Calls the context's `run()` on a separate thread, posting its outputs as events.
+
+    The context is swapped between runs when `request()` names a new one. Other threads
+    `call()` the context's methods (e.g. `note()`) through this thread, between runs.
+    """
+
+    def __init__(
+        self,
+        service_id: ServiceIdentifier,
+        context_name: str,
+        context,
+        scheduler: ServiceScheduler,
+        logger: logging.Logger,
+        idle_timeout_s: float = 0.1,
+    ):
+        super().__init__(name=f"{service_id}.context", daemon=True)
+        self.service_id = service_id
+        self.context_name = context_name
+        self.context = context
+        self.scheduler = scheduler
+        self.logger = logger
+        # the wait after `run()` returns None, so that non-blocking contexts are not spun
+        self.idle_timeout_s = idle_timeout_s
+
+        self.requested_context_name = context_name
+        self.context_environment = None
+        self._stop_event = threading.Event()
+        # the calls of the context's methods made by other threads, and whether this thread has finished
+        self._calls = queue.Queue()
+        self._calls_lock = threading.Lock()
+        self._finished = False
+
+    def request(self, context_name: Optional[str], context_environment: Optional[str]):
+        if context_name is not None:
+            self.requested_context_name = context_name
+        self.context_environment = context_environment
+
+    def stop(self):
+        self._stop_event.set()
+
+    def call(self, method_name: str, *args, **kwargs):
+        """
+        Calls the context's method, if it has it, on this thread between runs (the
+        context need not be thread-safe), or on the calling thread once this thread
+        has finished.
+        """
+        with self._calls_lock:
+            if not self._finished:
+                self._calls.put((method_name, args, kwargs))
+                return
+        self._call(method_name, args, kwargs)
+
+    def _call(self, method_name: str, args: tuple, kwargs: dict):
+        method = getattr(self.context, method_name, None)
+        if method is None:
+            return
+        try:
+            method(*args, **kwargs)
+        except BaseException as err:
+            self.logger.error(f"{self.context_name}.{method_name}() raised: {repr(err)}")
+
+    def _make_calls(self):
+        while True:
+            try:
+                method_name, args, kwargs = self._calls.get_nowait()
+            except queue.Empty:
+                return
+            self._call(method_name, args, kwargs)
+
+    def _change_context(self, new_context_name: str):
+        context_dict = {}
+        try:
+            import_module(new_context_name, modulePrefix="context", definition_dict=context_dict, logger=self.logger)
+
+            context = context_dict.pop(new_context_name)
+            context.setup(
+                self.service_id.hostname,
+                self.service_id.enumeration,
+                logger=self.logger
+            )
+        except:
+            self.logger.warning(f"Could not load new Context: `{new_context_name}`. Maintaining current Context: `{self.context_name}`.")
+            self.requested_context_name = self.context_name
+            self.scheduler.post(ServiceEvent.ContextRejected, self.context_name)
+            return
+
+        self.context_name = new_context_name
+        self.context = context
+
+    def run(self):
+        try:
+            self._run()
+        finally:
+            with self._calls_lock:
+                self._make_calls()
+                self._finished = True
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._make_calls()
+            if self.requested_context_name != self.context_name:
+                self._change_context(self.requested_context_name)
+
+            # the block overflow policy holds the context back while the queue is full
+            if not self.scheduler.job_queue.wait_for_space(self.idle_timeout_s):
+                continue
+
+            context_environment = self.context_environment
+            try:
+                context_outputs = self.context.run(
+                    env=context_environment,
+                    logger=self.logger
+                )
+            except BaseException as err:
+                self.logger.error(f"{self.context_name}.run() raised: {repr(err)}")
+                self.scheduler.post(ServiceEvent.ContextFinished, err)
+                return
+
+            if self._stop_event.is_set():
+                return
+            if context_outputs is None:
+                self._stop_event.wait(self.idle_timeout_s)
+                continue
+            if context_outputs is False:
+                self.scheduler.post(ServiceEvent.ContextFinished, None)
+                return
+
+            self.scheduler.post(
+                ServiceEvent.ContextOutput,
+                (
+                    self.context_name,
+                    context_outputs,
+                    self.context.dehydrate(),
+                    context_environment,
+                    self.context.priority(context_outputs) if hasattr(self.context, "priority") else 0
+                )
+            )
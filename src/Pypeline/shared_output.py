@@ -0,0 +1,189 @@
+import os
+import sys
+from typing import Dict, List, Optional
+from multiprocessing import resource_tracker, shared_memory
+import secrets
+
+from pydantic import BaseModel, PrivateAttr
+
+# the handles created by this process that have not been released (and, in a forked
+# worker, those of its parent, see `forget_inherited_shared_outputs`)
+CREATED_SHARED_OUTPUTS: Dict[str, "SharedOutput"] = {}
+# where Linux lists the shared memory, see `release_process_shared_outputs`
+SHARED_MEMORY_DIRECTORY = "/dev/shm"
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Maps the existing shared memory, which this process does not own, so that its
+    resource tracker does not unlink the memory when the process exits.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class SharedOutput(BaseModel):
+    """
+    A handle on an output held in shared memory. It pickles and serialises as its
+    name and layout, so that stages in other threads and workers map the data
+    instead of copying it.
+
+    Outputs created during a job are unlinked when the job finishes, as are
+    those of the context's output that the job receives. The memory is named
+    after the creating process, so that the service can unlink the outputs of
+    a worker that it terminated.
+    """
+    name: str
+    size: int
+    shape: Optional[List[int]] = None
+    dtype: Optional[str] = None
+
+    _shm: Optional[shared_memory.SharedMemory] = PrivateAttr(default=None)
+    _creator_pid: Optional[int] = PrivateAttr(default=None)
+
+    def __reduce__(self):
+        return (SharedOutput.model_validate, (self.model_dump(),))
+
+    @staticmethod
+    def create(size: int, shape: Optional[List[int]] = None, dtype: Optional[str] = None) -> "SharedOutput":
+        shm = shared_memory.SharedMemory(
+            # within the 31 characters of macOS
+            name=f"pypeline_{os.getpid()}_{secrets.token_hex(6)}",
+            create=True,
+            size=max(size, 1)
+        )
+        shared_output = SharedOutput(name=shm.name, size=size, shape=shape, dtype=dtype)
+        shared_output._shm = shm
+        shared_output._creator_pid = os.getpid()
+        CREATED_SHARED_OUTPUTS[shm.name] = shared_output
+        return shared_output
+
+    @staticmethod
+    def from_array(array) -> "SharedOutput":
+        """Copies the array (e.g. a `numpy.ndarray`) into a new shared output."""
+        shared_output = SharedOutput.create(
+            array.nbytes,
+            shape=list(array.shape),
+            dtype=array.dtype.str
+        )
+        shared_output.array()[...] = array
+        return shared_output
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "SharedOutput":
+        shared_output = SharedOutput.create(len(data))
+        shared_output.buffer[:] = data
+        return shared_output
+
+    @property
+    def buffer(self) -> memoryview:
+        if self._shm is None:
+            self._shm = _attach(self.name)
+        return self._shm.buf[0:self.size]
+
+    def array(self):
+        """A `numpy.ndarray` view of the shared memory."""
+        try:
+            import numpy
+        except ImportError as error:
+            raise RuntimeError("SharedOutput.array() requires numpy.") from error
+
+        if self.dtype is None:
+            return numpy.frombuffer(self.buffer, dtype=numpy.uint8)
+        return numpy.ndarray(
+            self.shape,
+            dtype=numpy.dtype(self.dtype),
+            buffer=self.buffer
+        )
+
+    def close(self):
+        """Unmaps the shared memory from this process."""
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:
+                # views are still held, leave the mapping to the garbage collector
+                pass
+            self._shm = None
+
+    def unlink(self):
+        """Unmaps the shared memory and frees it for all processes."""
+        self.close()
+        CREATED_SHARED_OUTPUTS.pop(self.name, None)
+        try:
+            shm = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+
+def find_shared_outputs(value) -> List[SharedOutput]:
+    """The SharedOutput handles within (nested lists, tuples and dicts of) the value."""
+    if isinstance(value, SharedOutput):
+        return [value]
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return [
+            shared_output
+            for item in value
+            for shared_output in find_shared_outputs(item)
+        ]
+    return []
+
+
+def release_shared_outputs(value=None, unlink: bool = True):
+    """
+    Closes, and optionally unlinks, the SharedOutput handles within the value,
+    or all of those created by this process if no value is given.
+    """
+    shared_outputs = (
+        [
+            shared_output
+            for shared_output in CREATED_SHARED_OUTPUTS.values()
+            if shared_output._creator_pid == os.getpid()
+        ]
+        if value is None
+        else find_shared_outputs(value)
+    )
+    for shared_output in shared_outputs:
+        if unlink:
+            shared_output.unlink()
+        else:
+            CREATED_SHARED_OUTPUTS.pop(shared_output.name, None)
+            shared_output.close()
+
+
+def forget_inherited_shared_outputs():
+    """
+    Closes (without unlinking) the handles that a forked process inherited from its
+    parent, which own them (e.g. the context outputs of jobs that the service has
+    yet to dispatch).
+    """
+    for name, shared_output in list(CREATED_SHARED_OUTPUTS.items()):
+        if shared_output._creator_pid != os.getpid():
+            CREATED_SHARED_OUTPUTS.pop(name, None)
+            shared_output.close()
+
+
+def release_process_shared_outputs(pid: int) -> int:
+    """
+    Unlinks the shared memory created by the (terminated) process, which did not
+    release it, returning how many outputs were unlinked. Only Linux lists its
+    shared memory, elsewhere the memory is left.
+    """
+    if not os.path.isdir(SHARED_MEMORY_DIRECTORY):
+        return 0
+    prefix = f"pypeline_{pid}_"
+    names = [
+        name
+        for name in os.listdir(SHARED_MEMORY_DIRECTORY)
+        if name.startswith(prefix)
+    ]
+    for name in names:
+        SharedOutput(name=name, size=0).unlink()
+    return len(names)
@@ -0,0 +1,101 @@
+import sys
+import textwrap
+import importlib
+
+import pytest
+
+import Pypeline
+from Pypeline.dataclasses import JobParameters, JobResult, ProcessIdentifier
+
+# the state of a pool worker, see `initialise_worker`
+WORKER_GLOBALS = [name for name in vars(Pypeline) if name.startswith("WORKER_")]
+
+
+@pytest.fixture
+def worker_globals(monkeypatch):
+    """Restores the worker globals of `Pypeline` once the test has run."""
+    for name in WORKER_GLOBALS:
+        monkeypatch.setattr(Pypeline, name, getattr(Pypeline, name))
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    """A fake Redis server, that the `RedisInterface`s of the test connect to."""
+    fakeredis = pytest.importorskip("fakeredis")
+    from Pypeline import redis_interface
+    server = fakeredis.FakeServer()
+
+    class FakeRedis(fakeredis.FakeRedis):
+        def __init__(self, *args, **kwargs):
+            kwargs.pop("host", None)
+            kwargs.pop("port", None)
+            super().__init__(*args, server=server, **kwargs)
+
+    monkeypatch.setattr(redis_interface.redis, "Redis", FakeRedis)
+    return server
+
+
+CONTEXT_SOURCE = """
+NOTES = []
+
+def setup(*args, **kwargs):
+    pass
+
+def dehydrate():
+    return ()
+
+def rehydrate(dehydrated):
+    pass
+
+def setupstage(stage, logger=None):
+    pass
+
+def note(process_note, **kwargs):
+    NOTES.append(process_note)
+"""
+
+
+@pytest.fixture
+def modules(monkeypatch, tmp_path):
+    """
+    Writes modules (the keyword arguments being their names and sources) on the
+    `sys.path`, forgetting them once the test has run. Returns the imported modules.
+    """
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module_names = []
+
+    def write(**sources):
+        for module_name, source in sources.items():
+            (tmp_path / f"{module_name}.py").write_text(textwrap.dedent(source))
+            module_names.append(module_name)
+        importlib.invalidate_caches()
+        return [importlib.import_module(module_name) for module_name in sources]
+
+    yield write
+    for module_name in module_names:
+        sys.modules.pop(module_name, None)
+        Pypeline.MODULE_CACHE.pop(module_name, None)
+
+
+@pytest.fixture
+def run_job(redis_server, worker_globals, modules):
+    """
+    Runs a job of the `context_test` context as a service's process would, returning
+    its `JobResult`. The context records its process notes in `run_job.context.NOTES`.
+    """
+    context, = modules(context_test=CONTEXT_SOURCE)
+
+    def run(stage_list, redis_kvcache, context_output, **kwargs) -> JobResult:
+        job_parameters = JobParameters(
+            job_id=1,
+            redis_kvcache=redis_kvcache,
+            context_name="test",
+            context_output=context_output,
+            context_dehydrated=(),
+            stage_list=stage_list,
+            **kwargs
+        )
+        return Pypeline.process_job(ProcessIdentifier("host", 0, 0), job_parameters, "localhost", 6379)
+
+    run.context = context
+    return run
@@ -0,0 +1,80 @@
+import time
+
+import Pypeline
+
+ASYNC_STAGE_SOURCE = """
+import asyncio
+import threading
+
+ENV_KEY = None
+ARG_KEY = None
+INP_KEY = "ASYNCFAN_INP"
+CONCURRENCY = 2
+RUNNING = [0]
+PEAK = [0]
+THREADS = set()
+
+async def run(arg, inp, env, logger=None):
+    THREADS.add(threading.current_thread().name)
+    RUNNING[0] += 1
+    PEAK[0] = max(PEAK[0], RUNNING[0])
+    await asyncio.sleep(0.02)
+    RUNNING[0] -= 1
+    if inp[0] == "fail":
+        raise ValueError("failed")
+    return [inp[0]]
+"""
+
+COLLECTING_STAGE_SOURCE = """
+ENV_KEY = None
+ARG_KEY = None
+INP_KEY = "ASYNCCOLLECT_INP"
+INPUTS = []
+
+def run(arg, inp, env, logger=None):
+    INPUTS.append(inp[0])
+    return []
+"""
+
+
+def test_async_stages_run_on_the_worker_event_loop(run_job, modules):
+    async_stage, collecting = modules(stage_asyncfan=ASYNC_STAGE_SOURCE, stage_asynccollect=COLLECTING_STAGE_SOURCE)
+    job_result = run_job(
+        ["asyncfan", "asynccollect"],
+        {"ASYNCFAN_INP": "test", "ASYNCCOLLECT_INP": "asyncfan"},
+        list(range(6))
+    )
+    assert job_result.successful
+    assert async_stage.THREADS == {"pypeline.event_loop"}
+    # at most CONCURRENCY of the permutations run at once
+    assert async_stage.PEAK[0] == 2
+    assert collecting.INPUTS == list(range(6))
+    assert len(job_result.status.stage_timestamps) == 12
+
+
+def test_a_failing_async_permutation_fails_the_job(run_job, modules):
+    async_stage, collecting = modules(stage_asyncfan=ASYNC_STAGE_SOURCE, stage_asynccollect=COLLECTING_STAGE_SOURCE)
+    job_result = run_job(
+        ["asyncfan", "asynccollect"],
+        {"ASYNCFAN_INP": "test", "ASYNCCOLLECT_INP": "asyncfan"},
+        ["fail", 1]
+    )
+    assert not job_result.successful
+    assert collecting.INPUTS == []
+
+
+def test_the_event_loop_is_reused_until_the_process_forks(worker_globals, monkeypatch):
+    loop = Pypeline.worker_event_loop()
+    assert Pypeline.worker_event_loop() is loop
+
+    # as in a forked worker, where the loop's thread is not running
+    monkeypatch.setattr(Pypeline, "WORKER_EVENT_LOOP_PID", -1)
+    forked_loop = Pypeline.worker_event_loop()
+    assert forked_loop is not loop
+    assert Pypeline.worker_event_loop() is forked_loop
+
+    deadline = time.time() + 5
+    while not forked_loop.is_running():
+        assert time.time() < deadline
+        time.sleep(0.01)
+    forked_loop.call_soon_threadsafe(forked_loop.stop)
@@ -0,0 +1,118 @@
+from types import SimpleNamespace
+import logging
+
+import pytest
+
+from Pypeline import batch_stage
+
+BATCH_STAGE_SOURCE = """
+import time
+
+ENV_KEY = None
+ARG_KEY = None
+INP_KEY = "BATCHFAN_INP"
+BATCH = True
+RUNS = []
+
+def run(args, inps, env, logger=None):
+    RUNS.append((list(args), [list(inp) for inp in inps]))
+    time.sleep(0.04)
+    if inps[0][0] == "short":
+        return [[]]
+    return [[inp[0]*10] for inp in inps]
+"""
+
+ASYNC_BATCH_STAGE_SOURCE = """
+import asyncio
+import threading
+
+ENV_KEY = None
+ARG_KEY = None
+INP_KEY = "BATCHFAN_INP"
+BATCH = True
+RUNS = []
+THREADS = set()
+
+async def run(args, inps, env, logger=None):
+    THREADS.add(threading.current_thread().name)
+    RUNS.append([list(inp) for inp in inps])
+    await asyncio.sleep(0.01)
+    return [[inp[0]*10] for inp in inps]
+"""
+
+COLLECTING_STAGE_SOURCE = """
+ENV_KEY = None
+ARG_KEY = None
+INP_KEY = "BATCHCOLLECT_INP"
+INPUTS = []
+
+def run(arg, inp, env, logger=None):
+    INPUTS.append(list(inp))
+    return []
+"""
+
+
+def _run_batch_job(run_job, context_output):
+    return run_job(
+        ["batchfan", "batchcollect"],
+        {"BATCHFAN_INP": "test", "BATCHCOLLECT_INP": "batchfan"},
+        context_output
+    )
+
+
+def test_permutations_are_run_together(run_job, modules):
+    batched, collecting = modules(stage_batchfan=BATCH_STAGE_SOURCE, stage_batchcollect=COLLECTING_STAGE_SOURCE)
+    job_result = _run_batch_job(run_job, [0, 1, 2])
+    assert job_result.successful
+    assert batched.RUNS == [([None, None, None], [[0], [1], [2]])]
+    # each permutation's outputs are handed on as if it had been run on its own
+    assert collecting.INPUTS == [[0], [10], [20]]
+
+
+def test_the_run_duration_is_apportioned_to_the_permutations(run_job, modules):
+    modules(stage_batchfan=BATCH_STAGE_SOURCE, stage_batchcollect=COLLECTING_STAGE_SOURCE)
+    job_result = _run_batch_job(run_job, [0, 1, 2, 3])
+    assert job_result.successful
+
+    timestamps = [
+        timestamp
+        for timestamp in job_result.status.stage_timestamps
+        if timestamp.name == "batchfan"
+    ]
+    assert len(timestamps) == 4
+    durations = [timestamp.end - timestamp.start for timestamp in timestamps]
+    assert durations == pytest.approx([durations[0]]*4, abs=1e-5)
+    assert sum(durations) >= 0.04
+    # the apportioned timestamps are contiguous
+    for previous, timestamp in zip(timestamps, timestamps[1:]):
+        assert timestamp.start == pytest.approx(previous.end, abs=1e-5)
+
+
+def test_a_mismatched_output_count_fails_the_job(run_job, modules):
+    batched, collecting = modules(stage_batchfan=BATCH_STAGE_SOURCE, stage_batchcollect=COLLECTING_STAGE_SOURCE)
+    job_result = _run_batch_job(run_job, ["short", 1])
+    assert not job_result.successful
+    assert len(batched.RUNS) == 1
+    assert collecting.INPUTS == []
+
+
+def test_a_mismatched_output_count_fails_every_permutation():
+    stage = SimpleNamespace(BATCH=True, run=lambda args, inps, env, logger=None: [[1]])
+    fanout = batch_stage(
+        [(None, [0], None), (None, [1], None)],
+        stage,
+        logging.getLogger(__name__)
+    )
+    assert len(fanout) == 2
+    for _, _, _, future in fanout:
+        with pytest.raises(ValueError, match="1 output lists for 2 permutations"):
+            future.result()
+
+
+def test_async_batch_stages_run_on_the_worker_event_loop(run_job, modules):
+    batched, collecting = modules(stage_batchfan=ASYNC_BATCH_STAGE_SOURCE, stage_batchcollect=COLLECTING_STAGE_SOURCE)
+    job_result = _run_batch_job(run_job, [0, 1])
+    assert job_result.successful
+    assert batched.THREADS == {"pypeline.event_loop"}
+    assert batched.RUNS == [[[0], [1]]]
+    assert collecting.INPUTS == [[0], [10]]
@@ -0,0 +1,94 @@
+import os
+import logging
+
+import pytest
+
+from Pypeline.checkpoint import JobCheckpoints
+from Pypeline.dataclasses import JobParameters, ServiceIdentifier
+from Pypeline.shared_output import SharedOutput
+
+
+@pytest.fixture
+def checkpoints(tmp_path):
+    return JobCheckpoints(str(tmp_path), ServiceIdentifier(hostname="host", enumeration=0), logging.getLogger(__name__))
+
+
+def _job(job_id: int) -> JobParameters:
+    return JobParameters(
+        job_id=job_id,
+        redis_kvcache={},
+        context_name="context",
+        context_output=["output"],
+        context_dehydrated={},
+        stage_list=["a", "b"],
+    )
+
+
+def _record(stage_index: int, stage_name: str, output: str) -> dict:
+    return {
+        "stage_index": stage_index,
+        "argindices": {stage_name: stage_index},
+        "stage_outputs": {stage_name: [output]},
+        "times": [float(stage_index)],
+    }
+
+
+def test_load_merges_the_records(checkpoints):
+    job = _job(1)
+    assert checkpoints.load(job.job_id) is None
+    assert checkpoints.append(job, _record(0, "a", "a0"))
+    assert checkpoints.append(job, _record(1, "b", "b0"))
+    assert checkpoints.append(job, _record(2, "a", "a1"))
+
+    assert checkpoints.load(job.job_id) == {
+        "stage_index": 2,
+        "argindices": {"a": 2, "b": 1},
+        "stage_outputs": {"a": ["a1"], "b": ["b0"]},
+        "times": [0.0, 1.0, 2.0],
+    }
+
+
+def test_append_only_writes_the_record(checkpoints):
+    job = _job(1)
+    checkpoints.append(job, _record(0, "a", "x"*1000))
+    filepath = checkpoints._filepath(job.job_id)
+    sizes = [os.path.getsize(filepath)]
+    for _ in range(10):
+        checkpoints.append(job, _record(0, "a", "x"*1000))
+        sizes.append(os.path.getsize(filepath))
+
+    growths = {after - before for before, after in zip(sizes, sizes[1:])}
+    assert len(growths) == 1 and growths.pop() < sizes[0]
+
+
+def test_load_truncates_a_torn_record(checkpoints):
+    job = _job(1)
+    checkpoints.append(job, _record(0, "a", "a0"))
+    filepath = checkpoints._filepath(job.job_id)
+    intact_size = os.path.getsize(filepath)
+    checkpoints.append(job, _record(1, "b", "b0"))
+    with open(filepath, "r+b") as fio:
+        fio.truncate(os.path.getsize(filepath) - 3)
+
+    assert checkpoints.load(job.job_id)["stage_index"] == 0
+    assert os.path.getsize(filepath) == intact_size
+
+    # the records of the resumed job follow the intact ones
+    checkpoints.append(job, _record(1, "b", "b1"))
+    assert checkpoints.load(job.job_id)["stage_outputs"] == {"a": ["a0"], "b": ["b1"]}
+
+
+def test_unfinished_lists_the_jobs_to_resume(checkpoints):
+    for job_id in [3, 1]:
+        checkpoints.append(_job(job_id), _record(0, "a", "a0"))
+    checkpoints.discard(3)
+
+    unfinished = checkpoints.unfinished()
+    assert [job.job_id for job in unfinished] == [1]
+    assert unfinished[0].resume
+
+
+def test_shared_outputs_are_not_checkpointed(checkpoints):
+    shared_output = SharedOutput(name="pypeline_test", size=1)
+    assert not checkpoints.append(_job(1), {"stage_outputs": {"a": [shared_output]}})
+    assert checkpoints.load(1) is None
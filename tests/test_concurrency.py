@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+
+from Pypeline import stage_fans_out
+
+CONCURRENT_STAGE_SOURCE = """
+import time
+import threading
+
+ENV_KEY = None
+ARG_KEY = None
+INP_KEY = "CCFAN_INP"
+CONCURRENCY = 4
+LOCK = threading.Lock()
+RUNNING = [0]
+PEAK = [0]
+
+def run(arg, inp, env, logger=None):
+    with LOCK:
+        RUNNING[0] += 1
+        PEAK[0] = max(PEAK[0], RUNNING[0])
+    # the later permutations finish first
+    time.sleep(0.05*(4 - inp[0]) if isinstance(inp[0], int) else 0)
+    with LOCK:
+        RUNNING[0] -= 1
+    if inp[0] == "fail":
+        raise ValueError("failed")
+    return [inp[0]*10]
+"""
+
+COLLECTING_STAGE_SOURCE = """
+ENV_KEY = None
+ARG_KEY = None
+INP_KEY = "CCCOLLECT_INP"
+INPUTS = []
+
+def run(arg, inp, env, logger=None):
+    INPUTS.append(list(inp))
+    return []
+"""
+
+
+def test_only_concurrent_async_and_batch_stages_fan_out():
+    assert stage_fans_out(SimpleNamespace(CONCURRENCY=2), "stage")
+    assert stage_fans_out(SimpleNamespace(BATCH=True), "stage")
+    assert not stage_fans_out(SimpleNamespace(CONCURRENCY=1), "stage")
+    assert not stage_fans_out(SimpleNamespace(), "stage")
+    # detached stages await their processes one permutation at a time
+    assert not stage_fans_out(SimpleNamespace(CONCURRENCY=2), "stage&")
+
+
+def test_permutations_run_concurrently_and_keep_their_order(run_job, modules):
+    fanned, collecting = modules(stage_ccfan=CONCURRENT_STAGE_SOURCE, stage_cccollect=COLLECTING_STAGE_SOURCE)
+    job_result = run_job(
+        ["ccfan", "cccollect"],
+        {"CCFAN_INP": "test", "CCCOLLECT_INP": "*ccfan"},
+        [0, 1, 2, 3]
+    )
+    assert job_result.successful
+    assert fanned.PEAK[0] > 1
+    # the later stages are run in the order of the permutations, rather than of their completion
+    assert collecting.INPUTS == [[0], [10], [20], [30]]
+
+    timestamps = job_result.status.stage_timestamps
+    assert [timestamp.name for timestamp in timestamps] == ["ccfan", "cccollect"]*4
+    assert all(timestamp.end is not None for timestamp in timestamps)
+    # the timestamps are those of the concurrent runs
+    assert timestamps[2].start < timestamps[0].end
+
+
+def test_a_failing_permutation_fails_the_job(run_job, modules):
+    fanned, collecting = modules(stage_ccfan=CONCURRENT_STAGE_SOURCE, stage_cccollect=COLLECTING_STAGE_SOURCE)
+    job_result = run_job(
+        ["ccfan", "cccollect"],
+        {"CCFAN_INP": "test", "CCCOLLECT_INP": "*ccfan"},
+        ["fail", 0]
+    )
+    assert not job_result.successful
+    assert collecting.INPUTS == []
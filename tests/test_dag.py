@@ -0,0 +1,92 @@
+import pytest
+
+from Pypeline import plan_stage_dag
+from Pypeline.dataclasses import ProcessNote, StageMode
+
+# records its runs, as (stage name, input)
+STAGE_SOURCE = """
+import time
+
+ENV_KEY = None
+ARG_KEY = None
+INP_KEY = "{name}_INP"
+RUNS = []
+
+def run(arg, inp, env, logger=None):
+    RUNS.append(("{name}", list(inp)))
+    if "fail" in inp:
+        raise ValueError("failed")
+    return ["{name}(" + ",".join(map(str, inp)) + ")"]
+"""
+
+
+def test_independent_stages_branch_from_their_dependency():
+    children, join_dependencies = plan_stage_dag(
+        "context",
+        ["a", "b", "c", "d"],
+        {"a": [None], "b": [("a",)], "c": [("^a", "&verbatim")], "d": [("b",), ("*context",)]},
+    )
+    assert children == {"context": ["a"], "a": ["b", "c"], "b": ["d"], "c": [], "d": []}
+    assert join_dependencies == {}
+
+
+def test_stages_depending_on_separate_branches_join_at_their_common_ancestor():
+    children, join_dependencies = plan_stage_dag(
+        "context",
+        ["a", "b", "c", "d", "e"],
+        {"a": [("context",)], "b": [("a",)], "c": [("a",)], "d": [("b", "c")], "e": [("*d", "context")]},
+    )
+    assert children == {"context": ["a"], "a": ["b", "c", "d"], "b": [], "c": [], "d": ["e"], "e": []}
+    assert join_dependencies == {"d": ["b", "c"]}
+
+
+def test_stages_may_only_depend_on_preceding_stages():
+    with pytest.raises(ValueError):
+        plan_stage_dag("context", ["a", "b"], {"a": [("b",)], "b": [("context",)]})
+
+
+def _stages(modules, *names):
+    return modules(**{
+        f"stage_{name}": STAGE_SOURCE.format(name=name)
+        for name in names
+    })
+
+
+def test_branches_run_for_each_output_and_joins_collect_them(run_job, modules):
+    source, left, right, join = _stages(modules, "dsrc", "dleft", "dright", "djoin")
+    job_result = run_job(
+        ["dsrc", "dleft", "dright", "djoin"],
+        {
+            "dsrc_INP": "test",
+            "dleft_INP": "dsrc",
+            "dright_INP": "dsrc",
+            # the join takes all of one branch's outputs, and the last input of the other
+            "djoin_INP": "*dleft ^dright",
+        },
+        [1, 2],
+        stage_mode=StageMode.DAG,
+    )
+    assert job_result.successful
+
+    assert source.RUNS == [("dsrc", [1]), ("dsrc", [2])]
+    assert sorted(left.RUNS) == [("dleft", ["dsrc(1)"]), ("dleft", ["dsrc(2)"])]
+    assert sorted(right.RUNS) == [("dright", ["dsrc(1)"]), ("dright", ["dsrc(2)"])]
+    assert join.RUNS == [
+        ("djoin", ["dleft(dsrc(1))", "dsrc(1)"]),
+        ("djoin", ["dleft(dsrc(2))", "dsrc(2)"]),
+    ]
+    assert len(job_result.status.stage_timestamps) == 8
+
+
+def test_a_failing_branch_aborts_the_job(run_job, modules):
+    source, failing, sibling, join = _stages(modules, "dfsrc", "dfailing", "dfsibling", "dfjoin")
+    job_result = run_job(
+        ["dfsrc", "dfailing", "dfsibling", "dfjoin"],
+        {"dfsrc_INP": "test", "dfailing_INP": "&fail dfsrc", "dfsibling_INP": "dfsrc", "dfjoin_INP": "dfailing dfsibling"},
+        [1],
+        stage_mode=StageMode.DAG,
+    )
+    assert not job_result.successful
+    assert failing.RUNS == [("dfailing", ["fail", "dfsrc(1)"])]
+    assert join.RUNS == []
+    assert ProcessNote.StageError in run_job.context.NOTES
@@ -0,0 +1,55 @@
+import sys
+import logging
+from subprocess import Popen
+
+from Pypeline.dataclasses import ProcessStatus
+from Pypeline.detached_processes import DetachedProcesses
+
+
+def _sleeper(duration_s: float) -> Popen:
+    return Popen([sys.executable, "-c", f"import time; time.sleep({duration_s})"])
+
+
+def test_capture_tracks_popens_that_reuse_freed_ids():
+    status = ProcessStatus(job_id=1, process_id=0)
+    detached_processes = DetachedProcesses(status, logging.getLogger(__name__))
+    popened = []
+
+    for _ in range(20):
+        # the documented idiom frees the previous (reaped) Popen, whose id() is reused
+        detached_processes.wait("stage&", limit=1)
+        popened.clear()
+        popened.append(_sleeper(0.01))
+        assert detached_processes.capture("stage&", popened, 0.0) == 1
+
+    detached_processes.wait("stage&", limit=1)
+    assert len(status.detached_processes) == 20
+    assert all(detached_status.returncode == 0 for detached_status in status.detached_processes)
+
+
+def test_capture_ignores_reaped_popens_left_in_popened():
+    status = ProcessStatus(job_id=1, process_id=0)
+    detached_processes = DetachedProcesses(status, logging.getLogger(__name__))
+    popened = [_sleeper(0)]
+    assert detached_processes.capture("stage&", popened, 0.0) == 1
+    detached_processes.wait("stage&", limit=1)
+
+    popened.append(_sleeper(0))
+    assert detached_processes.capture("stage&", popened, 0.0) == 1
+    detached_processes.wait("stage&", limit=1)
+    assert len(status.detached_processes) == 2
+
+
+def test_wait_respects_the_limit():
+    status = ProcessStatus(job_id=1, process_id=0)
+    detached_processes = DetachedProcesses(status, logging.getLogger(__name__))
+    popened = []
+    for _ in range(6):
+        detached_processes.wait("stage&", limit=2)
+        assert len(detached_processes.live("stage&")) < 2
+        popened.clear()
+        popened.append(_sleeper(0.05))
+        detached_processes.capture("stage&", popened, 0.0)
+        assert len(detached_processes.live("stage&")) <= 2
+    detached_processes.wait("stage&", limit=1)
+    assert len(status.detached_processes) == 6
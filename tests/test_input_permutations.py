@@ -0,0 +1,98 @@
+import itertools
+
+import pytest
+
+from Pypeline import InputPermutations, parse_input_template
+
+
+def _eager_permutations(input_template_symbols, input_values, limit=None):
+    """The permutations, in the order that `parse_input_template` materialised them before they were lazy."""
+    ret = []
+    value_indices = {symbol: 0 for symbol in input_template_symbols}
+    input_template_symbols_rev = input_template_symbols[::-1]
+    fully_permutated = False
+    while not fully_permutated and (limit is None or len(ret) < limit):
+        inp = []
+        for symbol in input_template_symbols:
+            if symbol[0] == "*":
+                inp.extend(input_values[symbol][value_indices[symbol]])
+            else:
+                inp.append(input_values[symbol][value_indices[symbol]])
+        ret.append(inp)
+
+        for i, symbol in enumerate(input_template_symbols_rev):
+            value_indices[symbol] += 1
+            if value_indices[symbol] == len(input_values[symbol]):
+                value_indices[symbol] = 0
+                if i + 1 == len(input_template_symbols_rev):
+                    fully_permutated = True
+            else:
+                break
+    return ret
+
+
+INPUT_VALUES = {
+    "a": ["a0", "a1", "a2"],
+    "b": ["b0"],
+    "c": ["c0", "c1"],
+    "*d": [["d0", "d1"]],
+    "&v": ["v"],
+}
+
+
+@pytest.mark.parametrize(
+    "input_template_symbols",
+    [
+        ["a"],
+        ["a", "c"],
+        ["c", "a"],
+        ["a", "b", "c"],
+        ["&v", "a", "*d", "c"],
+        ["*d"],
+    ]
+)
+def test_the_order_is_that_of_the_eager_permutations(input_template_symbols):
+    permutations = InputPermutations(input_template_symbols, INPUT_VALUES)
+    eager = _eager_permutations(input_template_symbols, INPUT_VALUES)
+    assert list(permutations) == eager
+    assert len(permutations) == len(eager)
+    assert [permutations[index] for index in range(len(eager))] == eager
+    for start in range(len(eager) + 1):
+        assert list(permutations.iterate(start)) == eager[start:]
+
+
+def test_repeated_symbols_take_the_same_value():
+    permutations = InputPermutations(["a", "c", "a"], INPUT_VALUES)
+    assert list(permutations) == [
+        [a, c, a]
+        for c, a in itertools.product(INPUT_VALUES["c"], INPUT_VALUES["a"])
+    ]
+    # the eager permutations never finished, cycling through the later ones
+    assert list(permutations) == _eager_permutations(["a", "c", "a"], INPUT_VALUES, limit=len(permutations))
+
+
+def test_permutations_are_indexed_without_being_produced():
+    symbols = [f"s{index}" for index in range(9)]
+    permutations = InputPermutations(symbols, {symbol: list(range(10)) for symbol in symbols})
+    assert len(permutations) == 10**9
+    assert permutations[-1] == [9]*9
+    assert permutations[123456789] == [1, 2, 3, 4, 5, 6, 7, 8, 9]
+    assert next(permutations.iterate(987654321)) == [9, 8, 7, 6, 5, 4, 3, 2, 1]
+    with pytest.raises(IndexError):
+        permutations[10**9]
+
+
+def test_input_templates_resolve_their_symbols():
+    outputs = {"context": [1, 2], "stage": ["o0", "o1"]}
+    lastinput = {"stage": ["i0"]}
+    assert list(parse_input_template("stage &verbatim ^stage", outputs, lastinput)) == [
+        ["o0", "verbatim", "i0"],
+        ["o1", "verbatim", "i0"],
+    ]
+    assert list(parse_input_template(("*context", "stage"), outputs, lastinput)) == [[1, 2, "o0"], [1, 2, "o1"]]
+    assert list(parse_input_template(None, outputs, lastinput)) == [[]]
+
+
+def test_input_templates_without_values_are_not_run():
+    assert parse_input_template("missing", {"stage": ["o0"]}, {}) is False
+    assert parse_input_template("stage", {"stage": []}, {}) is False
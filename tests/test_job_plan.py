@@ -0,0 +1,119 @@
+import logging
+import os
+
+import pytest
+
+import Pypeline
+from Pypeline import JobPlan, KeywordTemplate, replace_keywords
+from Pypeline.dataclasses import JobParameters
+
+PLANNED_STAGE_SOURCE = """
+ENV_KEY = "PLANNED_ENV"
+ARG_KEY = "PLANNED_ARG"
+INP_KEY = "PLANNED_INP"
+VERSION = {version}
+
+def run(arg, inp, env, logger=None):
+    return []
+"""
+
+KVCACHE = {
+    "PLANNED_ENV": "env=$inst$",
+    "PLANNED_ARG": "-n $hnme$;-b $beg$",
+    "PLANNED_INP": "test;test planned",
+}
+
+
+@pytest.fixture
+def job_plans(monkeypatch):
+    monkeypatch.setattr(Pypeline, "JOB_PLANS", {})
+    return Pypeline.JOB_PLANS
+
+
+def _job_parameters(redis_kvcache=KVCACHE) -> JobParameters:
+    return JobParameters(
+        job_id=1,
+        redis_kvcache=dict(redis_kvcache),
+        context_name="test",
+        context_output=[],
+        context_dehydrated={},
+        stage_list=["planned"],
+    )
+
+
+def _plan(stage_dict: dict, redis_kvcache=KVCACHE) -> JobPlan:
+    return JobPlan.for_job(_job_parameters(redis_kvcache), stage_dict, logging.getLogger(__name__))
+
+
+def test_the_plan_is_compiled_from_the_stage_keys(modules, job_plans):
+    module, = modules(stage_planned=PLANNED_STAGE_SOURCE.format(version=1))
+    job_plan = _plan({})
+    assert job_plan.stages == {"planned": module}
+    assert job_plan.input_templates == {"planned": [("test",), ("test", "planned")]}
+    assert [arg.string for arg in job_plan.args["planned"]] == ["-n $hnme$", "-b $beg$"]
+    assert job_plan.envvars["planned"].render({"inst": 2}) == "env=2"
+    assert job_plans == {("planned",): job_plan}
+
+
+def test_the_plan_is_reused(modules, job_plans):
+    modules(stage_planned=PLANNED_STAGE_SOURCE.format(version=1))
+    stage_dict = {}
+    job_plan = _plan(stage_dict)
+    assert _plan(stage_dict) is job_plan
+    # the key-values of other stages do not matter
+    assert _plan(stage_dict, {**KVCACHE, "OTHER_INP": "test"}) is job_plan
+
+
+def test_the_plan_is_recompiled_when_a_stage_key_value_changes(modules, job_plans):
+    modules(stage_planned=PLANNED_STAGE_SOURCE.format(version=1))
+    stage_dict = {}
+    job_plan = _plan(stage_dict)
+
+    changed_plan = _plan(stage_dict, {**KVCACHE, "PLANNED_ARG": "-n $hnme$"})
+    assert changed_plan is not job_plan
+    assert [arg.string for arg in changed_plan.args["planned"]] == ["-n $hnme$"]
+    assert job_plans == {("planned",): changed_plan}
+
+
+def test_the_plan_is_recompiled_when_a_stage_is_reloaded(modules, job_plans, tmp_path):
+    module, = modules(stage_planned=PLANNED_STAGE_SOURCE.format(version=1))
+    stage_dict = {}
+    job_plan = _plan(stage_dict)
+    load_count = Pypeline.MODULE_CACHE["stage_planned"].load_count
+
+    module_path = tmp_path / "stage_planned.py"
+    module_path.write_text(PLANNED_STAGE_SOURCE.format(version=2))
+    stat = os.stat(module_path)
+    os.utime(module_path, (stat.st_atime, stat.st_mtime + 1))
+
+    reloaded_plan = _plan(stage_dict)
+    assert Pypeline.MODULE_CACHE["stage_planned"].load_count == load_count + 1
+    assert reloaded_plan is not job_plan
+    # the module is reloaded in place
+    assert reloaded_plan.stages["planned"] is module
+    assert module.VERSION == 2
+    assert _plan(stage_dict) is reloaded_plan
+
+
+def test_keyword_templates_render_every_keyword():
+    template = KeywordTemplate("$stages$ on $inst$ of $inst$ at $beg$", ["inst", "stages", "beg"])
+    assert template.render({"inst": 1, "stages": ["a", "b"]}) == "a b on 1 of 1 at $beg$"
+    assert template.render({"inst": 2, "stages": [], "beg": "now"}) == " on 2 of 2 at now"
+    # the template is not altered by rendering
+    assert template.render({}) == template.string
+
+
+def test_keyword_templates_prefer_the_longest_keyword():
+    template = KeywordTemplate("$ab$ $a$", ["a", "ab"])
+    assert template.render({"a": 1, "ab": 2}) == "2 1"
+
+
+def test_keyword_templates_without_keywords_render_the_string():
+    assert KeywordTemplate("no $keywords$", []).render({"keywords": 1}) == "no $keywords$"
+
+
+def test_keywords_are_replaced_with_custom_delimiters():
+    keyword_dict = {"inst": 3}
+    assert replace_keywords(keyword_dict, "<inst> $inst$", "<", ">") == "3 $inst$"
+    template = KeywordTemplate("-i $inst$", keyword_dict.keys())
+    assert replace_keywords(keyword_dict, template) == "-i 3"
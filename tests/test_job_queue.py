@@ -0,0 +1,120 @@
+import os
+import time
+import threading
+
+import pytest
+
+from Pypeline.dataclasses import JobParameters, QueueOverflowPolicy
+from Pypeline.job_queue import JobQueue
+
+
+def _job(job_id: int, priority: int = 0) -> JobParameters:
+    return JobParameters(
+        job_id=job_id,
+        redis_kvcache={"KEY": "value"},
+        context_name="context",
+        context_output=[job_id],
+        context_dehydrated={},
+        stage_list=["stage"],
+        priority=priority,
+    )
+
+
+def _pop_all(job_queue: JobQueue):
+    job_ids = []
+    while len(job_queue) > 0:
+        job_ids.append(job_queue.pop().job_id)
+    return job_ids
+
+
+def test_pop_orders_by_priority_then_first_in_first_out():
+    job_queue = JobQueue(8)
+    for job_id, priority in [(1, 0), (2, 1), (3, 0), (4, 1), (5, -1)]:
+        assert job_queue.push(_job(job_id, priority)) is None
+
+    assert _pop_all(job_queue) == [2, 4, 1, 3, 5]
+    assert job_queue.pop() is None
+    mean_wait_s, max_wait_s = job_queue.wait_time_statistics()
+    assert 0 <= mean_wait_s <= max_wait_s
+
+
+def test_drop_newest_drops_the_incoming_job():
+    job_queue = JobQueue(2)
+    job_queue.push(_job(1))
+    job_queue.push(_job(2, priority=10))
+    assert not job_queue.admits(_job(3, priority=20))
+    assert job_queue.push(_job(3, priority=20)).job_id == 3
+    assert _pop_all(job_queue) == [2, 1]
+
+
+@pytest.mark.parametrize(
+    "incoming_priority, dropped_job_id, popped_job_ids",
+    [
+        # the oldest of the lowest priority is dropped, including at the incoming job's priority
+        (5, 1, [2, 4, 3]),
+        (0, 1, [2, 3, 4]),
+        # rather than a queued job of a higher priority
+        (-1, 4, [2, 1, 3]),
+    ]
+)
+def test_drop_oldest_drops_the_lowest_priority(incoming_priority, dropped_job_id, popped_job_ids):
+    job_queue = JobQueue(3, QueueOverflowPolicy.DropOldest)
+    for job_id, priority in [(1, 0), (2, 10), (3, 0)]:
+        job_queue.push(_job(job_id, priority))
+
+    assert job_queue.admits(_job(4, incoming_priority))
+    assert job_queue.push(_job(4, incoming_priority)).job_id == dropped_job_id
+    assert _pop_all(job_queue) == popped_job_ids
+
+
+@pytest.mark.parametrize("overflow_policy", [QueueOverflowPolicy.DropNewest, QueueOverflowPolicy.DropOldest])
+def test_a_zero_limit_drops_every_job(overflow_policy):
+    job_queue = JobQueue(0, overflow_policy)
+    assert job_queue.push(_job(1, priority=10)).job_id == 1
+    assert len(job_queue) == 0
+
+
+def test_spilled_jobs_round_trip_in_order(tmp_path):
+    spill_directory = str(tmp_path / "spill")
+    job_queue = JobQueue(1, QueueOverflowPolicy.Spill, spill_directory=spill_directory)
+    for job_id, priority in [(1, 0), (2, 0), (3, 1), (4, 0)]:
+        assert job_queue.push(_job(job_id, priority)) is None
+    assert len(job_queue) == 4
+    assert len(os.listdir(spill_directory)) == 3
+
+    popped = [job_queue.pop() for _ in range(4)]
+    assert [job_parameters.job_id for job_parameters in popped] == [3, 1, 2, 4]
+    assert popped[0] == _job(3, 1)
+    assert os.listdir(spill_directory) == []
+
+
+def test_spill_requires_a_directory_and_removes_stale_jobs(tmp_path):
+    with pytest.raises(ValueError):
+        JobQueue(1, QueueOverflowPolicy.Spill)
+
+    (tmp_path / "job_1_0.pkl").write_bytes(b"stale")
+    JobQueue(1, QueueOverflowPolicy.Spill, spill_directory=str(tmp_path))
+    assert os.listdir(tmp_path) == []
+
+
+def test_block_admits_jobs_and_waits_for_space():
+    job_queue = JobQueue(1, QueueOverflowPolicy.Block)
+    assert job_queue.wait_for_space(0)
+    job_queue.push(_job(1))
+    assert job_queue.push(_job(2)) is None
+    assert len(job_queue) == 2
+
+    assert not job_queue.wait_for_space(0.01)
+    popper = threading.Timer(0.05, lambda: [job_queue.pop(), job_queue.pop()])
+    popper.start()
+    start = time.time()
+    assert job_queue.wait_for_space(5)
+    assert time.time() - start < 5
+    popper.join()
+    assert len(job_queue) == 0
+
+
+def test_other_policies_do_not_wait():
+    job_queue = JobQueue(1)
+    job_queue.push(_job(1))
+    assert job_queue.wait_for_space(0)
@@ -0,0 +1,19 @@
+from Pypeline.dataclasses import JobResult, ProcessStatus, StageTimestamp
+from Pypeline.metrics import ServiceMetrics
+
+
+def test_resumed_jobs_only_observe_the_runs_after_the_resume():
+    metrics = ServiceMetrics()
+    status = ProcessStatus(
+        job_id=1,
+        process_id=0,
+        stage_timestamps=[
+            StageTimestamp(name="first", start=0.0, end=1.0),
+            StageTimestamp(name="second", start=1.0, end=3.0),
+            StageTimestamp(name="second", start=10.0, end=10.5),
+        ],
+        resumed_run_count=2,
+    )
+    metrics.observe_job_result(JobResult(successful=True, status=status))
+    assert set(metrics.stage_durations) == {"second"}
+    assert metrics.stage_durations["second"][1:] == (0.5, 1)
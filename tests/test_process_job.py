@@ -0,0 +1,27 @@
+import os
+
+import Pypeline
+from Pypeline.dataclasses import ProcessNote, ServiceIdentifier
+
+STAGE_SOURCE = """
+ENV_KEY = None
+ARG_KEY = None
+INP_KEY = "{name}_INP"
+
+def run(arg, inp, env, logger=None):
+    return [str(i) for i in inp]
+"""
+
+
+def test_warm_workers_reload_an_edited_context(run_job, modules, tmp_path):
+    modules(stage_pjecho=STAGE_SOURCE.format(name="pjecho"))
+    Pypeline.initialise_worker(ServiceIdentifier(hostname="host", enumeration=0), "localhost", 6379)
+    assert run_job(["pjecho"], {"pjecho_INP": "test"}, [1]).successful
+    assert Pypeline.WORKER_STAGE_DICT["test"].NOTES[0] == ProcessNote.Start
+
+    context_filepath = tmp_path / "context_test.py"
+    context_filepath.write_text(context_filepath.read_text().replace("NOTES.append(process_note)", "NOTES.append(\"reloaded\")"))
+    os.utime(context_filepath, (1000, 1000))
+    assert run_job(["pjecho"], {"pjecho_INP": "test"}, [1]).successful
+    # the reloaded context records its notes afresh
+    assert Pypeline.WORKER_STAGE_DICT["test"].NOTES == ["reloaded"]*4
@@ -0,0 +1,96 @@
+import glob
+import pstats
+import logging
+
+import Pypeline
+from Pypeline.dataclasses import JobParameters, ProcessIdentifier
+from Pypeline.profiling import StageProfiler
+
+IDENTIFIER = ProcessIdentifier("host", 0, 1)
+LOGGER = logging.getLogger(__name__)
+
+PROFILED_STAGE_SOURCE = """
+ENV_KEY = None
+ARG_KEY = None
+INP_KEY = "PROFILED_INP"
+
+def allocate(count):
+    return [str(index) for index in range(count)]
+
+def run(arg, inp, env, logger=None):
+    return [len(allocate(10000))]
+"""
+
+
+class Stage:
+    @staticmethod
+    def run(arg, inp, env, logger=None):
+        return []
+
+
+class AsyncStage:
+    @staticmethod
+    async def run(arg, inp, env, logger=None):
+        return []
+
+
+def _job_parameters(profile_stages, profile_memory=False) -> JobParameters:
+    return JobParameters(
+        job_id=7,
+        redis_kvcache={},
+        context_name="context",
+        context_output=[],
+        context_dehydrated={},
+        stage_list=["a", "b&"],
+        profile_stages=profile_stages,
+        profile_memory=profile_memory,
+    )
+
+
+def _for_stage(job_parameters: JobParameters, stage, stage_name: str, directory: str = "/tmp"):
+    return StageProfiler.for_stage(job_parameters, IDENTIFIER, stage, stage_name, directory, LOGGER)
+
+
+def test_only_the_listed_synchronous_stages_are_profiled():
+    assert _for_stage(_job_parameters([]), Stage, "a") is None
+    assert _for_stage(_job_parameters(["b&"]), Stage, "a") is None
+    assert _for_stage(_job_parameters(["*"]), AsyncStage, "a") is None
+
+    profiler = _for_stage(_job_parameters(["*"]), Stage, "b&")
+    assert profiler.filename_prefix == "profile_host_0.1_job7_b"
+    assert not profiler.memory
+
+
+def test_runs_are_profiled_to_a_file(tmp_path):
+    def allocate():
+        return [str(index) for index in range(10000)]
+
+    profiler = _for_stage(_job_parameters(["a"], profile_memory=True), Stage, "a", directory=str(tmp_path))
+    outputs, stage_profile = profiler.run(lambda: len(allocate()))
+    assert outputs == 10000
+    assert stage_profile.stage_name == "a"
+    assert stage_profile.duration_s > 0
+    assert any("allocate" in function for function in stage_profile.top_functions)
+    assert stage_profile.memory_peak_bytes > 10000
+    assert len(stage_profile.top_allocations) > 0
+
+    stats = pstats.Stats(stage_profile.filepath)
+    assert any(function[2] == "allocate" for function in stats.stats)
+
+
+def test_unwritable_profiles_are_still_summarised(tmp_path):
+    profiler = _for_stage(_job_parameters(["a"]), Stage, "a", directory=str(tmp_path / "missing"))
+    outputs, stage_profile = profiler.run(lambda: "output")
+    assert outputs == "output"
+    assert stage_profile.filepath is None
+    assert stage_profile.memory_peak_bytes is None
+
+
+def test_the_profiled_stages_of_a_job_write_their_profiles(run_job, modules, monkeypatch, tmp_path):
+    modules(stage_profiled=PROFILED_STAGE_SOURCE)
+    profile_directory = tmp_path / "profiles"
+    profile_directory.mkdir()
+    monkeypatch.setattr(Pypeline, "WORKER_PROFILE_DIRECTORY", str(profile_directory))
+    job_result = run_job(["profiled"], {"PROFILED_INP": "test"}, [1, 2], profile_stages=["profiled"])
+    assert job_result.successful
+    assert len(glob.glob(str(profile_directory / "profile_host_0.0_job1_profiled_*.prof"))) == 2
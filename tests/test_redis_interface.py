@@ -0,0 +1,112 @@
+from datetime import datetime
+
+import pytest
+
+from Pypeline.dataclasses import ProcessState, ProcessStatus, ServiceIdentifier, ServiceStatus, StageTimestamp
+from Pypeline.redis_interface import RedisServiceInterface
+
+
+@pytest.fixture
+def interface(redis_server):
+    return RedisServiceInterface(ServiceIdentifier(hostname="host", enumeration=0), subscribe_broadcast=False)
+
+
+@pytest.fixture
+def commands(interface, monkeypatch):
+    """The names of the commands of each round trip of the interface's pipelines (within MULTI/EXEC if transactional)."""
+    commands = []
+    pipeline = interface.redis_obj.pipeline
+
+    def _pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def _execute(*args, **kwargs):
+            names = [command[0][0] for command in pipe.command_stack]
+            commands.append(["MULTI"] + names + ["EXEC"] if pipe.transaction else names)
+            return execute(*args, **kwargs)
+
+        pipe.execute = _execute
+        return pipe
+
+    monkeypatch.setattr(interface.redis_obj, "pipeline", _pipeline)
+    return commands
+
+
+def _status(job_id: int = 1) -> ProcessStatus:
+    return ProcessStatus(job_id=job_id, process_id=0)
+
+
+def test_process_statuses_are_written_incrementally(interface, commands):
+    status = _status()
+    interface.write_process_status(status)
+    assert commands == [["DEL", "HSET"]]
+
+    status.stage_timestamps.append(StageTimestamp(name="a", start=1.0, end=None))
+    interface.write_process_status(status)
+    assert commands[-1] == ["RPUSH", "HSET"]
+
+    # only the unfinished stage timestamp is rewritten, once it has changed
+    status.stage_timestamps[0].end = 2.0
+    status.stage_timestamps.append(StageTimestamp(name="b", start=2.0, end=3.0))
+    interface.write_process_status(status)
+    assert commands[-1] == ["LSET", "RPUSH", "HSET"]
+    interface.write_process_status(status)
+    assert len(commands) == 3
+
+    status.result_cache_hits += 1
+    interface.write_process_status(status)
+    assert commands[-1] == ["HSET"]
+    assert interface.read_process_status(0).model_dump() == status.model_dump()
+
+
+def test_the_status_of_another_run_rewrites_the_stage_timestamps(interface):
+    status = _status()
+    status.stage_timestamps.append(StageTimestamp(name="a", start=1.0, end=None))
+    interface.write_process_status(status)
+
+    # such as the run of a resubmitted job, even if it has the `id()` of the previous status
+    rerun_status = _status()
+    rerun_status.stage_timestamps.append(StageTimestamp(name="b", start=5.0, end=6.0))
+    interface.write_process_status(rerun_status)
+    assert interface.read_process_status(0).stage_timestamps == rerun_status.stage_timestamps
+
+
+def _tick(interface, busy_count: int = 0, **kwargs):
+    return interface.tick(
+        ServiceStatus(workers_busy_count=busy_count, workers_total_count=2, jobs_queued_count=0),
+        [ProcessState.Idle, ProcessState.Idle],
+        **kwargs
+    )
+
+
+def test_ticks_write_the_service_fields_only_on_change_or_pulse(interface, commands):
+    _tick(interface)
+    assert commands == [["MULTI", "HSET", "HMGET", "HDEL", "EXEC"]]
+    assert interface["STATUS"] == "0/2 (0 queued)"
+    assert "host:0.1" in interface["PROCESSES"]
+
+    _tick(interface)
+    assert commands[-1] == ["MULTI", "HMGET", "HDEL", "EXEC"]
+
+    interface.redis_obj.hset(interface.rh_status, "PROCESSES", "cleared")
+    _tick(interface, busy_count=1)
+    assert commands[-1] == ["MULTI", "HSET", "HMGET", "HDEL", "EXEC"]
+    assert interface["STATUS"] == "1/2 (0 queued)"
+    assert interface["PROCESSES"] == "cleared"
+
+    # the pulse rewrites all of the fields
+    _tick(interface, busy_count=1, pulse=datetime(2024, 1, 2, 3, 4, 5))
+    assert interface["PULSE"] == "2024/01/02 03:04:05"
+    assert "host:0.1" in interface["PROCESSES"]
+
+
+def test_ticks_read_the_keys_and_take_the_cancellations(interface, commands):
+    interface.context = "context"
+    interface.set("#STAGES", "a b")
+    interface.set("#CANCEL", "1 2")
+    values = _tick(interface)
+    assert values == {"#CONTEXT": "context", "#CONTEXTENV": None, "#STAGES": "a b", "#CANCEL": "1 2"}
+
+    assert _tick(interface)["#CANCEL"] is None
+    assert interface.get("#STAGES") == "a b"
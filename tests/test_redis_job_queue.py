@@ -0,0 +1,98 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from Pypeline import redis_job_queue
+from Pypeline.dataclasses import JobParameters, QueueOverflowPolicy
+from Pypeline.redis_job_queue import RedisJobQueue
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(redis_job_queue.redis, "Redis", fakeredis.FakeRedis)
+    return fakeredis.FakeServer()
+
+
+def _queue(server, holder: str, limit: int = 8, **kwargs) -> RedisJobQueue:
+    job_queue = RedisJobQueue("test", holder, limit, server=server, **kwargs)
+    job_queue.close()
+    return job_queue
+
+
+def _job(job_id: int, priority: int = 0, **kwargs) -> JobParameters:
+    return JobParameters(
+        job_id=job_id,
+        redis_kvcache={"KEY": "value"},
+        context_name="context",
+        context_output=["/shared/output", {"nested": [1, 2.5]}],
+        context_dehydrated={"state": 1},
+        stage_list=["stage"],
+        priority=priority,
+        **kwargs
+    )
+
+
+def test_jobs_round_trip_as_json(server):
+    job_queue = _queue(server, "a")
+    job = _job(1, timeout_s=2.5, stage_timeouts_s={"stage": 1.0}, resume=True)
+    job_queue.push(job)
+
+    member = job_queue.redis_obj.hvals(job_queue.rh_jobs)[0]
+    assert JobParameters.model_validate_json(member) == job
+    assert job_queue.pop() == job
+
+
+def test_pop_orders_by_priority_then_first_in_first_out(server):
+    pushing, popping = _queue(server, "a"), _queue(server, "b")
+    for job_id, priority in [(1, 0), (2, 1), (3, 0), (4, 1)]:
+        pushing.push(_job(job_id, priority))
+
+    assert [popping.pop().job_id for _ in range(4)] == [2, 4, 1, 3]
+    assert popping.pop() is None
+
+
+@pytest.mark.parametrize(
+    "overflow_policy, dropped_job_id, popped_job_ids",
+    [
+        (QueueOverflowPolicy.DropNewest, 3, [1, 2]),
+        (QueueOverflowPolicy.DropOldest, 1, [2, 3]),
+    ]
+)
+def test_push_drops_to_respect_the_limit(server, overflow_policy, dropped_job_id, popped_job_ids):
+    job_queue = _queue(server, "a", limit=2, overflow_policy=overflow_policy)
+    assert job_queue.push(_job(1)) is None
+    assert job_queue.push(_job(2)) is None
+
+    dropped = job_queue.push(_job(3))
+    assert dropped.job_id == dropped_job_id
+    assert [job_queue.pop().job_id for _ in range(2)] == popped_job_ids
+
+
+def test_drop_oldest_drops_an_incoming_job_of_the_lowest_priority(server):
+    job_queue = _queue(server, "a", limit=2, overflow_policy=QueueOverflowPolicy.DropOldest)
+    job_queue.push(_job(1, priority=10))
+    job_queue.push(_job(2, priority=10))
+
+    assert job_queue.push(_job(3, priority=0)).job_id == 3
+    assert job_queue.push(_job(4, priority=10)).job_id == 1
+    assert [job_queue.pop().job_id for _ in range(2)] == [2, 4]
+
+
+def test_lapsed_leases_are_requeued(server):
+    dying, surviving = _queue(server, "a", lease_timeout_s=0.0), _queue(server, "b")
+    dying.push(_job(1))
+    assert dying.pop().job_id == 1
+
+    assert surviving.pop().job_id == 1
+    surviving.complete(_job(1))
+    assert surviving.pop() is None
+    assert surviving.redis_obj.zcard(surviving.rz_leases) == 0
+
+
+def test_job_ids_are_unique_across_the_cluster(server):
+    services = [_queue(server, "a"), _queue(server, "b")]
+    job_ids = [services[i % 2].next_job_id() for i in range(10)]
+    assert sorted(set(job_ids)) == job_ids
+
+    # as is the counter of a restarted service
+    assert _queue(server, "a").next_job_id() > max(job_ids)
@@ -0,0 +1,77 @@
+import os
+import time
+
+import pytest
+
+from Pypeline import result_cache
+from Pypeline.result_cache import ResultCache
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    scans = []
+    scandir = os.scandir
+
+    def _scandir(path):
+        scans.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(result_cache.os, "scandir", _scandir)
+    return scans
+
+
+def _entries(cache: ResultCache):
+    return sorted(name for name in os.listdir(cache.directory) if name.endswith(".pkl"))
+
+
+def test_get_returns_what_was_put(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = ResultCache.key("source", "stage", "arg", ["inp"], None)
+    assert cache.get(key) == (False, None)
+    cache.put(key, ["output"])
+    assert cache.get(key) == (True, ["output"])
+
+
+def test_expired_entries_are_not_read(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path), max_age_s=60)
+    cache.put("key", ["output"])
+    expired_time = time.time() - 120
+    os.utime(cache._filepath("key"), (expired_time, expired_time))
+
+    def _load(fio):
+        raise AssertionError("an expired entry was unpickled")
+
+    monkeypatch.setattr(result_cache.pickle, "load", _load)
+    assert cache.get("key") == (False, None)
+    assert _entries(cache) == []
+
+
+def test_puts_only_rescan_over_the_size_limit(tmp_path, scans):
+    cache = ResultCache(str(tmp_path), max_size_bytes=1 << 20)
+    for index in range(20):
+        cache.put(f"key{index:02d}", [index])
+    assert len(scans) == 1
+
+    cache.put("large", [b"x"*(1 << 20)])
+    assert len(scans) == 2
+
+
+def test_puts_rescan_periodically(tmp_path, scans):
+    cache = ResultCache(str(tmp_path), evict_period_s=0)
+    for index in range(3):
+        cache.put(f"key{index}", [index])
+    assert len(scans) == 3
+
+
+def test_the_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path), max_size_bytes=3500)
+    for index in range(3):
+        cache.put(f"key{index}", [b"x"*1000])
+        modified_time = time.time() - 10 + index
+        os.utime(cache._filepath(f"key{index}"), (modified_time, modified_time))
+    # a hit makes key0 the most recently used
+    assert cache.get("key0")[0]
+
+    cache.put("key3", [b"x"*1000])
+    assert _entries(cache) == ["key0.pkl", "key2.pkl", "key3.pkl"]
+    assert cache._size_bytes == sum(os.path.getsize(cache._filepath(key)) for key in ["key0", "key2", "key3"])
@@ -0,0 +1,419 @@
+import os
+import time
+import queue
+import logging
+import itertools
+import threading
+from multiprocessing import shared_memory
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from Pypeline.dataclasses import JobParameters, JobResult, ProcessState, ServiceIdentifier, WorkerEvent
+from Pypeline.job_queue import JobQueue
+from Pypeline.scheduler import ContextRunner, ServiceEvent, ServiceScheduler, _discard_pool_task
+from Pypeline.shared_output import SHARED_MEMORY_DIRECTORY
+
+
+class FakeResult:
+    def __init__(self, job: int):
+        self._job = job
+
+    def ready(self) -> bool:
+        return False
+
+
+class FakePool:
+    """Records the jobs applied to it, which the tests complete through their callbacks."""
+
+    def __init__(self):
+        self.applied = []
+        self._cache = {}
+        self._jobs = itertools.count()
+
+    def apply_async(self, func, args, callback=None, error_callback=None):
+        self.applied.append((args[1], callback))
+        result = FakeResult(next(self._jobs))
+        self._cache[result._job] = result
+        return result
+
+    def complete(self, index: int = -1, successful: bool = True):
+        job_parameters, callback = self.applied[index]
+        self._cache.popitem()
+        callback(JobResult(successful=successful))
+
+
+def _job(job_id: int, **kwargs) -> JobParameters:
+    return JobParameters(
+        job_id=job_id,
+        redis_kvcache={},
+        context_name="context",
+        context_output=[],
+        context_dehydrated={},
+        stage_list=["stage"],
+        **kwargs
+    )
+
+
+def _scheduler(pool: FakePool, job_queue, workers: int = 1) -> ServiceScheduler:
+    return ServiceScheduler(
+        pool,
+        ServiceIdentifier(hostname="host", enumeration=0),
+        workers,
+        job_queue,
+        "localhost",
+        6379,
+        logging.getLogger(__name__),
+    )
+
+
+def test_resumed_jobs_are_dispatched_ahead_of_the_queue():
+    pool = FakePool()
+    scheduler = _scheduler(pool, JobQueue(8))
+    scheduler.enqueue(_job(1))
+    scheduler.enqueue(_job(2, priority=5))
+    scheduler.resume(_job(3, resume=True))
+    assert scheduler.snapshot()[0].jobs_queued_count == 2
+
+    pool.complete()
+    pool.complete()
+    pool.complete()
+    assert [job_parameters.job_id for job_parameters, _ in pool.applied] == [1, 3, 2]
+    assert len(scheduler.wait(0)) == 3
+    assert not scheduler.busy()
+
+
+def test_resumed_jobs_bypass_the_cluster_queue(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    from Pypeline import redis_job_queue
+    monkeypatch.setattr(redis_job_queue.redis, "Redis", fakeredis.FakeRedis)
+    server = fakeredis.FakeServer()
+    job_queue = redis_job_queue.RedisJobQueue("test", "host:0", 8, server=server)
+    job_queue.close()
+    other_service = redis_job_queue.RedisJobQueue("test", "other:0", 8, server=server)
+    other_service.close()
+
+    pool = FakePool()
+    scheduler = _scheduler(pool, job_queue, workers=0)
+    scheduler.resume(_job(1, resume=True))
+
+    # only this service holds the checkpoint, so the other services cannot pop the job
+    assert other_service.pop() is None
+    assert scheduler.busy()
+
+
+def _await(predicate, timeout_s: float = 5.0):
+    deadline = time.time() + timeout_s
+    while not predicate():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_workers_that_exit_by_themselves_complete_their_jobs():
+    pool = FakePool()
+    scheduler = _scheduler(pool, JobQueue(8), workers=2)
+    event_queue = queue.Queue()
+    scheduler.watch_workers(event_queue)
+    scheduler.enqueue(_job(1))
+    scheduler.enqueue(_job(2))
+
+    job_result = JobResult(successful=True, worker_retirement="a peak RSS of 1.0 MB")
+    # the report of another job (of the slot) is ignored
+    event_queue.put((123, 0, 2, WorkerEvent.Retired, job_result))
+    event_queue.put((123, 0, 1, WorkerEvent.Retired, job_result))
+    _await(lambda: scheduler.process_states[0] == ProcessState.Recycling)
+    assert scheduler.wait(0) == [(ServiceEvent.ProcessComplete, (0, job_result))]
+    # the pool no longer awaits the task of the exited worker
+    assert len(pool._cache) == 1
+
+    # the replacement worker is dispatched to once it has warmed
+    scheduler.enqueue(_job(3))
+    assert len(pool.applied) == 2
+    event_queue.put((456, None, None, WorkerEvent.Warmed, None))
+    _await(lambda: len(pool.applied) == 3)
+    event_queue.put(None)
+
+
+def test_slots_are_not_held_for_workers_that_do_not_warm():
+    pool = FakePool()
+    scheduler = ServiceScheduler(
+        pool,
+        ServiceIdentifier(hostname="host", enumeration=0),
+        2,
+        JobQueue(8),
+        "localhost",
+        6379,
+        logging.getLogger(__name__),
+        warming=True,
+        warm_timeout_s=0.1,
+    )
+    event_queue = queue.Queue()
+    scheduler.watch_workers(event_queue)
+    scheduler.enqueue(_job(1))
+    scheduler.enqueue(_job(2))
+    assert pool.applied == []
+
+    # a worker that failed to initialise frees its slot
+    event_queue.put((123, None, None, WorkerEvent.Failed, "OSError()"))
+    _await(lambda: len(pool.applied) == 1)
+
+    # as does the timeout of one that has yet to warm
+    assert scheduler.next_deadline() <= time.time() + 0.1
+    scheduler.check_deadlines()
+    assert len(pool.applied) == 1
+    time.sleep(0.1)
+    scheduler.check_deadlines()
+    assert len(pool.applied) == 2
+    assert scheduler.next_deadline() == float("inf")
+    event_queue.put(None)
+
+
+@pytest.fixture
+def kills(monkeypatch):
+    kills = []
+    monkeypatch.setattr("Pypeline.scheduler.os.kill", lambda pid, signum: kills.append(pid))
+    return kills
+
+
+def _running_scheduler(pool: FakePool, event_queue: queue.Queue, deadline: float) -> ServiceScheduler:
+    scheduler = _scheduler(pool, JobQueue(8))
+    scheduler.watch_workers(event_queue)
+    scheduler.enqueue(_job(1))
+    # as `initialise_worker` reports the job's deadline
+    scheduler.running_jobs[0] = 1
+    event_queue.put((123, 0, 1, WorkerEvent.Deadline, (deadline, "the job's timeout")))
+    _await(lambda: scheduler.process_pids[0] == 123)
+    return scheduler
+
+
+def test_workers_past_their_deadline_are_terminated(kills):
+    pool = FakePool()
+    event_queue = queue.Queue()
+    scheduler = _running_scheduler(pool, event_queue, time.time() + 0.1)
+    scheduler.check_deadlines()
+    assert kills == []
+
+    # an output of the worker's, which it has yet to release
+    shm = shared_memory.SharedMemory(name="pypeline_123_test", create=True, size=8)
+
+    time.sleep(0.1)
+    scheduler.check_deadlines()
+    assert kills == [123]
+    shm.close()
+    if os.path.isdir(SHARED_MEMORY_DIRECTORY):
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=shm.name)
+    else:
+        shm.unlink()
+    assert [event for event, _ in scheduler.wait(0)] == [ServiceEvent.ProcessTerminated, ServiceEvent.ProcessComplete]
+    assert scheduler.process_states[0] == ProcessState.Recycling
+    # the pool no longer awaits the task of the killed worker
+    assert len(pool._cache) == 0
+    event_queue.put(None)
+
+
+def test_workers_are_not_terminated_once_their_job_has_ended(kills):
+    pool = FakePool()
+    event_queue = queue.Queue()
+    scheduler = _running_scheduler(pool, event_queue, time.time())
+
+    # the worker has ended the job (and may run another), but its report is yet to be handled
+    scheduler.running_jobs[0] = 0
+    scheduler.check_deadlines()
+    scheduler.cancel([1])
+    assert kills == []
+
+    event_queue.put((123, 0, 1, WorkerEvent.Ended, None))
+    _await(lambda: scheduler.process_pids[0] is None)
+    assert scheduler.next_deadline() == float("inf")
+
+    # the job's result then completes it
+    pool.complete()
+    assert scheduler.wait(0) == [(ServiceEvent.ProcessComplete, (0, JobResult(successful=True)))]
+    event_queue.put(None)
+
+
+def test_the_tasks_of_terminated_workers_are_discarded_from_the_pool():
+    # relies on the internals of the Python's pool, which this fails on should they change
+    pool = ThreadPool(1)
+    try:
+        released = threading.Event()
+        async_result = pool.apply_async(released.wait)
+        assert len(pool._cache) == 1
+        _discard_pool_task(pool, async_result)
+        assert len(pool._cache) == 0
+        released.set()
+    finally:
+        pool.close()
+        pool.join()
+
+
+def test_pools_without_the_internals_are_refused():
+    class Pool:
+        pass
+
+    with pytest.raises(RuntimeError):
+        _scheduler(Pool(), JobQueue(8))
+    with pytest.raises(RuntimeError):
+        _discard_pool_task(FakePool(), object())
+
+
+class RecordingContext:
+    """Runs until told to finish, recording the threads that call it."""
+
+    def __init__(self):
+        self.threads = {"run": set(), "note": set()}
+        self.notes = []
+        self.finish = threading.Event()
+
+    def run(self, env=None, logger=None):
+        self.threads["run"].add(threading.get_ident())
+        if self.finish.is_set():
+            return False
+        time.sleep(0.01)
+        return None
+
+    def note(self, process_note, **kwargs):
+        self.threads["note"].add(threading.get_ident())
+        self.notes.append(process_note)
+
+
+def test_context_notes_are_made_on_the_runner_thread():
+    context = RecordingContext()
+    scheduler = _scheduler(FakePool(), JobQueue(8))
+    context_runner = ContextRunner(
+        ServiceIdentifier(hostname="host", enumeration=0),
+        "recording",
+        context,
+        scheduler,
+        logging.getLogger(__name__),
+        idle_timeout_s=0.01
+    )
+    context_runner.call("note", "queued before the start")
+    context_runner.start()
+    context_runner.call("note", "while running")
+    _await(lambda: len(context.notes) == 2)
+    context.finish.set()
+    context_runner.join(5)
+
+    # once the runner has finished, the calls are made directly
+    context_runner.call("note", "after finishing")
+    context_runner.call("missing")
+    assert context.notes == ["queued before the start", "while running", "after finishing"]
+    assert context.threads["note"] - {threading.get_ident()} == context.threads["run"]
+
+
+def test_wait_blocks_until_events_are_posted():
+    scheduler = _scheduler(FakePool(), JobQueue(8))
+    start = time.time()
+    assert scheduler.wait(0.05) == []
+    assert time.time() - start >= 0.05
+
+    poster = threading.Timer(0.05, lambda: [
+        scheduler.post(ServiceEvent.SetMessage, 1),
+        scheduler.post(ServiceEvent.SetMessage, 2),
+    ])
+    poster.start()
+    events = scheduler.wait(5)
+    poster.join()
+    # all of the pending events, in order
+    events += scheduler.wait(0)
+    assert events == [(ServiceEvent.SetMessage, 1), (ServiceEvent.SetMessage, 2)]
+
+
+def test_completions_wake_the_service_and_backfill_the_worker():
+    pool = FakePool()
+    scheduler = _scheduler(pool, JobQueue(8))
+    scheduler.enqueue(_job(1))
+    scheduler.enqueue(_job(2))
+    assert len(pool.applied) == 1
+
+    # the callback arrives on the pool's result-handler thread
+    completer = threading.Thread(target=pool.complete)
+    completer.start()
+    assert scheduler.wait(5) == [(ServiceEvent.ProcessComplete, (0, JobResult(successful=True)))]
+    completer.join()
+    assert [job_parameters.job_id for job_parameters, _ in pool.applied] == [1, 2]
+    assert scheduler.busy()
+
+
+class OutputContext:
+    """Outputs each of its outputs in turn, then finishes (or raises)."""
+
+    def __init__(self, outputs: list, error: BaseException = None):
+        self.outputs = list(outputs)
+        self.error = error
+
+    def run(self, env=None, logger=None):
+        if len(self.outputs) > 0:
+            return self.outputs.pop(0)
+        if self.error is not None:
+            raise self.error
+        return False
+
+    def dehydrate(self):
+        return ("dehydrated",)
+
+    def priority(self, outputs):
+        return len(outputs)
+
+
+def _context_runner(scheduler: ServiceScheduler, context) -> ContextRunner:
+    return ContextRunner(
+        ServiceIdentifier(hostname="host", enumeration=0),
+        "outputs",
+        context,
+        scheduler,
+        logging.getLogger(__name__),
+        idle_timeout_s=0.01
+    )
+
+
+def _events_until(scheduler: ServiceScheduler, event: ServiceEvent) -> list:
+    events = []
+    while len(events) == 0 or events[-1][0] != event:
+        events.extend(scheduler.wait(5))
+    return events
+
+
+def test_context_outputs_are_posted_as_events():
+    scheduler = _scheduler(FakePool(), JobQueue(8))
+    context_runner = _context_runner(scheduler, OutputContext([["a"], None, ["b", "c"]]))
+    context_runner.request(None, "ENV=1")
+    context_runner.start()
+
+    assert _events_until(scheduler, ServiceEvent.ContextFinished) == [
+        (ServiceEvent.ContextOutput, ("outputs", ["a"], ("dehydrated",), "ENV=1", 1)),
+        (ServiceEvent.ContextOutput, ("outputs", ["b", "c"], ("dehydrated",), "ENV=1", 2)),
+        (ServiceEvent.ContextFinished, None),
+    ]
+    context_runner.join(5)
+
+
+def test_a_raising_context_finishes():
+    scheduler = _scheduler(FakePool(), JobQueue(8))
+    error = RuntimeError("context error")
+    context_runner = _context_runner(scheduler, OutputContext([], error=error))
+    context_runner.start()
+    assert _events_until(scheduler, ServiceEvent.ContextFinished) == [(ServiceEvent.ContextFinished, error)]
+    context_runner.join(5)
+
+
+def test_dropped_jobs_are_noted_on_the_runner_thread():
+    from Pypeline.entrypoints import note_dropped_job
+
+    context = RecordingContext()
+    context_runner = ContextRunner(
+        ServiceIdentifier(hostname="host", enumeration=0),
+        "recording",
+        context,
+        _scheduler(FakePool(), JobQueue(8)),
+        logging.getLogger(__name__),
+        idle_timeout_s=0.01
+    )
+    context_runner.start()
+    note_dropped_job(context_runner, 8, logging.getLogger(__name__))
+    _await(lambda: len(context.notes) == 1)
+    context.finish.set()
+    context_runner.join(5)
+    assert context.threads["note"] == context.threads["run"]
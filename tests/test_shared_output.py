@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import subprocess
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import pytest
+
+import Pypeline
+from Pypeline import shared_output as shared_output_module
+from Pypeline.shared_output import (
+    CREATED_SHARED_OUTPUTS,
+    SharedOutput,
+    forget_inherited_shared_outputs,
+    release_process_shared_outputs,
+    release_shared_outputs,
+)
+
+SRC_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(Pypeline.__file__)))
+
+
+def _exists(name: str) -> bool:
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    shm.close()
+    return True
+
+
+def test_buffer_round_trips_the_data():
+    shared_output = SharedOutput.from_bytes(b"pypeline")
+    attached = SharedOutput.model_validate(shared_output.model_dump())
+    try:
+        assert bytes(attached.buffer) == b"pypeline"
+    finally:
+        attached.close()
+        release_shared_outputs()
+    assert not _exists(shared_output.name)
+
+
+def test_attaching_processes_do_not_unlink_the_memory_as_they_exit():
+    shared_output = SharedOutput.from_bytes(b"pypeline")
+    try:
+        # a process with its own resource tracker, as a worker forked before the tracker started
+        completed = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys; from Pypeline.shared_output import SharedOutput; "
+                f"shared_output = SharedOutput(name='{shared_output.name}', size=8); "
+                "sys.stdout.write(bytes(shared_output.buffer).decode()); shared_output.close()",
+            ],
+            env={**os.environ, "PYTHONPATH": SRC_DIRECTORY},
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+        assert completed.stdout == "pypeline"
+        assert "leaked shared_memory" not in completed.stderr
+        # the tracker of the exited process would have unlinked the memory by now
+        time.sleep(0.5)
+        assert _exists(shared_output.name)
+    finally:
+        release_shared_outputs()
+
+
+def _release_in_worker(forget: bool):
+    if forget:
+        forget_inherited_shared_outputs()
+        assert len(CREATED_SHARED_OUTPUTS) == 0
+    release_shared_outputs()
+
+
+@pytest.mark.parametrize("forget", [False, True])
+def test_forked_workers_only_release_their_own_outputs(forget):
+    shared_output = SharedOutput.from_bytes(b"pypeline")
+    try:
+        worker = mp.get_context("fork").Process(target=_release_in_worker, args=(forget,))
+        worker.start()
+        worker.join(30)
+        assert worker.exitcode == 0
+        assert _exists(shared_output.name)
+    finally:
+        release_shared_outputs()
+    assert not _exists(shared_output.name)
+
+
+@pytest.mark.skipif(not os.path.isdir(shared_output_module.SHARED_MEMORY_DIRECTORY), reason="the shared memory is not listed")
+def test_the_outputs_of_a_terminated_process_are_released():
+    # as created by the terminated process, which never released them
+    pid = 2**22 + 1
+    shms = [
+        shared_memory.SharedMemory(name=f"pypeline_{pid}_{index}", create=True, size=8)
+        for index in range(2)
+    ]
+    other = SharedOutput.from_bytes(b"pypeline")
+    try:
+        assert release_process_shared_outputs(pid) == 2
+        assert not any(_exists(shm.name) for shm in shms)
+        assert _exists(other.name)
+    finally:
+        for shm in shms:
+            shm.close()
+        release_shared_outputs()
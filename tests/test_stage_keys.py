@@ -0,0 +1,32 @@
+import os
+import sys
+
+from Pypeline import get_stage_keys
+
+
+def _write_stage(directory, name: str, inp_key: str, mtime: float):
+    filepath = directory / f"stage_{name}.py"
+    filepath.write_text(f"ENV_KEY = None\nARG_KEY = '{name.upper()}_ARG'\nINP_KEY = '{inp_key}'\n")
+    os.utime(filepath, (mtime, mtime))
+
+
+def test_stage_keys_are_cached_until_a_stage_is_reloaded(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    _write_stage(tmp_path, "keysa", "KEYSA_INP", 1000)
+    _write_stage(tmp_path, "keysb", "KEYSB_INP", 1000)
+    definition_dict = {}
+    try:
+        keys = get_stage_keys(["keysa", "keysb", "skip", "missing"], definition_dict=definition_dict)
+        assert keys == ["KEYSA_INP", "KEYSA_ARG", "KEYSB_INP", "KEYSB_ARG"]
+
+        # the cached keys are not changed by the callers
+        keys.append("#CONTEXT")
+        assert get_stage_keys(["keysa", "keysb"], definition_dict=definition_dict) == keys[:-1]
+
+        _write_stage(tmp_path, "keysb", "KEYSB_INPUT", 2000)
+        assert get_stage_keys(["keysa", "keysb"], definition_dict=definition_dict) == [
+            "KEYSA_INP", "KEYSA_ARG", "KEYSB_INPUT", "KEYSB_ARG"
+        ]
+    finally:
+        for name in ["stage_keysa", "stage_keysb"]:
+            sys.modules.pop(name, None)
@@ -0,0 +1,99 @@
+import pytest
+
+from Pypeline.dataclasses import ServiceIdentifier
+from Pypeline.redis_interface import RedisClientInterface, RedisServiceInterface
+
+
+SERVICE_ID = ServiceIdentifier(hostname="host", enumeration=0)
+JOBS_CHANNEL = f"{SERVICE_ID.redis_address()}/jobs"
+JOBS_STREAM = f"pypeline://{JOBS_CHANNEL}"
+
+
+@pytest.fixture
+def service(redis_server):
+    return RedisServiceInterface(SERVICE_ID, subscribe_broadcast=False, message_transport="streams")
+
+
+def _client(**kwargs) -> RedisClientInterface:
+    return RedisClientInterface(SERVICE_ID, message_transport="streams", **kwargs)
+
+
+def _data(messages) -> list:
+    return [message["data"] for message in messages]
+
+
+def _pending_count(service, group: str) -> int:
+    return service.redis_obj.xpending(JOBS_STREAM, group)["pending"]
+
+
+def test_messages_are_appended_to_the_stream(service):
+    service.publish("jobs", "a")
+    assert service.rc_subscriptions == {}
+    assert [fields["data"] for _, fields in service.redis_obj.xrange(JOBS_STREAM)] == ["a"]
+
+
+def test_consumer_group_shares_messages(service):
+    first = _client(consumer_group="group", consumer_name="first", batch_size=2)
+    second = _client(consumer_group="group", consumer_name="second", batch_size=2)
+    for data in "abcd":
+        service.publish("jobs", data)
+
+    # each reads a batch of its own, leaving none for a later read
+    first_data = _data(first.get_messages(JOBS_CHANNEL, timeout_s=0))
+    second_data = _data(second.get_messages(JOBS_CHANNEL, timeout_s=0))
+    assert first_data == ["a", "b"]
+    assert second_data == ["c", "d"]
+    assert first.get_messages(JOBS_CHANNEL, timeout_s=0) == []
+
+
+def test_messages_are_acknowledged_with_the_next_read(service):
+    client = _client(consumer_group="group", consumer_name="only")
+    service.publish("jobs", "a")
+    service.publish("jobs", "b")
+
+    assert client.get_message(JOBS_CHANNEL, timeout_s=0)["data"] == "a"
+    assert _pending_count(service, "group") == 2
+
+    # the other message read is buffered, so got without a read
+    assert client.get_message(JOBS_CHANNEL, timeout_s=0)["data"] == "b"
+    assert _pending_count(service, "group") == 2
+
+    assert client.get_message(JOBS_CHANNEL, timeout_s=0) is None
+    assert _pending_count(service, "group") == 0
+
+
+def test_unacknowledged_messages_are_reread_by_the_consumer(service):
+    client = _client(consumer_group="group", consumer_name="restarted", batch_size=1)
+    service.publish("jobs", "a")
+    service.publish("jobs", "b")
+    assert _data(client.get_messages(JOBS_CHANNEL, timeout_s=0)) == ["a"]
+
+    # a consumer of the same name, as after a restart, is first given what was not acknowledged
+    restarted = _client(consumer_group="group", consumer_name="restarted", batch_size=1)
+    assert _data(restarted.get_messages(JOBS_CHANNEL, timeout_s=0)) == ["a"]
+    assert _data(restarted.get_messages(JOBS_CHANNEL, timeout_s=0)) == ["b"]
+    assert restarted.get_messages(JOBS_CHANNEL, timeout_s=0) == []
+    assert _pending_count(service, "group") == 0
+
+
+def test_messages_are_converted_by_the_data_constructor(service):
+    client = _client(consumer_group="group")
+    service.publish("jobs", "1")
+    service.publish("jobs", "2")
+    assert client.get_messages(JOBS_CHANNEL, data_constructor=int, timeout_s=0) == [1, 2]
+
+
+def test_without_a_group_each_client_reads_the_messages_after_its_creation(service):
+    service.publish("jobs", "before")
+    first = _client()
+    second = _client()
+    service.publish("jobs", "a")
+    service.publish("jobs", "b")
+
+    assert _data(first.get_messages(JOBS_CHANNEL, timeout_s=0)) == ["a", "b"]
+    assert _data(second.get_messages(JOBS_CHANNEL, timeout_s=0, count=1)) == ["a"]
+    assert _data(second.get_messages(JOBS_CHANNEL, timeout_s=0)) == ["b"]
+    assert first.get_messages(JOBS_CHANNEL, timeout_s=0) == []
+
+    service.publish("jobs", "c")
+    assert _data(first.get_messages(JOBS_CHANNEL, timeout_s=0)) == ["c"]
@@ -0,0 +1,75 @@
+import queue
+import logging
+
+import pytest
+
+import Pypeline
+from Pypeline.dataclasses import ServiceIdentifier, WorkerEvent
+from Pypeline.redis_interface import RedisServiceInterface
+
+SERVICE_ID = ServiceIdentifier(hostname="host", enumeration=0)
+
+
+@pytest.fixture
+def service(redis_server, worker_globals, monkeypatch, tmp_path):
+    for name in ["context_warmtest", "stage_warma", "stage_warmb"]:
+        (tmp_path / f"{name}.py").write_text("ENV_KEY = None\nARG_KEY = None\nINP_KEY = None\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    return RedisServiceInterface(SERVICE_ID, subscribe_broadcast=False)
+
+
+def _initialise_worker(**kwargs):
+    event_queue = queue.Queue()
+    Pypeline.initialise_worker(SERVICE_ID, "localhost", 6379, event_queue=event_queue, **kwargs)
+    return event_queue
+
+
+def test_workers_warm_the_current_context_and_stages(service):
+    service.context = "warmtest"
+    service.set("#STAGES", "warma")
+    event_queue = _initialise_worker()
+    assert set(Pypeline.WORKER_STAGE_DICT) == {"warmtest", "warma"}
+    assert event_queue.get_nowait()[3] == WorkerEvent.Warmed
+
+    # the replacement of a retired worker warms the stages of the time
+    service.set("#STAGES", "warmb")
+    _initialise_worker()
+    assert set(Pypeline.WORKER_STAGE_DICT) == {"warmtest", "warmb"}
+
+
+def test_workers_warm_despite_a_missing_stage(service):
+    service.context = "warmtest"
+    service.set("#STAGES", "missing warma")
+    event_queue = _initialise_worker()
+    assert "warma" in Pypeline.WORKER_STAGE_DICT
+    assert event_queue.get_nowait()[3] == WorkerEvent.Warmed
+
+
+def test_the_job_count_limit_is_left_to_the_pool(service):
+    _initialise_worker(max_jobs=2)
+    logger = logging.getLogger(__name__)
+    assert Pypeline._worker_retirement(logger) == (None, False)
+    assert Pypeline._worker_retirement(logger) == ("2 job(s)", False)
+
+
+def test_workers_over_the_rss_limit_exit(service):
+    _initialise_worker(max_rss_mb=0.001)
+    reason, exits = Pypeline._worker_retirement(logging.getLogger(__name__))
+    assert reason.startswith("a peak RSS of") and exits
+
+    # which requires the event queue, on which the job's result is reported
+    Pypeline.initialise_worker(SERVICE_ID, "localhost", 6379, max_rss_mb=0.001)
+    assert Pypeline._worker_retirement(logging.getLogger(__name__)) == (None, False)
+
+
+def test_workers_that_fail_to_initialise_report_it(service, tmp_path):
+    # the checkpoint directory cannot be created under a file
+    (tmp_path / "file").write_text("")
+    event_queue = queue.Queue()
+    with pytest.raises(OSError):
+        Pypeline.initialise_worker(
+            SERVICE_ID, "localhost", 6379, event_queue=event_queue, checkpoint_directory=str(tmp_path / "file" / "checkpoints")
+        )
+    pid, process_id, job_id, worker_event, payload = event_queue.get_nowait()
+    assert worker_event == WorkerEvent.Failed and "Error" in payload
+    assert event_queue.empty()